@@ -1,4 +1,5 @@
 # agents/analyst_agent.py
+import base64
 import json
 import os
 import re
@@ -77,35 +78,105 @@ Numbers should be integers.
             max_tokens=300
         )
 
-        response_text = response.choices[0].message.content.strip()
+        return parse_kbju_response(response.choices[0].message.content.strip(), lang)
 
-        # Attempt to extract JSON from response
-        try:
-            # Search for JSON in response
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group()
-                kbju_data = json.loads(json_str)
+    except Exception as e:
+        print(f"Error calling OpenAI API: {e}")
+
+
+def parse_kbju_response(response_text: str, lang: str = "uk") -> dict:
+    """
+    KBJU dict from a model answer with JSON in it, None when it can't be parsed
+    """
+    try:
+        # Search for JSON in response
+        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+        if json_match:
+            json_str = json_match.group()
+            kbju_data = json.loads(json_str)
+
+            # Check and validate data
+            required_keys = ['calories', 'protein', 'fat', 'carbs']
+            for key in required_keys:
+                if key not in kbju_data:
+                    raise ValueError(f"Missing key: {key}")
+                # Convert to integers
+                kbju_data[key] = int(float(kbju_data[key]))
+
+            # Add analysis if missing
+            if 'analysis' not in kbju_data:
+                kbju_data['analysis'] = "Розрахунок виконано" if lang == "uk" else "Calculation completed"
+
+            return kbju_data
+        else:
+            raise ValueError("No JSON found in response")
 
-                # Check and validate data
-                required_keys = ['calories', 'protein', 'fat', 'carbs']
-                for key in required_keys:
-                    if key not in kbju_data:
-                        raise ValueError(f"Missing key: {key}")
-                    # Convert to integers
-                    kbju_data[key] = int(float(kbju_data[key]))
+    except (json.JSONDecodeError, ValueError) as e:
+        print(f"Error parsing GPT response: {e}")
+        print(f"GPT response: {response_text}")
 
-                # Add analysis if missing
-                if 'analysis' not in kbju_data:
-                    kbju_data['analysis'] = "Розрахунок виконано" if lang == "uk" else "Calculation completed"
 
-                return kbju_data
-            else:
-                raise ValueError("No JSON found in response")
+def estimate_kbju_from_photo(image: bytes, caption: str = "", lang: str = "uk") -> dict:
+    """
+    Estimate KBJU of the meal in a photo (JPEG, already downscaled) using a vision model
+    """
+    if lang == "uk":
+        prompt = f"""
+Ти - професійний дієтолог. Визнач страву на фото та оціни її КБЖУ для всієї порції, яку видно.
+{f"Підпис користувача: {caption}" if caption else ""}
+
+Дай відповідь ТІЛЬКИ в форматі JSON:
+{{
+    "dish": "коротка назва страви українською",
+    "calories": число,
+    "protein": число,
+    "fat": число,
+    "carbs": число,
+    "analysis": "короткий коментар українською"
+}}
 
-        except (json.JSONDecodeError, ValueError) as e:
-            print(f"Error parsing GPT response: {e}")
-            print(f"GPT response: {response_text}")
+Числа мають бути цілими.
+        """
+    else:
+        prompt = f"""
+You are a professional nutritionist. Identify the meal in the photo and estimate KBJU for the whole visible portion.
+{f"User's caption: {caption}" if caption else ""}
+
+Respond ONLY in JSON format:
+{{
+    "dish": "short dish name in English",
+    "calories": number,
+    "protein": number,
+    "fat": number,
+    "carbs": number,
+    "analysis": "brief comment in English"
+}}
+
+Numbers should be integers.
+        """
+
+    try:
+        image_url = "data:image/jpeg;base64," + base64.b64encode(image).decode("ascii")
+        response = client.chat.completions.create(
+            model=os.getenv("VISION_MODEL", "gpt-4o-mini"),
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are a precise nutrition calculator. Always respond with valid JSON only."
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "image_url", "image_url": {"url": image_url, "detail": "low"}}
+                    ]
+                }
+            ],
+            temperature=0.3,
+            max_tokens=300
+        )
+
+        return parse_kbju_response(response.choices[0].message.content.strip(), lang)
 
     except Exception as e:
         print(f"Error calling OpenAI API: {e}")
@@ -335,78 +406,73 @@ def is_meal_description(text: str) -> bool:
     return bool(re.search(r'[а-яёa-z]', text.lower())) and not text.startswith('/')
 
 
-def get_weekly_nutrition_summary(entries_by_date: dict, lang: str = "uk") -> str:
+def get_weekly_nutrition_summary(stats: dict, lang: str = "uk") -> str:
     """
-    Weekly nutrition analysis using GPT
-    """
-    if not entries_by_date:
-        return "Немає даних за тиждень" if lang == "uk" else "No weekly data"
-
-    # Prepare daily data
-    daily_summaries = []
-    total_week_calories = 0
-    total_week_protein = 0
-    total_week_fat = 0
-    total_week_carbs = 0
-
-    for date_str, entries in entries_by_date.items():
-        day_calories = sum(entry.get('calories', 0) for entry in entries)
-        day_protein = sum(entry.get('protein', 0) for entry in entries)
-        day_fat = sum(entry.get('fat', 0) for entry in entries)
-        day_carbs = sum(entry.get('carbs', 0) for entry in entries)
-
-        total_week_calories += day_calories
-        total_week_protein += day_protein
-        total_week_fat += day_fat
-        total_week_carbs += day_carbs
+    Weekly or monthly nutrition analysis using GPT, worded by the period length
 
-        daily_summaries.append(f"{date_str}: {day_calories} ккал, {len(entries)} прийомів")
-
-    avg_daily_calories = total_week_calories // len(entries_by_date) if entries_by_date else 0
-
-    days_text = "\n".join(daily_summaries)
+    stats: nutrition_reports.aggregate_period() result for the period
+    """
+    if not stats or not stats.get("meals"):
+        return "Немає даних за цей період" if lang == "uk" else "No data for this period"
+
+    kcal = "ккал" if lang == "uk" else "kcal"
+    meals = "прийомів" if lang == "uk" else "meals"
+    days_text = "\n".join(f"{day['date']}: {day['calories']} {kcal}, {day['meals']} {meals}" for day in stats["per_day"])
+
+    days = stats["days"]
+    weekly = days <= 7
+    total_calories = stats["totals"]["calories"]
+    total_protein = stats["totals"]["protein"]
+    total_fat = stats["totals"]["fat"]
+    total_carbs = stats["totals"]["carbs"]
+    avg_daily_calories = stats["daily_avg"]["calories"]
+    days_with_data = stats["days_logged"]
 
     if lang == "uk":
+        trends = "Тижневі тенденції" if weekly else "Тенденції за місяць"
+        next_period = "наступний тиждень" if weekly else "наступний місяць"
         prompt = f"""
-Ти - дієтолог. Проаналізуй тижневий раціон харчування клієнта.
+Ти - дієтолог. Проаналізуй раціон харчування клієнта за останні {days} днів.
 
 ДАНІ ПО ДНЯХ:
 {days_text}
 
-ЗАГАЛЬНА СТАТИСТИКА ТИЖНЯ:
-- Загальні калорії за тиждень: {total_week_calories} ккал
+ЗАГАЛЬНА СТАТИСТИКА ЗА {days} ДНІВ:
+- Загальні калорії за {days} днів: {total_calories} ккал
 - Середньодобові калорії: {avg_daily_calories} ккал
-- Загальні білки: {total_week_protein} г
-- Загальні жири: {total_week_fat} г
-- Загальні вуглеводи: {total_week_carbs} г
-- Кількість днів з даними: {len(entries_by_date)}
+- Загальні білки: {total_protein} г
+- Загальні жири: {total_fat} г
+- Загальні вуглеводи: {total_carbs} г
+- Кількість днів з даними: {days_with_data}
 
 Дай аналіз:
-📈 **Тижневі тенденції**
+📈 **{trends}**
 🎯 **Постійність харчування**
-💡 **Рекомендації на наступний тиждень**
+💡 **Рекомендації на {next_period}**
 
 Будь конкретним та практичним.
         """
     else:
+        trends = "Weekly trends" if weekly else "Monthly trends"
+        next_period = "next week" if weekly else "next month"
         prompt = f"""
-You are a nutritionist. Analyze the weekly nutrition intake of a client.
+You are a nutritionist. Analyze the nutrition intake of a client over the last {days} days.
 
 DAILY DATA:
 {days_text}
 
-WEEKLY STATISTICS:
-- Total weekly calories: {total_week_calories} kcal
+STATISTICS FOR {days} DAYS:
+- Total calories over {days} days: {total_calories} kcal
 - Average daily calories: {avg_daily_calories} kcal
-- Total protein: {total_week_protein} g
-- Total fat: {total_week_fat} g
-- Total carbohydrates: {total_week_carbs} g
-- Days with data: {len(entries_by_date)}
+- Total protein: {total_protein} g
+- Total fat: {total_fat} g
+- Total carbohydrates: {total_carbs} g
+- Days with data: {days_with_data}
 
 Provide analysis:
-📈 **Weekly trends**
+📈 **{trends}**
 🎯 **Consistency of nutrition**
-💡 **Recommendations for next week**
+💡 **Recommendations for {next_period}**
 
 Be specific and practical.
         """
@@ -417,7 +483,7 @@ Be specific and practical.
             messages=[
                 {
                     "role": "system",
-                    "content": "You are a nutritionist providing weekly nutrition analysis."
+                    "content": f"You are a nutritionist providing {'weekly' if weekly else 'monthly'} nutrition analysis."
                 },
                 {
                     "role": "user",
@@ -431,22 +497,22 @@ Be specific and practical.
         return response.choices[0].message.content.strip()
 
     except Exception as e:
-        print(f"Error analyzing weekly nutrition: {e}")
+        print(f"Error analyzing {'weekly' if weekly else 'monthly'} nutrition: {e}")
         if lang == "uk":
             return f"""
-📊 **Тижнева статистика:**
+📊 **Статистика за {days} днів:**
 • Середньодобові калорії: {avg_daily_calories} ккал
-• Днів з даними: {len(entries_by_date)}
-• Загальні калорії: {total_week_calories} ккал
+• Днів з даними: {days_with_data}
+• Загальні калорії: {total_calories} ккал
 
 ❌ Помилка при отриманні детального аналізу.
             """
         else:
             return f"""
-📊 **Weekly statistics:**
+📊 **Statistics for {days} days:**
 • Average daily calories: {avg_daily_calories} kcal
-• Days with data: {len(entries_by_date)}
-• Total calories: {total_week_calories} kcal
+• Days with data: {days_with_data}
+• Total calories: {total_calories} kcal
 
 ❌ Error getting detailed analysis.
             """
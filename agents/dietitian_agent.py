@@ -2,6 +2,9 @@ import json
 import os
 from openai import OpenAI
 from dotenv import load_dotenv
+
+from nutrition_formulas import BMI_CATEGORIES, bmi_category, body_mass_index, daily_calories
+
 load_dotenv()
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
@@ -10,22 +13,7 @@ def calculate_daily_calories(age: int, gender: str, weight: float, height: int,
     """
     Calculate daily calorie requirement using Mifflin-St Jeor formula
     """
-    # Basal Metabolic Rate (BMR)
-    if gender == "male":
-        bmr = 10 * weight + 6.25 * height - 5 * age + 5
-    else:  # female
-        bmr = 10 * weight + 6.25 * height - 5 * age - 161
-
-    # Total calorie expenditure considering activity
-    total_calories = bmr * activity_coefficient
-
-    return {
-        "bmr": round(bmr),
-        "total": round(total_calories),
-        "maintain": round(total_calories),
-        "lose": round(total_calories - 300),  # 300 kcal deficit for weight loss
-        "gain": round(total_calories + 300)  # 300 kcal surplus for weight gain
-    }
+    return daily_calories(age, gender, weight, height, activity_coefficient)
 
 
 def get_nutrition_advice(user_profile: dict, lang: str = "uk") -> str:
@@ -138,21 +126,15 @@ Be concise and specific.
     return response.choices[0].message.content.strip()
 
 
-def get_meal_suggestions(user_profile: dict, meal_type: str, lang: str = "uk") -> str:
+def get_meal_suggestions(user_profile: dict, meal_type: str, plans: list, lang: str = "uk") -> str:
     """
-    Get meal suggestions for specific meal type
+    Short comments on meal options picked by the local planner
     """
-    target_calories = user_profile['calories']['maintain']
-
-    # Approximate calorie distribution by meals
-    meal_calories = {
-        "breakfast": int(target_calories * 0.25),  # 25% for breakfast
-        "lunch": int(target_calories * 0.35),  # 35% for lunch
-        "dinner": int(target_calories * 0.30),  # 30% for dinner
-        "snack": int(target_calories * 0.10)  # 10% for snack
-    }
-
-    calories_for_meal = meal_calories.get(meal_type.lower(), int(target_calories * 0.25))
+    options = "\n".join(
+        f"{n}. " + ", ".join(f"{item['name'][lang]} {item['grams']} g" for item in plan["items"])
+        + f" ({plan['totals']['calories']} kcal)"
+        for n, plan in enumerate(plans, 1)
+    )
 
     if lang == "uk":
         meal_names = {
@@ -161,43 +143,39 @@ def get_meal_suggestions(user_profile: dict, meal_type: str, lang: str = "uk") -
             "dinner": "вечеря",
             "snack": "перекус"
         }
-        meal_name = meal_names.get(meal_type.lower(), "прийом їжі")
+        meal_name = meal_names.get(meal_type, "прийом їжі")
 
         prompt = f"""
-Ти - дієтолог. Запропонуй 3 варіанти здорових страв для {meal_name} для клієнта:
-- Денна норма: {target_calories} ккал
-- На цей {meal_name}: приблизно {calories_for_meal} ккал
+Ти - дієтолог. Для клієнта підібрано варіанти на {meal_name}:
+{options}
+
+Клієнт:
+- Денна норма: {user_profile['calories']['maintain']} ккал
 - Вік: {user_profile['age']} років
 - Стать: {"чоловік" if user_profile['gender'] == 'male' else "жінка"}
 
-Дай 3 конкретні варіанти з:
-- Назвою страви
-- Орієнтовною калорійністю
-- Коротким описом користі
-
-Формат: емодзі + назва + калорії + опис
+Для кожного варіанту напиши одне коротке речення про його користь.
+Не змінюй продукти, грами та калорії.
         """
     else:
         prompt = f"""
-You are a nutritionist. Suggest 3 healthy meal options for {meal_type} for a client:
-- Daily target: {target_calories} kcal
-- For this {meal_type}: approximately {calories_for_meal} kcal
+You are a nutritionist. These {meal_type} options were picked for a client:
+{options}
+
+Client:
+- Daily target: {user_profile['calories']['maintain']} kcal
 - Age: {user_profile['age']} years
 - Gender: {user_profile['gender']}
 
-Provide 3 specific options with:
-- Meal name
-- Approximate calories
-- Brief benefit description
-
-Format: emoji + name + calories + description
+For each option write one short sentence about its benefits.
+Don't change the foods, grams or calories.
         """
 
     response = client.chat.completions.create(
         model="gpt-3.5-turbo",
         messages=[{"role": "user", "content": prompt}],
-        temperature=0.8,
-        max_tokens=600
+        temperature=0.7,
+        max_tokens=300
     )
 
     return response.choices[0].message.content.strip()
@@ -217,29 +195,19 @@ def load_user_profile(user_id: int) -> dict:
 
 def calculate_bmi(weight: float, height: int) -> dict:
     """Calculate BMI and category"""
-    height_m = height / 100
-    bmi = weight / (height_m ** 2)
-
-    if bmi < 18.5:
-        category_uk = "Недостатня вага"
-        category_en = "Underweight"
-        recommendation_uk = "Рекомендується набір ваги"
-        recommendation_en = "Weight gain recommended"
-    elif 18.5 <= bmi < 25:
-        category_uk = "Нормальна вага"
-        category_en = "Normal weight"
-        recommendation_uk = "Підтримуйте поточну вагу"
-        recommendation_en = "Maintain current weight"
-    elif 25 <= bmi < 30:
-        category_uk = "Надмірна вага"
-        category_en = "Overweight"
-        recommendation_uk = "Рекомендується зниження ваги"
-        recommendation_en = "Weight loss recommended"
-    else:
-        category_uk = "Ожиріння"
-        category_en = "Obesity"
-        recommendation_uk = "Обов'язково зверніться до лікаря"
-        recommendation_en = "Consult a doctor immediately"
+    bmi = body_mass_index(weight, height)
+
+    texts = {
+        "underweight": ("Недостатня вага", "Underweight",
+                        "Рекомендується набір ваги", "Weight gain recommended"),
+        "normal": ("Нормальна вага", "Normal weight",
+                   "Підтримуйте поточну вагу", "Maintain current weight"),
+        "overweight": ("Надмірна вага", "Overweight",
+                       "Рекомендується зниження ваги", "Weight loss recommended"),
+        "obesity": ("Ожиріння", "Obesity",
+                    "Обов'язково зверніться до лікаря", "Consult a doctor immediately")
+    }
+    category_uk, category_en, recommendation_uk, recommendation_en = texts[BMI_CATEGORIES[bmi_category(bmi)]]
 
     return {
         "bmi": round(bmi, 1),
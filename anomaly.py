@@ -0,0 +1,81 @@
+import math
+from typing import Dict, Optional
+
+
+# ============================================================================
+# Streaming anomaly detection
+# ============================================================================
+
+class EwmaBaseline:
+    """Exponentially weighted mean and variance of one user's values, O(1) memory"""
+
+    __slots__ = ("mean", "var", "count")
+
+    def __init__(self, mean: float = 0.0, var: float = 0.0, count: int = 0):
+        self.mean = mean
+        self.var = var
+        self.count = count
+
+    def score(self, value: float, min_std: float) -> float:
+        """How many standard deviations `value` is from the baseline"""
+        std = max(math.sqrt(self.var), min_std)
+        return (value - self.mean) / std
+
+    def update(self, value: float, alpha: float):
+        if self.count == 0:
+            self.mean = value
+        else:
+            diff = value - self.mean
+            increment = alpha * diff
+            self.mean += increment
+            self.var = (1 - alpha) * (self.var + diff * increment)
+        self.count += 1
+
+
+class AnomalyDetector:
+    """Flags values far from the user's own baseline.
+
+    Until a user has `warmup` observations there is no baseline yet and
+    `observe` returns None, so callers can fall back to fixed cutoffs.
+    The std is floored at `min_std_ratio` of the mean so a very regular
+    user isn't flagged for small changes.
+    """
+
+    def __init__(self, alpha: float = 0.1, threshold: float = 2.0, warmup: int = 5,
+                 min_std_ratio: float = 0.15):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.min_std_ratio = min_std_ratio
+        self.baselines: Dict[int, EwmaBaseline] = {}
+
+    def check(self, user_id: int, value: float) -> Optional[Dict]:
+        """Score `value` against the baseline without learning from it"""
+        baseline = self.baselines.get(user_id)
+        if baseline is None or baseline.count < self.warmup:
+            return None
+
+        z = baseline.score(value, abs(baseline.mean) * self.min_std_ratio or 1.0)
+        if z >= self.threshold:
+            level = "high"
+        elif z <= -self.threshold:
+            level = "low"
+        else:
+            level = "normal"
+        return {"level": level, "z": round(z, 2), "baseline": round(baseline.mean)}
+
+    def observe(self, user_id: int, value: float) -> Optional[Dict]:
+        """Score `value`, then fold it into the baseline"""
+        result = self.check(user_id, value)
+
+        baseline = self.baselines.get(user_id)
+        if baseline is None:
+            baseline = self.baselines[user_id] = EwmaBaseline()
+        baseline.update(value, self.alpha)
+        return result
+
+    def get_state(self) -> Dict:
+        return {str(user_id): [b.mean, b.var, b.count] for user_id, b in self.baselines.items()}
+
+    def load_state(self, state: Dict):
+        self.baselines = {int(user_id): EwmaBaseline(*values) for user_id, values in state.items()}
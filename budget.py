@@ -0,0 +1,85 @@
+from datetime import date
+from typing import Callable, Dict, Optional
+
+from i18n import catalog
+from nutrition_formulas import daily_targets
+from user_time import clock
+
+NUTRIENTS = ("calories", "protein", "fat", "carbs")
+GOALS = ("maintain", "lose", "gain")
+
+
+# ============================================================================
+# Remaining daily budget
+# ============================================================================
+
+class BudgetTracker:
+    """What is left of each user's daily calorie and macro targets.
+
+    Eaten totals come from the analyst's daily rollup, which is already
+    updated when a meal is saved or deleted; targets are cached per user
+    and replaced when the profile is recalculated. A lookup is a few dict
+    reads, so every reply can include it.
+    """
+
+    def __init__(self, day_totals: Callable[[date], Dict[int, Dict]]):
+        self.day_totals = day_totals
+        # user_id -> {"maintain", "lose", "gain", "protein", "fat", "carbs"}
+        self.targets: Dict[int, Dict[str, float]] = {}
+
+    def set_targets(self, user_id: int, calories: Dict):
+        if not calories or not calories.get("maintain"):
+            self.targets.pop(user_id, None)
+            return
+        targets = {goal: calories.get(goal, calories["maintain"]) for goal in GOALS}
+        macros = daily_targets(calories["maintain"])
+        for key in NUTRIENTS[1:]:
+            targets[key] = macros[key]
+        self.targets[user_id] = targets
+
+    def load_targets(self, profiles: Dict[int, Dict]):
+        self.targets = {}
+        for user_id, profile in profiles.items():
+            self.set_targets(user_id, profile.get("calories"))
+
+    def get(self, user_id: int, day: date = None) -> Optional[Dict]:
+        """Targets, eaten and remaining for one day (the user's local today by default), None without a profile"""
+        targets = self.targets.get(user_id)
+        if targets is None:
+            return None
+
+        day = day or clock.today(user_id)
+        eaten = self.day_totals(day).get(user_id) or {}
+        eaten = {key: eaten.get(key, 0) for key in NUTRIENTS}
+        return {
+            "day": day.strftime("%Y-%m-%d"),
+            "targets": {"calories": targets["maintain"], **{key: round(targets[key]) for key in NUTRIENTS[1:]}},
+            "eaten": eaten,
+            "remaining": {
+                "calories": round(targets["maintain"] - eaten["calories"]),
+                **{key: round(targets[key] - eaten[key]) for key in NUTRIENTS[1:]}
+            },
+            "goals": {goal: round(targets[goal] - eaten["calories"]) for goal in GOALS}
+        }
+
+    def format(self, user_id: int, lang: str) -> str:
+        budget = self.get(user_id)
+        if budget is None:
+            return ""
+
+        target = budget["targets"]["calories"]
+        remaining = budget["remaining"]
+        if remaining["calories"] < 0:
+            return catalog.render(lang, "budget_over", over=-remaining["calories"], target=target)
+
+        return catalog.render(
+            lang, "budget",
+            calories=remaining["calories"],
+            target=target,
+            percent=round(budget["eaten"]["calories"] / target * 100) if target else 0,
+            protein=max(remaining["protein"], 0),
+            fat=max(remaining["fat"], 0),
+            carbs=max(remaining["carbs"], 0),
+            lose=max(budget["goals"]["lose"], 0),
+            gain=max(budget["goals"]["gain"], 0)
+        )
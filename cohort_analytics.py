@@ -0,0 +1,287 @@
+"""Cohort statistics over the whole meal history.
+
+    python cohort_analytics.py [--partitions 64] [--workers 8]
+
+Entries are streamed from nutrition_data.json into per-user partitions on
+disk, partitions are aggregated in parallel by a process pool, and the
+merged histograms are written to data/cohort_summary.json.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, tzinfo
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from meal_log import iter_entries
+from user_time import DEFAULT_TIMEZONE, get_timezone
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).parent / "data"
+SUMMARY_FILE = DATA_DIR / "cohort_summary.json"
+
+PERCENTILES = (10, 25, 50, 75, 90)
+# Day within ±10% of calories.maintain counts as adherent
+ADHERENCE_TOLERANCE = 0.10
+
+# Histogram layouts: every partition fills the same bins so results merge by addition
+RATIO_BINS = 301            # intake / target, 1% bins, 0..300%
+SHARE_BINS = 101            # % of calories or % of days, 0..100
+CALORIE_BIN_WIDTH = 50
+CALORIE_BINS = 201          # daily calories, 0..10000 kcal
+MACRO_KCAL = np.array([4.0, 9.0, 4.0])
+
+# Set in each worker process by _init_worker
+_targets: Dict[int, float] = {}
+_zones: Dict[int, tzinfo] = {}
+_default_zone: Optional[tzinfo] = None
+
+
+# ============================================================================
+# Partitioning
+# ============================================================================
+
+def partition_entries(input_file: Path, workdir: Path, partitions: int) -> List[Path]:
+    """Spill entries to JSONL files by user, so each user's history lands in one partition"""
+    paths = [workdir / f"part-{index:04d}.jsonl" for index in range(partitions)]
+    files = [open(path, "w", encoding="utf-8") for path in paths]
+    try:
+        for entry in iter_entries(input_file):
+            user_id = entry.get("user_id")
+            index = user_id % partitions if isinstance(user_id, int) else 0
+            files[index].write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+
+def load_profiles(profiles_file: Path) -> Tuple[Dict[int, float], Dict[int, str]]:
+    """Calorie targets and timezone names by user"""
+    try:
+        with open(profiles_file, "r", encoding="utf-8") as f:
+            profiles = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}, {}
+
+    targets = {}
+    timezones = {}
+    for user_id, profile in profiles.items():
+        maintain = (profile.get("calories") or {}).get("maintain")
+        if maintain:
+            targets[int(user_id)] = float(maintain)
+        if profile.get("timezone"):
+            timezones[int(user_id)] = profile["timezone"]
+    return targets, timezones
+
+
+# ============================================================================
+# Partition aggregation (runs in worker processes)
+# ============================================================================
+
+def _init_worker(targets: Dict[int, float], timezones: Dict[int, str]):
+    global _targets, _zones, _default_zone
+    _targets = targets
+    _zones = {user_id: zone for user_id, zone in
+              ((user_id, get_timezone(name)) for user_id, name in timezones.items()) if zone is not None}
+    _default_zone = get_timezone(DEFAULT_TIMEZONE) if DEFAULT_TIMEZONE else None
+
+
+def local_hour(timestamp: str, zone: Optional[tzinfo]) -> Optional[int]:
+    """Hour of a logged timestamp on the user's clock; naive timestamps are the server's local time"""
+    try:
+        logged = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return None
+    return (logged.astimezone(zone) if zone is not None else logged).hour
+
+
+def analyze_partition(path: Path) -> Dict:
+    """Mergeable histograms for one partition"""
+    # (user_id, date) -> [calories, protein, fat, carbs]
+    days: Dict[tuple, List[float]] = {}
+    meal_hours = np.zeros(24, dtype=np.int64)
+    entries = 0
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            entries += 1
+
+            key = (entry.get("user_id"), entry.get("date"))
+            totals = days.get(key)
+            if totals is None:
+                totals = days[key] = [0.0, 0.0, 0.0, 0.0]
+            totals[0] += entry.get("calories") or 0
+            totals[1] += entry.get("protein") or 0
+            totals[2] += entry.get("fat") or 0
+            totals[3] += entry.get("carbs") or 0
+
+            hour = local_hour(entry.get("timestamp"), _zones.get(entry.get("user_id"), _default_zone))
+            if hour is not None:
+                meal_hours[hour] += 1
+
+    result = {
+        "entries": entries,
+        "users": len({user_id for user_id, _ in days if user_id is not None}),
+        "user_days": len(days),
+        "meal_hours": meal_hours,
+        "daily_calories": np.zeros(CALORIE_BINS, dtype=np.int64),
+        "macro_shares": np.zeros((3, SHARE_BINS), dtype=np.int64),
+        "target_ratio": np.zeros(RATIO_BINS, dtype=np.int64),
+        "user_adherence": np.zeros(SHARE_BINS, dtype=np.int64),
+        "target_days": 0,
+        "adherent_days": 0
+    }
+    if not days:
+        return result
+
+    keys = list(days)
+    values = np.array([days[key] for key in keys])
+
+    calorie_bins = np.minimum(values[:, 0] // CALORIE_BIN_WIDTH, CALORIE_BINS - 1).astype(np.int64)
+    result["daily_calories"] += np.bincount(np.maximum(calorie_bins, 0), minlength=CALORIE_BINS)
+
+    macro_kcal = values[:, 1:] * MACRO_KCAL
+    macro_total = macro_kcal.sum(axis=1)
+    has_macros = macro_total > 0
+    shares = np.clip(np.rint(macro_kcal[has_macros] / macro_total[has_macros, None] * 100), 0, 100).astype(np.int64)
+    for macro in range(3):
+        result["macro_shares"][macro] += np.bincount(shares[:, macro], minlength=SHARE_BINS)
+
+    # Adherence: only days of users with a calorie target
+    user_ids = np.array([user_id if isinstance(user_id, int) else -1 for user_id, _ in keys])
+    targets = np.array([_targets.get(user_id, 0.0) for user_id in user_ids])
+    with_target = targets > 0
+    if with_target.any():
+        ratio = values[with_target, 0] / targets[with_target]
+        result["target_ratio"] += np.bincount(
+            np.clip(np.rint(ratio * 100), 0, RATIO_BINS - 1).astype(np.int64), minlength=RATIO_BINS
+        )
+        adherent = np.abs(ratio - 1) <= ADHERENCE_TOLERANCE
+        result["target_days"] = int(with_target.sum())
+        result["adherent_days"] = int(adherent.sum())
+
+        # Share of each user's logged days that were adherent
+        users, inverse = np.unique(user_ids[with_target], return_inverse=True)
+        user_days = np.bincount(inverse, minlength=len(users))
+        user_adherent = np.bincount(inverse, weights=adherent, minlength=len(users))
+        user_share = np.rint(user_adherent / user_days * 100).astype(np.int64)
+        result["user_adherence"] += np.bincount(user_share, minlength=SHARE_BINS)
+
+    return result
+
+
+# ============================================================================
+# Merging
+# ============================================================================
+
+def merge_results(results) -> Dict:
+    merged = None
+    for result in results:
+        if merged is None:
+            merged = result
+            continue
+        for key, value in result.items():
+            merged[key] = merged[key] + value
+    return merged
+
+
+def histogram_percentiles(counts: np.ndarray, bin_width: float = 1.0) -> Dict[str, float]:
+    total = counts.sum()
+    if not total:
+        return {}
+    cumulative = np.cumsum(counts)
+    return {
+        f"p{q}": float(np.searchsorted(cumulative, total * q / 100) * bin_width)
+        for q in PERCENTILES
+    }
+
+
+def build_summary(merged: Dict, elapsed: float) -> Dict:
+    target_days = merged["target_days"]
+    return {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "elapsed_s": round(elapsed, 1),
+        "entries": merged["entries"],
+        "users": merged["users"],
+        "user_days": merged["user_days"],
+        "daily_calories": histogram_percentiles(merged["daily_calories"], CALORIE_BIN_WIDTH),
+        "adherence": {
+            "days_with_target": target_days,
+            "adherent_day_share": round(merged["adherent_days"] / target_days * 100, 1) if target_days else None,
+            "intake_to_target_pct": histogram_percentiles(merged["target_ratio"]),
+            "user_adherent_days_pct": histogram_percentiles(merged["user_adherence"])
+        },
+        "macro_share_pct": {
+            macro: histogram_percentiles(merged["macro_shares"][index])
+            for index, macro in enumerate(("protein", "fat", "carbs"))
+        },
+        "meal_hours": merged["meal_hours"].tolist()
+    }
+
+
+def write_summary(summary: Dict, output: Path):
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = output.with_suffix(".tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, output)
+
+
+def load_summary(path: Path = SUMMARY_FILE) -> Optional[Dict]:
+    """Latest summary for the bot, None if the job hasn't run yet"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+# ============================================================================
+# Entry point
+# ============================================================================
+
+def run(input_file: Path, profiles_file: Path, output: Path, partitions: int, workers: int) -> Dict:
+    started = time.monotonic()
+    workdir = Path(tempfile.mkdtemp(prefix="cohort-"))
+    try:
+        paths = partition_entries(input_file, workdir, partitions)
+        logger.info(f"Partitioned into {partitions} files in {time.monotonic() - started:.1f}s")
+
+        targets, timezones = load_profiles(profiles_file)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(targets, timezones)) as pool:
+            merged = merge_results(pool.map(analyze_partition, paths))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = build_summary(merged, time.monotonic() - started)
+    write_summary(summary, output)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cohort statistics over all users' meal history")
+    parser.add_argument("--input", type=Path, default=DATA_DIR / "nutrition_data.json")
+    parser.add_argument("--profiles", type=Path, default=DATA_DIR / "profiles.json")
+    parser.add_argument("--output", type=Path, default=SUMMARY_FILE)
+    parser.add_argument("--partitions", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    summary = run(args.input, args.profiles, args.output, args.partitions, args.workers)
+    logger.info(f"{summary['entries']} entries, {summary['users']} users -> {args.output} "
+                f"in {summary['elapsed_s']}s")
+
+
+if __name__ == "__main__":
+    main()
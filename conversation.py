@@ -0,0 +1,85 @@
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+
+def normalize_label(text: str) -> str:
+    """Button labels compare without case and whitespace differences"""
+    return " ".join(text.split()).casefold()
+
+
+# ============================================================================
+# Conversation state machine
+# ============================================================================
+
+class Route:
+    __slots__ = ("name", "handler", "arg")
+
+    def __init__(self, name: str, handler: Callable, arg: Any = None):
+        self.name = name
+        self.handler = handler
+        self.arg = arg
+
+
+class ConversationRouter:
+    """Declarative flows compiled into O(1) dispatch tables.
+
+    A route is keyed by (state, normalized button label); every label of every
+    language is expanded at compile time. Each state may also have a fallback
+    for free text input (food description, age, weight...).
+    """
+
+    def __init__(self, labels: Dict[str, Dict[str, str]]):
+        self.labels = labels
+        self._routes: Dict[Tuple[Optional[str], str], Route] = {}
+        self._fallbacks: Dict[Optional[str], Route] = {}
+        self._latency: Dict[str, list] = {}
+
+    def add(self, state: Optional[str], label_keys: Iterable[str], handler: Callable, arg: Any = None):
+        for label_key in label_keys:
+            route = Route(f"{state}:{label_key}", handler, label_key if arg is None else arg)
+            for text in self.labels[label_key].values():
+                self._routes[(state, normalize_label(text))] = route
+
+    def add_fallback(self, state: Optional[str], handler: Callable, arg: Any = None):
+        self._fallbacks[state] = Route(f"{state}:*", handler, arg)
+
+    def compile(self, flows: Iterable[Tuple]):
+        """flows: (state, label keys or None for free text, handler, optional arg)"""
+        for flow in flows:
+            state, label_keys, handler = flow[:3]
+            arg = flow[3] if len(flow) > 3 else None
+            if label_keys is None:
+                self.add_fallback(state, handler, arg)
+            else:
+                self.add(state, label_keys, handler, arg)
+
+    def resolve(self, state: Optional[str], text: str) -> Optional[Route]:
+        route = self._routes.get((state, normalize_label(text)))
+        if route is None:
+            route = self._fallbacks.get(state)
+        return route
+
+    def label(self, label_key: str, lang: str) -> str:
+        return self.labels[label_key][lang]
+
+    async def run(self, route: Route, *args):
+        started = time.perf_counter()
+        try:
+            return await route.handler(*args, route.arg)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = self._latency.get(route.name)
+            if stats is None:
+                # count, total seconds, max seconds
+                stats = [0, 0.0, 0.0]
+                self._latency[route.name] = stats
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+
+    def stats(self) -> Dict:
+        return {
+            name: {"count": count, "avg_ms": round(total / count * 1000, 1), "max_ms": round(peak * 1000, 1)}
+            for name, (count, total, peak) in self._latency.items()
+        }
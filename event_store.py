@@ -0,0 +1,108 @@
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+
+# ============================================================================
+# Durable event log + snapshots
+# ============================================================================
+
+class EventStore:
+    """Append-only JSON-lines event log with periodic compact snapshots.
+
+    Startup loads the latest snapshot and replays only the events written
+    after it, so restart time depends on snapshot size, not on history.
+    """
+
+    def __init__(self, directory: Path, snapshot_every: int = 500, fsync: bool = False):
+        self.directory = Path(directory)
+        self.log_file = self.directory / "events.log"
+        self.snapshot_file = self.directory / "snapshot.json"
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.last_seq = 0
+        self.snapshot_seq = 0
+        self._handle = None
+
+    def append(self, kind: str, data: Dict) -> int:
+        self.last_seq += 1
+        record = {
+            "seq": self.last_seq,
+            "kind": kind,
+            "ts": datetime.now().isoformat(),
+            "data": data
+        }
+
+        handle = self._open_log()
+        handle.write(json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str) + "\n")
+        handle.flush()
+        if self.fsync:
+            os.fsync(handle.fileno())
+
+        return self.last_seq
+
+    def needs_snapshot(self) -> bool:
+        return self.last_seq - self.snapshot_seq >= self.snapshot_every
+
+    def load_snapshot(self) -> Optional[Dict]:
+        try:
+            with open(self.snapshot_file, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        self.snapshot_seq = snapshot.get("seq", 0)
+        self.last_seq = max(self.last_seq, self.snapshot_seq)
+        return snapshot.get("state", {})
+
+    def replay(self) -> Iterator[Dict]:
+        """Yield events written after the loaded snapshot"""
+        try:
+            f = open(self.log_file, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return
+
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn write from a crash - everything before it is intact
+                    break
+
+                seq = record.get("seq", 0)
+                if seq <= self.snapshot_seq:
+                    continue
+
+                self.last_seq = max(self.last_seq, seq)
+                yield record
+
+    def save_snapshot(self, state: Dict):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.snapshot_file.with_suffix(".tmp")
+
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"seq": self.last_seq, "state": state}, f,
+                      ensure_ascii=False, separators=(",", ":"), default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+        self.snapshot_seq = self.last_seq
+
+        # Snapshot covers the whole log now, start a fresh tail
+        self.close()
+        with open(self.log_file, "w", encoding="utf-8"):
+            pass
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def _open_log(self):
+        if self._handle is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._handle = open(self.log_file, "a", encoding="utf-8")
+        return self._handle
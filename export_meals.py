@@ -0,0 +1,162 @@
+"""Export meal history for the analytics stack.
+
+    python export_meals.py --output exports/meals.csv.gz [--user 123] [--from 2024-01-01] [--to 2024-01-31]
+    python export_meals.py --output exports/new.csv.gz --incremental     # only rows since the last run
+
+Entries are streamed from nutrition_data.json and written row by row, so
+memory doesn't grow with the history. Output is CSV or JSON lines,
+gzipped when the file name ends with .gz.
+
+Incremental mode exports entries added or modified (re-estimated) after
+the stored watermark and moves the watermark forward once the file is
+complete; a modified entry is exported again under the same id. It always
+covers every user and date, so it can't be combined with --user, --from
+or --to. Deletions aren't exported - the log is treated as append-only.
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Set
+
+from meal_log import iter_entries
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).parent / "data"
+WATERMARK_FILE = DATA_DIR / "export_watermark.json"
+
+COLUMNS = ["id", "user_id", "date", "timestamp", "modified", "description", "calories", "protein", "fat", "carbs"]
+
+
+# ============================================================================
+# Filtering
+# ============================================================================
+
+def changed_at(entry: Dict) -> str:
+    """When the entry was last written: re-estimation stamps `modified`, otherwise it's the log time"""
+    return entry.get("modified") or entry.get("timestamp") or ""
+
+
+def select_entries(entries: Iterator[Dict], users: Optional[Set[int]] = None, date_from: str = None,
+                   date_to: str = None, since: str = None) -> Iterator[Dict]:
+    """ISO dates and timestamps compare correctly as strings"""
+    for entry in entries:
+        if users is not None and entry.get("user_id") not in users:
+            continue
+        day = entry.get("date", "")
+        if date_from and day < date_from:
+            continue
+        if date_to and day > date_to:
+            continue
+        if since and changed_at(entry) <= since:
+            continue
+        yield entry
+
+
+# ============================================================================
+# Output
+# ============================================================================
+
+def open_output(path: Path, compress: bool):
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def write_rows(entries: Iterator[Dict], f, fmt: str) -> Dict:
+    """Write entries, return row count and the latest change time seen"""
+    rows = 0
+    latest = None
+
+    if fmt == "csv":
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+
+    for entry in entries:
+        if fmt == "csv":
+            writer.writerow([entry.get(column, "") for column in COLUMNS])
+        else:
+            f.write(json.dumps({column: entry.get(column) for column in COLUMNS}, ensure_ascii=False) + "\n")
+
+        rows += 1
+        timestamp = changed_at(entry)
+        if timestamp and (latest is None or timestamp > latest):
+            latest = timestamp
+
+    return {"rows": rows, "latest": latest}
+
+
+def load_watermark(path: Path) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("timestamp")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_watermark(path: Path, timestamp: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_suffix(".tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": timestamp}, f)
+    os.replace(tmp_file, path)
+
+
+# ============================================================================
+# Entry point
+# ============================================================================
+
+def export(input_file: Path, output: Path, fmt: str = "csv", users: Optional[Set[int]] = None,
+           date_from: str = None, date_to: str = None, watermark_file: Path = None) -> Dict:
+    # One watermark for the whole log: a filtered run would move it past rows it never wrote
+    if watermark_file and (users or date_from or date_to):
+        raise ValueError("incremental exports can't be filtered by user or date")
+    since = load_watermark(watermark_file) if watermark_file else None
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    # Partial exports never show up under the final name
+    tmp_output = output.with_name(output.name + ".part")
+    with open_output(tmp_output, compress=output.suffix == ".gz") as f:
+        entries = select_entries(iter_entries(input_file), users, date_from, date_to, since)
+        result = write_rows(entries, f, fmt)
+    os.replace(tmp_output, output)
+
+    if watermark_file and result["latest"]:
+        save_watermark(watermark_file, result["latest"])
+
+    result["since"] = since
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream meal history to CSV / JSON lines")
+    parser.add_argument("--input", type=Path, default=DATA_DIR / "nutrition_data.json")
+    parser.add_argument("--output", type=Path, required=True, help="file name; .gz suffix enables gzip")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument("--user", type=int, action="append", help="repeat for several users")
+    parser.add_argument("--from", dest="date_from", help="first date, YYYY-MM-DD")
+    parser.add_argument("--to", dest="date_to", help="last date, YYYY-MM-DD")
+    parser.add_argument("--incremental", action="store_true", help="only entries newer than the watermark")
+    parser.add_argument("--watermark", type=Path, default=WATERMARK_FILE)
+    args = parser.parse_args()
+    if args.incremental and (args.user or args.date_from or args.date_to):
+        parser.error("--incremental exports every user and date; drop --user, --from and --to")
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    result = export(
+        args.input, args.output, args.format,
+        users=set(args.user) if args.user else None,
+        date_from=args.date_from,
+        date_to=args.date_to,
+        watermark_file=args.watermark if args.incremental else None
+    )
+    logger.info(f"Exported {result['rows']} rows to {args.output}"
+                + (f" (since {result['since']})" if result["since"] else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import hashlib
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from portion_cache import strip_meal_type
+
+NUTRIENTS = ("calories", "protein", "fat", "carbs")
+
+# A use counts half as much after this many days
+HALF_LIFE_DAYS = 14
+# Meals remembered per user; the weakest one is forgotten when a new one comes in
+MAX_TRACKED = 50
+
+
+def favorite_key(description: str) -> str:
+    """Same meal however it was capitalised or spaced, and whichever meal type it was logged as"""
+    return " ".join(strip_meal_type(description).lower().split())
+
+
+def favorite_id(key: str) -> str:
+    """Short stable ID for callback data"""
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:10]
+
+
+# ============================================================================
+# Favorites and recents
+# ============================================================================
+
+class Favorite:
+    __slots__ = ("description", "kbju", "count", "score", "last_used")
+
+    def __init__(self, description: str, kbju: Dict, count: int = 0, score: float = 0.0, last_used: float = 0.0):
+        self.description = description
+        self.kbju = kbju
+        self.count = count
+        self.score = score
+        self.last_used = last_used
+
+    def rank(self, now: float) -> float:
+        """Use count with every use fading by its age - frequent and recent meals come first"""
+        age_days = max(now - self.last_used, 0) / 86400
+        return self.score * 0.5 ** (age_days / HALF_LIFE_DAYS)
+
+    def to_list(self) -> List:
+        return [self.description, self.kbju, self.count, self.score, self.last_used]
+
+
+class FavoritesStore:
+    """Each user's logged meals with their last KBJU estimate, ranked for one-tap re-logging"""
+
+    def __init__(self):
+        # user_id -> favorite key -> Favorite
+        self.users: Dict[int, Dict[str, Favorite]] = {}
+
+    def add(self, user_id: int, description: str, kbju: Dict, when: datetime = None):
+        if user_id is None or not description:
+            return
+        now = (when or datetime.now()).timestamp()
+        key = favorite_key(description)
+        favorites = self.users.setdefault(user_id, {})
+
+        favorite = favorites.get(key)
+        if favorite is None:
+            favorite = favorites[key] = Favorite(description, {})
+            if len(favorites) > MAX_TRACKED:
+                weakest = min((k for k in favorites if k != key), key=lambda k: favorites[k].rank(now))
+                del favorites[weakest]
+
+        # Re-logged without the "🌅 Сніданок: " label it was first logged under
+        favorite.description = strip_meal_type(description)
+        favorite.kbju = {name: kbju.get(name) or 0 for name in NUTRIENTS}
+        favorite.score = favorite.rank(now) + 1
+        favorite.count += 1
+        favorite.last_used = max(favorite.last_used, now)
+
+    def remove(self, user_id: int, description: str):
+        """A deleted entry takes back its use"""
+        favorites = self.users.get(user_id)
+        favorite = favorites.get(favorite_key(description or "")) if favorites else None
+        if favorite is None:
+            return
+        favorite.count -= 1
+        favorite.score = max(favorite.score - 1, 0.0)
+        if favorite.count <= 0:
+            del favorites[favorite_key(description)]
+
+    def correct(self, user_id: int, description: str, old: Dict, new: Dict):
+        """A re-estimated entry replaces the stored KBJU, unless a later estimate already did"""
+        favorite = self.users.get(user_id, {}).get(favorite_key(description or ""))
+        if favorite is None or any(favorite.kbju.get(name) != (old.get(name) or 0) for name in NUTRIENTS):
+            return
+        favorite.kbju = {name: new.get(name) or 0 for name in NUTRIENTS}
+
+    def get(self, user_id: int, fav_id: str) -> Optional[Favorite]:
+        for key, favorite in self.users.get(user_id, {}).items():
+            if favorite_id(key) == fav_id:
+                return favorite
+        return None
+
+    def top(self, user_id: int, limit: int = 8) -> List[Dict]:
+        now = datetime.now().timestamp()
+        ranked = sorted(self.users.get(user_id, {}).items(), key=lambda item: item[1].rank(now), reverse=True)
+        return [
+            {"id": favorite_id(key), "description": favorite.description, "count": favorite.count, **favorite.kbju}
+            for key, favorite in ranked[:limit]
+        ]
+
+    def seed(self, entries: Iterable[Dict]):
+        """Rebuild from stored entries, oldest first"""
+        self.users = {}
+        for entry in entries:
+            timestamp = entry.get("timestamp")
+            try:
+                when = datetime.fromisoformat(timestamp) if timestamp else None
+            except ValueError:
+                when = None
+            self.add(entry.get("user_id"), entry.get("description"), entry, when)
+
+    def get_state(self) -> Dict:
+        return {
+            str(user_id): {key: favorite.to_list() for key, favorite in favorites.items()}
+            for user_id, favorites in self.users.items()
+        }
+
+    def load_state(self, state: Dict):
+        self.users = {}
+        for user_id, favorites in state.items():
+            merged = self.users[int(user_id)] = {}
+            for values in favorites.values():
+                # State saved while keys included the meal type: the same meal's entries are merged
+                favorite = Favorite(*values)
+                favorite.description = strip_meal_type(favorite.description)
+                key = favorite_key(favorite.description)
+                existing = merged.get(key)
+                if existing is None:
+                    merged[key] = favorite
+                    continue
+                latest = max(existing.last_used, favorite.last_used)
+                if favorite.last_used > existing.last_used:
+                    existing.kbju = favorite.kbju
+                existing.count += favorite.count
+                existing.score = existing.rank(latest) + favorite.rank(latest)
+                existing.last_used = latest
@@ -0,0 +1,136 @@
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from meal_planner import Food, load_foods
+from portion_cache import parse_portion
+
+NUTRIENTS = ("calories", "protein", "fat", "carbs")
+
+
+def normalize(text: str) -> str:
+    text = text.lower().replace("ё", "е").replace("’", "'")
+    return " ".join(re.sub(r"[^\w\s%'-]", " ", text).split())
+
+
+def trigrams(term: str) -> set:
+    padded = f" {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_distance(length: int) -> int:
+    """Typos allowed for a query of this length - short names must match exactly ("beer" is not "beef")"""
+    if length <= 5:
+        return 0
+    if length <= 6:
+        return 1
+    return 2
+
+
+def bounded_levenshtein(a: str, b: str, bound: int) -> Optional[int]:
+    """Edit distance, None as soon as it must exceed `bound`"""
+    if abs(len(a) - len(b)) > bound:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > bound:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= bound else None
+
+
+# ============================================================================
+# Fuzzy food index
+# ============================================================================
+
+class FoodSearch:
+    """Typo-tolerant lookup of foods.json names and aliases in both languages.
+
+    Terms are indexed by trigram; a query only compares against terms that
+    share enough trigrams to be within the allowed edit distance (one edit
+    changes at most three trigrams), then the bounded Levenshtein distance
+    picks the closest term. "молко нежирне" finds "молоко нежирне",
+    "гречки" finds "гречка".
+    """
+
+    def __init__(self, foods: List[Food] = None):
+        self.foods = load_foods() if foods is None else foods
+        self.by_id = {food.id: food for food in self.foods}
+        # (term, food); term ids index the postings
+        self.terms: List[Tuple[str, Food]] = []
+        self.exact: Dict[str, int] = {}
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        for food in self.foods:
+            names = list(food.name.values())
+            for aliases in food.aliases.values():
+                names.extend(aliases)
+            for name in names:
+                term = normalize(name)
+                if not term or term in self.exact:
+                    continue
+                self.exact[term] = len(self.terms)
+                for gram in trigrams(term):
+                    self.postings[gram].append(len(self.terms))
+                self.terms.append((term, food))
+        self.hits = 0
+        self.misses = 0
+
+    def find(self, name: str) -> Optional[Tuple[Food, str, int]]:
+        """(food, matched term, distance) of the closest term within the typo bound"""
+        query = normalize(name)
+        if not query:
+            return None
+        if query in self.exact:
+            term, food = self.terms[self.exact[query]]
+            return food, term, 0
+        bound = max_distance(len(query))
+        query_grams = trigrams(query)
+
+        shared = defaultdict(int)
+        for gram in query_grams:
+            for term_id in self.postings.get(gram, ()):
+                shared[term_id] += 1
+
+        best = None
+        needed = max(len(query_grams) - 3 * bound, 1)
+        for term_id, count in shared.items():
+            if count < needed:
+                continue
+            term, food = self.terms[term_id]
+            distance = bounded_levenshtein(query, term, bound)
+            if distance is not None:
+                best = (food, term, distance)
+                # Only a closer term can replace it
+                bound = distance - 1
+                if bound < 0:
+                    break
+        return best
+
+    def estimate(self, description: str) -> Optional[Dict]:
+        """KBJU of "<food> <grams or ml>" from the food table, with provenance; None when it isn't a known single food.
+
+        Exact name matches are "high" confidence, typo-tolerant ones "low".
+        Volumes are only counted for foods with a density (drinks).
+        """
+        portion = parse_portion(description)
+        match = self.find(portion[0]) if portion else None
+        if match is not None and portion[1] == "ml" and match[0].density is None:
+            match = None
+        if match is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        food, term, distance = match
+        name, unit, quantity = portion
+        grams = quantity * food.density if unit == "ml" else quantity
+        kbju = dict(zip(NUTRIENTS, food.amounts(grams)))
+        kbju["provenance"] = {"source": "food_table", "food": food.id, "match": term, "distance": distance,
+                              "confidence": "high" if distance == 0 else "low"}
+        return kbju
+
+    def stats(self) -> Dict:
+        return {"terms": len(self.terms), "hits": self.hits, "misses": self.misses}
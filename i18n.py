@@ -0,0 +1,51 @@
+import json
+from pathlib import Path
+from typing import Dict, List
+
+LOCALES_DIR = Path(__file__).parent / "locales"
+DEFAULT_LANGUAGE = "uk"
+
+
+# ============================================================================
+# Message catalog
+# ============================================================================
+
+class Catalog:
+    """All user-facing texts, loaded once at startup from locales/<lang>.json.
+
+    Keys missing in a language fall back to the default language, so adding
+    a language is adding one JSON file.
+    """
+
+    def __init__(self, directory: Path = LOCALES_DIR, default: str = DEFAULT_LANGUAGE):
+        raw = {}
+        for path in sorted(Path(directory).glob("*.json")):
+            with open(path, "r", encoding="utf-8") as f:
+                raw[path.stem] = json.load(f)
+
+        base = raw[default]
+        self.default = default
+        self.languages: List[str] = [default] + [lang for lang in raw if lang != default]
+        self.messages: Dict[str, Dict[str, str]] = {}
+        # label key -> {lang: text}, the shape ConversationRouter expects
+        self.labels: Dict[str, Dict[str, str]] = {}
+
+        for lang in self.languages:
+            data = raw[lang]
+            self.messages[lang] = {**base["messages"], **data.get("messages", {})}
+            for key, text in {**base["labels"], **data.get("labels", {})}.items():
+                self.labels.setdefault(key, {})[lang] = text
+
+        # Language buttons look the same whatever language is active
+        for lang in self.languages:
+            name = raw[lang]["language_name"]
+            self.labels[f"lang_{lang}"] = {ui_lang: name for ui_lang in self.languages}
+
+    def text(self, lang: str, key: str) -> str:
+        return self.messages.get(lang, self.messages[self.default])[key]
+
+    def render(self, lang: str, key: str, **values) -> str:
+        return self.text(lang, key).format_map(values)
+
+
+catalog = Catalog()
@@ -0,0 +1,119 @@
+import asyncio
+import bisect
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the duration histogram buckets; the last bucket is open
+DURATION_BUCKETS = [0.5, 1, 2, 5, 10, 30]
+
+
+# ============================================================================
+# Background jobs
+# ============================================================================
+
+class DurationHistogram:
+    __slots__ = ("counts", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(DURATION_BUCKETS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.counts[bisect.bisect_left(DURATION_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self) -> Dict:
+        count = sum(self.counts)
+        labels = [f"<={bound}s" for bound in DURATION_BUCKETS] + [f">{DURATION_BUCKETS[-1]}s"]
+        return {
+            "count": count,
+            "avg_s": round(self.total / count, 2) if count else 0.0,
+            "max_s": round(self.max, 2),
+            "buckets": {label: n for label, n in zip(labels, self.counts) if n}
+        }
+
+
+class JobRunner:
+    """Bounded worker pool for slow (GPT-bound) actions.
+
+    Handlers submit a job and return right away; `workers` jobs run at a
+    time, at most `queue_size` wait. A full queue rejects new jobs instead
+    of piling up latency.
+    """
+
+    def __init__(self, workers: int = 4, queue_size: int = 100):
+        self.workers = workers
+        self.queue: asyncio.Queue = None
+        self.queue_size = queue_size
+        self._tasks: List[asyncio.Task] = []
+
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.durations: Dict[str, DurationHistogram] = {}
+
+    async def start(self):
+        self.queue = asyncio.Queue(self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 30.0):
+        """Let queued jobs finish (up to `timeout`), then stop the workers"""
+        if self.queue is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Stopping with {self.queue.qsize()} jobs still queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def full(self) -> bool:
+        return self.queue.full()
+
+    def submit(self, name: str, job: Callable[[], Awaitable]) -> bool:
+        """Queue `job` (a coroutine function without arguments); False if the queue is full"""
+        try:
+            self.queue.put_nowait((name, job, time.monotonic()))
+            return True
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logger.warning(f"Job queue full, rejected {name}")
+            return False
+
+    async def _worker(self):
+        while True:
+            name, job, queued_at = await self.queue.get()
+            self.running += 1
+            try:
+                await job()
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Job {name} failed: {e}")
+            finally:
+                self.running -= 1
+                histogram = self.durations.get(name)
+                if histogram is None:
+                    histogram = self.durations[name] = DurationHistogram()
+                # Time in queue counts - it's what the user waits for
+                histogram.add(time.monotonic() - queued_at)
+                self.queue.task_done()
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "queued": self.queue.qsize() if self.queue else 0,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "durations": {name: histogram.to_dict() for name, histogram in self.durations.items()}
+        }
@@ -1,11 +1,25 @@
 # main.py - FINAL COMPLETE VERSION WITH BUTTON DELETION
 import os
+import asyncio
 import logging
-from typing import Dict, List
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Dict, List, Optional, Tuple
+from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ChatAction
+from telegram.ext import ApplicationBuilder, CallbackQueryHandler, CommandHandler, MessageHandler, filters, ContextTypes
 from dotenv import load_dotenv
 
+from cohort_analytics import load_summary as load_cohort_summary
+from conversation import ConversationRouter
+from i18n import catalog
+from jobs import JobRunner
+from nutrition_formulas import ACTIVITY_COEFFICIENTS
+from outbox import OutboundDispatcher, split_text
+from photo_logging import create_vision_estimator
+from product_index import decode_barcode
+from update_processing import PerUserUpdateProcessor
+from webhook_server import WebhookServer
+
 # Enable logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -19,11 +33,28 @@ try:
     logger.info("MultiAgent system loaded")
 except ImportError as e:
     logger.error(f"Error importing multiagent_core: {e}")
+    from sessions import SessionStore
 
     class SimpleCoordinator:
         def __init__(self):
+            self.agents = {}
             self.user_languages = {}
-            self.user_states = {}
+            self.sessions = SessionStore()
+
+        def set_user_language(self, user_id, lang):
+            self.user_languages[user_id] = lang
+
+        async def restore_state(self):
+            pass
+
+        def snapshot(self):
+            pass
+
+        def due_digests(self, digest_time, window):
+            return {}
+
+        def create_reestimate_job(self, **options):
+            return None
 
         async def route_request(self, user_id, action, data):
             return {"status": "success", "message": f"Test: {action}"}
@@ -31,6 +62,87 @@ except ImportError as e:
 load_dotenv()
 coordinator = SimpleCoordinator()
 
+# Updates of different users are processed in parallel, one user's updates in order
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+update_processor = PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES)
+
+# Telegram user IDs allowed to see /stats
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(",", " ").split()}
+
+# "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Public base URL registered with Telegram; leave empty to skip setWebhook (local benchmarks)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+webhook_server = None
+
+# Outgoing messages: Telegram allows ~1 message/s per chat and ~30/s overall
+outbox = OutboundDispatcher(
+    chat_rate=float(os.getenv("OUTBOX_CHAT_RATE", "1")),
+    chat_burst=float(os.getenv("OUTBOX_CHAT_BURST", "3")),
+    global_rate=float(os.getenv("OUTBOX_GLOBAL_RATE", "30")),
+    global_burst=float(os.getenv("OUTBOX_GLOBAL_BURST", "30"))
+)
+
+# Evening digest for subscribed users, HH:MM in each user's own timezone
+DIGEST_TIME = dt_time.fromisoformat(os.getenv("DIGEST_TIME", "21:00"))
+# How often due digests are looked for; a user is due for two checks, so one late run doesn't skip them
+DIGEST_CHECK_INTERVAL = timedelta(minutes=15)
+
+# GPT-bound actions (add meal, recommendations) run on a bounded worker pool
+jobs = JobRunner(
+    workers=int(os.getenv("JOB_WORKERS", "4")),
+    queue_size=int(os.getenv("JOB_QUEUE_SIZE", "100"))
+)
+
+# Meal plans are computed locally; set to 1 to also have GPT comment on them
+MEAL_PLAN_GPT = os.getenv("MEAL_PLAN_GPT", "0") == "1"
+
+# Background re-estimation of past meals (/reestimate): its own share of the API rate, paused while users wait
+REESTIMATE_CONCURRENCY = int(os.getenv("REESTIMATE_CONCURRENCY", "2"))
+REESTIMATE_RATE = float(os.getenv("REESTIMATE_RATE", "1"))
+REESTIMATE_BATCH = int(os.getenv("REESTIMATE_BATCH", "200"))
+reestimate_job = None
+
+# Meal photos: "gpt" (vision model), "stub" (fixed answer, for tests and benchmarks) or "off"
+VISION_ESTIMATOR = os.getenv("VISION_ESTIMATOR", "gpt")
+
+# ============================================================================
+# KEYBOARDS
+# ============================================================================
+
+# Layouts use label keys; texts come from the catalog (locales/*.json)
+KEYBOARD_LAYOUTS = {
+    "language": [[f"lang_{lang}"] for lang in catalog.languages],
+    "main": [["analyst", "dietitian"]],
+    "analyst": [["add_food", "favorites"], ["delete_food", "daily_summary"], ["weekly_report", "monthly_report"], ["back"]],
+    "dietitian": [["calculate_calories", "recommendations"], ["meal_plan", "my_profile"], ["digest"], ["back"]],
+    "meal_type": [["breakfast", "lunch"], ["dinner", "snack"], ["back"]],
+    "gender": [["male", "female"], ["back"]],
+    "activity": [["sedentary"], ["light_activity"], ["moderate_activity"], ["high_activity"], ["back"]]
+}
+
+# Pseudo state for users that haven't chosen a language yet
+LANGUAGE_STATE = "choose_language"
+LANGUAGE_PROMPT = "⬇️ " + " / ".join(catalog.text(lang, "choose_language") for lang in catalog.languages) + ":"
+
+def build_keyboards() -> Dict:
+    """Every (language, keyboard) markup is built once"""
+    keyboards = {}
+    for lang in catalog.languages:
+        for name, rows in KEYBOARD_LAYOUTS.items():
+            keyboard = [[catalog.labels[key][lang] for key in row] for row in rows]
+            keyboards[(lang, name)] = ReplyKeyboardMarkup(
+                keyboard, resize_keyboard=True, one_time_keyboard=(name == "language")
+            )
+    return keyboards
+
+KEYBOARDS = build_keyboards()
+router = ConversationRouter(catalog.labels)
+
 # ============================================================================
 # HELPER FUNCTIONS
 # ============================================================================
@@ -38,348 +150,316 @@ coordinator = SimpleCoordinator()
 def user_has_language(user_id: int) -> bool:
     return user_id in coordinator.user_languages
 
-def is_language_command(text: str) -> bool:
-    return text in ["🇺🇦 Українська", "🇬🇧 English"]
-
-def is_main_menu_command(text: str) -> bool:
-    """Main menu commands - WITHOUT deletion buttons"""
-    commands = [
-        "📊 Аналітик", "📊 Analyst", "🍎 Дієтолог", "🍎 Dietitian",
-        "➕ Додати їжу", "➕ Add food", "🗑️ Видалити їжу", "🗑️ Delete food",
-        "📊 Підсумок дня", "📊 Daily summary", "🧮 Розрахувати калораж",
-        "🧮 Calculate calories", "💡 Рекомендації", "💡 Recommendations",
-        "📋 Мій профіль", "📋 My profile", "⬅️ Назад", "⬅️ Back"
-    ]
-    return text in commands
-
-def is_delete_button(text: str) -> bool:
-    """Check deletion button"""
-    # Looking for pattern: starts with emoji (🌅🌞🌙🍪) and contains calories
-    import re
-    return bool(re.match(r'^[🌅🌞🌙🍪].*\(\d+\s*(ккал|kcal)\)$', text))
+def reply(update: Update, text: str, reply_markup=None):
+    """Queue a message to the update's chat. Not awaited on purpose: texts queued
+    back to back (result + menu) are merged into one message by the outbox."""
+    return outbox.send(update.effective_chat.id, text, reply_markup=reply_markup)
+
+def edit(query, text: str, reply_markup=None):
+    return outbox.edit(query.message.chat_id, query.message.message_id, text, reply_markup=reply_markup)
+
+def keyboard(lang: str, name: str) -> ReplyKeyboardMarkup:
+    return KEYBOARDS.get((lang, name)) or KEYBOARDS[(catalog.default, name)]
+
+async def ask_language(update: Update):
+    reply(update, LANGUAGE_PROMPT, reply_markup=keyboard(catalog.default, "language"))
 
 # ============================================================================
 # MENUS
 # ============================================================================
 
-async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    lang = coordinator.user_languages.get(user_id, "uk")
-
-    if lang == "uk":
-        keyboard = [["📊 Аналітик", "🍎 Дієтолог"]]
-        text = "🏠 Головне меню\n\n📊 Аналітик - підрахунок КБЖУ\n🍎 Дієтолог - рекомендації"
-    else:
-        keyboard = [["📊 Analyst", "🍎 Dietitian"]]
-        text = "🏠 Main Menu\n\n📊 Analyst - KBJU calculation\n🍎 Dietitian - recommendations"
-
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    await update.message.reply_text(text, reply_markup=reply_markup)
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, lang: str = None):
+    if lang is None:
+        lang = coordinator.user_languages.get(update.effective_user.id, catalog.default)
+    reply(update, catalog.text(lang, "main_menu"), reply_markup=keyboard(lang, "main"))
 
 async def show_analyst_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, lang: str):
-    if lang == "uk":
-        keyboard = [
-            ["➕ Додати їжу", "🗑️ Видалити їжу"],
-            ["📊 Підсумок дня"],
-            ["⬅️ Назад"]
-        ]
-        text = "📊 Аналітик\n\nОберіть дію:"
-    else:
-        keyboard = [
-            ["➕ Add food", "🗑️ Delete food"],
-            ["📊 Daily summary"],
-            ["⬅️ Back"]
-        ]
-        text = "📊 Analyst\n\nChoose action:"
-
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    await update.message.reply_text(text, reply_markup=reply_markup)
+    reply(update, catalog.text(lang, "analyst_menu"), reply_markup=keyboard(lang, "analyst"))
 
 async def show_dietitian_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, lang: str):
-    if lang == "uk":
-        keyboard = [
-            ["🧮 Розрахувати калораж", "💡 Рекомендації"],
-            ["📋 Мій профіль", "⬅️ Назад"]
-        ]
-        text = "🍎 Дієтолог\n\nОберіть дію:"
-    else:
-        keyboard = [
-            ["🧮 Calculate calories", "💡 Recommendations"],
-            ["📋 My profile", "⬅️ Back"]
-        ]
-        text = "🍎 Dietitian\n\nChoose action:"
-
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    await update.message.reply_text(text, reply_markup=reply_markup)
+    reply(update, catalog.text(lang, "dietitian_menu"), reply_markup=keyboard(lang, "dietitian"))
 
 # ============================================================================
 # RESULT HANDLER - COMPLETELY FIXED
 # ============================================================================
 
+def format_profile(profile: Dict, lang: str, key: str) -> str:
+    """Profile and calorie calculation results share the same fields"""
+    calories = profile.get("calories", {})
+    return catalog.render(
+        lang, key,
+        age=profile.get("age"),
+        weight=profile.get("weight"),
+        height=profile.get("height"),
+        gender=catalog.text(lang, "gender_female" if profile.get("gender") == "female" else "gender_male"),
+        bmr=calories.get("bmr", "N/A"),
+        maintain=calories.get("maintain", "N/A"),
+        lose=calories.get("lose", "N/A"),
+        gain=calories.get("gain", "N/A"),
+        updated_at=profile.get("updated_at", "N/A")[:16].replace("T", " ")
+    )
+
+def format_result(result: Dict, lang: str) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Coordinator result -> message text and optional inline keyboard"""
+    status = result.get("status", "unknown")
+
+    if status == "success":
+        # 1. KBJU result (food addition)
+        if "kbju" in result:
+            kbju = result["kbju"]
+            message = catalog.render(
+                lang, "meal_added",
+                calories=kbju.get("calories", 0),
+                protein=kbju.get("protein", 0),
+                fat=kbju.get("fat", 0),
+                carbs=kbju.get("carbs", 0),
+                analysis=kbju.get("analysis", "")
+            ) + result.get("budget", "")
+
+        # 2. Dish list for deletion WITH BUTTONS
+        elif "entries" in result and result.get("action") == "show_delete_list":
+            unit = catalog.text(lang, "kcal")
+
+            # Callback data carries the entry ID, so trimmed button text doesn't matter
+            buttons = []
+            for entry in result["entries"]:
+                description = entry['description']
+                if len(description) > 35:
+                    description = description[:35] + "..."
+                button_text = f"{description} ({entry['calories']} {unit})"
+                buttons.append([InlineKeyboardButton(button_text, callback_data=f"del:{entry['id']}")])
+            buttons.append([InlineKeyboardButton(catalog.labels["back"][lang], callback_data="del:cancel")])
+
+            return catalog.text(lang, "delete_choose"), InlineKeyboardMarkup(buttons)
+
+        # 3. Favorites WITH BUTTONS - one tap logs the meal again
+        elif "favorites" in result and result.get("action") == "show_favorites":
+            unit = catalog.text(lang, "kcal")
+
+            buttons = []
+            for favorite in result["favorites"]:
+                description = favorite["description"]
+                if len(description) > 35:
+                    description = description[:35] + "..."
+                button_text = f"{description} ({favorite['calories']} {unit})"
+                buttons.append([InlineKeyboardButton(button_text, callback_data=f"fav:{favorite['id']}")])
+            buttons.append([InlineKeyboardButton(catalog.labels["back"][lang], callback_data="fav:cancel")])
+
+            return catalog.text(lang, "favorites_choose"), InlineKeyboardMarkup(buttons)
+
+        # 4. Daily report
+        elif "summary" in result:
+            message = result["summary"]
+
+        # 5. Recommendations
+        elif "recommendations" in result:
+            message = result["recommendations"]
+
+        # 6. User profile
+        elif "profile" in result:
+            message = format_profile(result["profile"], lang, "profile")
+
+        # 7. Calorie calculation result
+        elif "calories" in result:
+            profile = dict(result.get("user_data", {}), calories=result["calories"])
+            message = format_profile(profile, lang, "calories_result")
+
+        # 8. Regular message
+        else:
+            message = result.get("message", catalog.text(lang, "done"))
+
+    elif status == "error":
+        message = catalog.render(lang, "error_message", message=result.get("message", catalog.text(lang, "error")))
+
+    elif status == "no_data":
+        message = catalog.text(lang, "no_data")
+
+    elif status == "no_profile":
+        message = catalog.text(lang, "no_profile")
+
+    else:
+        message = result.get("message", str(result))
+
+    return message, None
+
 async def send_result(update: Update, result: Dict, lang: str):
     """COMPLETELY FIXED result sender"""
     logger.info(f"Sending result: {result}")
 
     try:
-        status = result.get("status", "unknown")
-
-        if status == "success":
-            # 1. KBJU result (food addition)
-            if "kbju" in result:
-                kbju = result["kbju"]
-                if lang == "uk":
-                    message = f"""✅ Страву додано!
-
-📊 Калорії: {kbju.get('calories', 0)} ккал
-🥩 Білки: {kbju.get('protein', 0)} г  
-🧈 Жири: {kbju.get('fat', 0)} г
-🍞 Вуглеводи: {kbju.get('carbs', 0)} г
-
-💬 {kbju.get('analysis', '')}"""
-                else:
-                    message = f"""✅ Meal added!
-
-📊 Calories: {kbju.get('calories', 0)} kcal
-🥩 Protein: {kbju.get('protein', 0)} g
-🧈 Fat: {kbju.get('fat', 0)} g
-🍞 Carbs: {kbju.get('carbs', 0)} g
-
-💬 {kbju.get('analysis', '')}"""
-
-            # 2. Dish list for deletion WITH BUTTONS
-            elif "entries" in result and result.get("action") == "show_delete_list":
-                entries = result["entries"]
-
-                # Save for deletion
-                coordinator.user_states[update.effective_user.id] = "waiting_delete_choice"
-                coordinator.user_states[f"{update.effective_user.id}_delete_entries"] = entries
-
-                if lang == "uk":
-                    message = "🗑️ Виберіть страву для видалення:"
-                    keyboard = []
-                    for entry_data in entries:
-                        entry = entry_data["entry"]
-                        # Create SIMPLE buttons without numbers
-                        button_text = f"{entry['description']} ({entry['calories']} ккал)"
-                        # Trim if too long
-                        if len(button_text) > 50:
-                            description = entry['description'][:35] + "..."
-                            button_text = f"{description} ({entry['calories']} ккал)"
-                        keyboard.append([KeyboardButton(button_text)])
-                    keyboard.append([KeyboardButton("⬅️ Назад")])
-                else:
-                    message = "🗑️ Choose meal to delete:"
-                    keyboard = []
-                    for entry_data in entries:
-                        entry = entry_data["entry"]
-                        button_text = f"{entry['description']} ({entry['calories']} kcal)"
-                        if len(button_text) > 50:
-                            description = entry['description'][:35] + "..."
-                            button_text = f"{description} ({entry['calories']} kcal)"
-                        keyboard.append([KeyboardButton(button_text)])
-                    keyboard.append([KeyboardButton("⬅️ Back")])
-
-                try:
-                    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
-                    await update.message.reply_text(message, reply_markup=reply_markup)
-                    logger.info("Delete buttons sent")
-                    return
-                except Exception as e:
-                    logger.error(f"Error with buttons: {e}")
-                    # Fallback without buttons
-                    message += "\n\n"
-                    for i, entry_data in enumerate(entries):
-                        entry = entry_data["entry"]
-                        message += f"{i + 1}. {entry['description']} ({entry['calories']} ккал)\n"
-
-            # 3. Daily report
-            elif "summary" in result:
-                message = result["summary"]
-
-            # 4. Recommendations
-            elif "recommendations" in result:
-                message = result["recommendations"]
-
-            # 5. User profile
-            elif "profile" in result:
-                profile = result["profile"]
-                calories = profile.get("calories", {})
-                if lang == "uk":
-                    message = f"""📋 Ваш профіль:
-
-👤 Дані:
-• Вік: {profile.get('age')} років
-• Вага: {profile.get('weight')} кг
-• Зріст: {profile.get('height')} см
-• Стать: {"жінка" if profile.get('gender') == 'female' else "чоловік"}
-
-📊 Денний калораж:
-• Підтримання ваги: {calories.get('maintain', 'N/A')} ккал/день
-• Для схуднення: {calories.get('lose', 'N/A')} ккал/день
-• Для набору ваги: {calories.get('gain', 'N/A')} ккал/день
-
-🕐 Оновлено: {profile.get('updated_at', 'N/A')[:16].replace('T', ' ')}"""
-                else:
-                    message = f"""📋 Your profile:
-
-👤 Data:
-• Age: {profile.get('age')} years
-• Weight: {profile.get('weight')} kg
-• Height: {profile.get('height')} cm
-• Gender: {profile.get('gender')}
-
-📊 Daily calories:
-• Maintain: {calories.get('maintain', 'N/A')} kcal/day
-• Lose: {calories.get('lose', 'N/A')} kcal/day
-• Gain: {calories.get('gain', 'N/A')} kcal/day
-
-🕐 Updated: {profile.get('updated_at', 'N/A')[:16].replace('T', ' ')}"""
-
-            # 6. Calorie calculation result
-            elif "calories" in result:
-                calories = result["calories"]
-                user_data = result.get("user_data", {})
-                if lang == "uk":
-                    message = f"""🧮 Розрахунок калорій завершено!
-
-👤 Ваші дані:
-• Вік: {user_data.get('age')} років
-• Вага: {user_data.get('weight')} кг
-• Зріст: {user_data.get('height')} см
-• Стать: {"жінка" if user_data.get('gender') == 'female' else "чоловік"}
-
-📊 Результати:
-• Базовий метаболізм: {calories['bmr']} ккал/день
-• Підтримання ваги: {calories['maintain']} ккал/день
-• Для схуднення: {calories['lose']} ккал/день
-• Для набору ваги: {calories['gain']} ккал/день
-
-✅ Профіль збережено!"""
-                else:
-                    message = f"""🧮 Calorie calculation completed!
-
-👤 Your data:
-• Age: {user_data.get('age')} years
-• Weight: {user_data.get('weight')} kg
-• Height: {user_data.get('height')} cm
-• Gender: {user_data.get('gender')}
-
-📊 Results:
-• Basal metabolism: {calories['bmr']} kcal/day
-• Maintain weight: {calories['maintain']} kcal/day
-• Lose weight: {calories['lose']} kcal/day
-• Gain weight: {calories['gain']} kcal/day
-
-✅ Profile saved!"""
-
-            # 7. Regular message
-            else:
-                message = result.get("message", "✅ Готово!" if lang == "uk" else "✅ Done!")
-
-        elif status == "error":
-            message = f"❌ {result.get('message', 'Помилка' if lang == 'uk' else 'Error')}"
-
-        elif status == "no_data":
-            if lang == "uk":
-                message = "📭 Немає даних за сьогодні\n\nДодайте спочатку їжу через 'Додати їжу'"
-            else:
-                message = "📭 No data for today\n\nAdd food first through 'Add food'"
-
-        elif status == "no_profile":
-            if lang == "uk":
-                message = "❌ Профіль не знайдено\n\nСпочатку розрахуйте калораж через 'Дієтолог' → 'Розрахувати калораж'"
-            else:
-                message = "❌ Profile not found\n\nCalculate calories first through 'Dietitian' → 'Calculate calories'"
-
-        else:
-            message = result.get("message", str(result))
-
-        # Send message
-        await update.message.reply_text(message)
-        logger.info("Result sent successfully")
+        message, markup = format_result(result, lang)
+        reply(update, message, reply_markup=markup)
+        logger.info("Result queued")
 
     except Exception as e:
         logger.error(f"Error in send_result: {e}")
-        error_msg = "❌ Помилка" if lang == "uk" else "❌ Error"
         try:
-            await update.message.reply_text(error_msg)
+            reply(update, catalog.text(lang, "error_generic"))
         except:
             logger.error("Failed to send error message")
 
+# ============================================================================
+# BACKGROUND JOBS
+# ============================================================================
+
+def run_in_background(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, lang: str,
+                      action: str, data: Dict, show_menu=None):
+    """GPT-bound actions: acknowledge with typing + placeholder right away,
+    run the action on the job pool and edit the placeholder with the result"""
+    if jobs.full():
+        reply(update, catalog.text(lang, "jobs_busy"))
+        return
+
+    chat_id = update.effective_chat.id
+    outbox.chat_action(chat_id, ChatAction.TYPING)
+    placeholder = outbox.send(chat_id, catalog.text(lang, "working"), merge=False)
+
+    async def job():
+        try:
+            result = await coordinator.route_request(user_id, action, data)
+            message, markup = format_result(result, lang)
+        except Exception as e:
+            logger.error(f"Background {action} failed: {e}")
+            message, markup = catalog.text(lang, "error_generic"), None
+
+        # The placeholder takes the first piece of a long result, the rest follow as new messages
+        first, *rest = split_text(message)
+        try:
+            sent = await placeholder
+            await outbox.edit(chat_id, sent.message_id, first, reply_markup=None if rest else markup)
+        except Exception as e:
+            logger.warning(f"Editing the placeholder failed, sending the result instead: {e}")
+            rest.insert(0, first)
+        if rest:
+            outbox.send(chat_id, "\n".join(rest), reply_markup=markup)
+
+        if show_menu is not None:
+            await show_menu(update, context, lang)
+
+    jobs.submit(action, job)
+
 # ============================================================================
 # MESSAGE HANDLERS
 # ============================================================================
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"/start from user {update.effective_user.id}")
+    await ask_language(update)
 
-    keyboard = [
-        [KeyboardButton("🇺🇦 Українська")],
-        [KeyboardButton("🇬🇧 English")]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
-    await update.message.reply_text("⬇️ Виберіть мову / Choose language:", reply_markup=reply_markup)
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runtime counters for admins"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
 
-async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text
+    lines = ["📈 Stats"]
+    for key, value in update_processor.stats().items():
+        lines.append(f"• updates.{key}: {value}")
+    for key, value in outbox.stats().items():
+        lines.append(f"• outbox.{key}: {value}")
+    job_stats = jobs.stats()
+    durations = job_stats.pop("durations")
+    for key, value in job_stats.items():
+        lines.append(f"• jobs.{key}: {value}")
+    for name, histogram in durations.items():
+        buckets = ", ".join(f"{label}: {n}" for label, n in histogram["buckets"].items())
+        lines.append(f"• job {name}: {histogram['count']}x, avg {histogram['avg_s']} s, max {histogram['max_s']} s ({buckets})")
+    if webhook_server is not None:
+        for key, value in webhook_server.stats().items():
+            lines.append(f"• webhook.{key}: {value}")
+    cohort = load_cohort_summary()
+    if cohort:
+        adherence = cohort["adherence"]["adherent_day_share"]
+        lines.append(f"• cohort: {cohort['users']} users, {cohort['entries']} entries, "
+                     f"{adherence}% days on target (generated {cohort['generated_at']})")
+    # The fallback coordinator has no agents
+    analyst = coordinator.agents.get("analyst")
+    if analyst is not None:
+        portions = analyst.portions.stats()
+        food_stats = analyst.food_search.stats()
+        lines.append(f"• food_search: {food_stats['hits']} found / {food_stats['misses']} not found, {food_stats['terms']} names")
+        photo_stats = analyst.photos.stats()
+        lines.append(f"• photo_cache: {photo_stats['hits']} reused / {photo_stats['misses']} estimated, {photo_stats['photos']} photos")
+        lines.append(f"• portion_cache: {portions['hits']} scaled / {portions['misses']} sent to GPT, {portions['items']} items")
+        if analyst.products is not None:
+            product_stats = analyst.products.stats()
+            lines.append(f"• product_index: {product_stats['hits']} found / {product_stats['misses']} unknown, "
+                         f"{product_stats['products']} products")
+    dietitian = coordinator.agents.get("dietitian")
+    if dietitian is not None:
+        planner = dietitian.meal_planner.stats()
+        lines.append(f"• meal_planner: {planner['hits']} cached / {planner['misses']} solved, {planner['foods']} foods")
+    if reestimate_job is not None and reestimate_job.state:
+        progress = reestimate_job.stats()
+        lines.append(f"• reestimate: {progress['status']} {progress['from']}..{progress['to']}, "
+                     f"{progress['processed']} done, {progress['changed']} changed, {progress['failed']} failed")
+        if progress.get("error"):
+            lines.append(f"• reestimate error: {progress['error']}")
+    for name, route_stats in router.stats().items():
+        lines.append(f"• route {name}: {route_stats['count']}x, avg {route_stats['avg_ms']} ms, max {route_stats['max_ms']} ms")
+    reply(update, "\n".join(lines))
+
+async def reestimate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: /reestimate FROM TO starts or resumes re-estimating a date range, /reestimate stop pauses, no arguments shows progress"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    if reestimate_job is None:
+        reply(update, "Re-estimation needs the OpenAI API")
+        return
+
+    args = context.args or []
+    if args == ["stop"]:
+        await reestimate_job.stop()
+    elif len(args) == 2:
+        try:
+            date_from, date_to = (date.fromisoformat(arg).isoformat() for arg in args)
+        except ValueError:
+            reply(update, "Usage: /reestimate YYYY-MM-DD YYYY-MM-DD | stop")
+            return
+        if not reestimate_job.start(date_from, date_to):
+            reply(update, "Already running - /reestimate stop first")
+            return
+    elif args:
+        reply(update, "Usage: /reestimate YYYY-MM-DD YYYY-MM-DD | stop")
+        return
+
+    lines = ["🔁 Re-estimate"]
+    for key, value in reestimate_job.stats().items():
+        lines.append(f"• {key}: {value}")
+    reply(update, "\n".join(lines))
+
+async def timezone(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/timezone Europe/Kyiv - the user's days start at local midnight; no argument shows the usage"""
     user_id = update.effective_user.id
+    lang = coordinator.user_languages.get(user_id, catalog.default)
+    if len(context.args or []) != 1:
+        reply(update, catalog.text(lang, "timezone_usage"))
+        return
 
-    if "Українська" in text:
-        coordinator.user_languages[user_id] = "uk"
-        await update.message.reply_text("✅ Мову встановлено: українська")
-        await show_main_menu(update, context)
-    elif "English" in text:
-        coordinator.user_languages[user_id] = "en"
-        await update.message.reply_text("✅ Language set to: English")
-        await show_main_menu(update, context)
+    result = await coordinator.route_request(user_id, "set_timezone", {"timezone": context.args[0], "lang": lang})
+    reply(update, result.get("message") or catalog.text(lang, "error_generic"))
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """MAIN MESSAGE HANDLER"""
     user_id = update.effective_user.id
     text = update.message.text
-    current_state = coordinator.user_states.get(user_id)
-
-    logger.info(f"User {user_id}: '{text}' (state: {current_state})")
-
-    try:
-        # 1. Check language
-        if not user_has_language(user_id):
-            if is_language_command(text):
-                await set_language(update, context)
-                return
-            else:
-                keyboard = [[KeyboardButton("🇺🇦 Українська")], [KeyboardButton("🇬🇧 English")]]
-                reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
-                await update.message.reply_text("⬇️ Виберіть мову / Choose language:", reply_markup=reply_markup)
-                return
 
+    if user_has_language(user_id):
+        current_state = coordinator.sessions.get_state(user_id)
         lang = coordinator.user_languages[user_id]
+    else:
+        current_state = LANGUAGE_STATE
+        lang = catalog.default
 
-        # 2. PRIORITY: user states
-        if current_state == "waiting_meal_type":
-            await handle_meal_type_selection(update, context, text, lang, user_id)
-            return
-
-        elif current_state == "waiting_food":
-            await handle_food_description(update, context, text, lang, user_id)
-            return
-
-        elif current_state == "waiting_delete_choice":
-            await handle_delete_choice(update, context, text, lang, user_id)
-            return
-
-        elif current_state and current_state.startswith("calorie_calc"):
-            await handle_calorie_calculation(update, context, text, lang, user_id, current_state)
-            return
+    logger.info(f"User {user_id}: '{text}' (state: {current_state})")
 
-        # 3. Menu commands
-        elif is_main_menu_command(text):
-            await handle_menu_command(update, context, text, lang, user_id)
-            return
+    try:
+        route = router.resolve(current_state, text)
+        if route is None:
+            # Stale state without routes (e.g. restored from an older version)
+            coordinator.sessions.clear(user_id)
+            route = router.resolve(None, text)
 
-        # 4. Unknown command
-        else:
-            await handle_unknown(update, context, text, lang)
+        await router.run(route, update, context, text, lang, user_id)
 
     except Exception as e:
         logger.error(f"Critical error: {e}")
@@ -388,272 +468,368 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ============================================================================
 # SPECIFIC HANDLERS
 # ============================================================================
+# Route handlers share one signature: (update, context, text, lang, user_id, arg)
 
-async def handle_meal_type_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int):
-    meal_types = ["🌅 Сніданок", "🌞 Обід", "🌙 Вечеря", "🍪 Перекус",
-                  "🌅 Breakfast", "🌞 Lunch", "🌙 Dinner", "🍪 Snack"]
+async def choose_language(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, new_lang: str):
+    coordinator.set_user_language(user_id, new_lang)
+    reply(update, catalog.text(new_lang, "language_set"))
+    await show_main_menu(update, context, new_lang)
 
-    if text in meal_types:
-        logger.info(f"Meal type selected: {text}")
-        coordinator.user_states[f"{user_id}_meal_type"] = text
-        coordinator.user_states[user_id] = "waiting_food"
+async def handle_no_language(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, arg):
+    await ask_language(update)
 
-        msg = "🍽️ Опишіть що ви їли:" if lang == "uk" else "🍽️ Describe what you ate:"
-        await update.message.reply_text(msg)
-    else:
-        msg = "❌ Оберіть тип їжі" if lang == "uk" else "❌ Select meal type"
-        await update.message.reply_text(msg)
+async def open_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, show_menu):
+    """Menu navigation - leaving a menu abandons any flow in progress"""
+    logger.info(f"Menu command: {text}")
+    coordinator.sessions.clear(user_id)
+    await show_menu(update, context, lang)
+
+async def run_action(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, action: str):
+    """Menu button that maps directly to a coordinator action"""
+    logger.info(f"Menu command: {text}")
+    coordinator.sessions.clear(user_id)
+    result = await coordinator.route_request(user_id, action, {"lang": lang})
+    await send_result(update, result, lang)
+
+async def run_background_action(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, action: str):
+    """Like run_action, for actions that wait on GPT"""
+    logger.info(f"Menu command: {text}")
+    coordinator.sessions.clear(user_id)
+    run_in_background(update, context, user_id, lang, action, {"lang": lang})
+
+async def start_add_food(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, arg):
+    coordinator.sessions.set_state(user_id, "waiting_meal_type")
+    reply(update, catalog.text(lang, "choose_meal_type"), reply_markup=keyboard(lang, "meal_type"))
+
+async def select_meal_type(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, meal_key: str):
+    meal_type = catalog.labels[meal_key][lang]
+    logger.info(f"Meal type selected: {meal_type}")
+    session = coordinator.sessions.set_state(user_id, "waiting_food")
+    session.meal_type = meal_type
+    reply(update, catalog.text(lang, "describe_food"))
+
+async def start_meal_plan(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, arg):
+    coordinator.sessions.set_state(user_id, "waiting_plan_meal_type")
+    reply(update, catalog.text(lang, "choose_meal_type"), reply_markup=keyboard(lang, "meal_type"))
+
+async def select_plan_meal_type(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, meal_key: str):
+    coordinator.sessions.clear(user_id)
+    data = {"lang": lang, "meal_type": meal_key, "phrase": MEAL_PLAN_GPT}
+    if MEAL_PLAN_GPT:
+        run_in_background(update, context, user_id, lang, "meal_plan", data, show_dietitian_menu)
+        return
+
+    result = await coordinator.route_request(user_id, "meal_plan", data)
+    await send_result(update, result, lang)
+    await show_dietitian_menu(update, context, lang)
 
-async def handle_food_description(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int):
+async def handle_food_description(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, arg):
     logger.info(f"Food description: {text}")
 
-    meal_type = coordinator.user_states.get(f"{user_id}_meal_type", "")
+    session = coordinator.sessions.get(user_id)
+    meal_type = session.meal_type if session else None
     meal_desc = f"{meal_type}: {text}" if meal_type else text
 
     # Clear states
-    coordinator.user_states[user_id] = None
-    coordinator.user_states.pop(f"{user_id}_meal_type", None)
+    coordinator.sessions.clear(user_id)
 
-    # Process food
-    result = await coordinator.route_request(user_id, "add_meal", {"meal_desc": meal_desc, "lang": lang})
-    await send_result(update, result, lang)
-    await show_analyst_menu(update, context, lang)
+    # Process food - KBJU estimation waits on GPT
+    run_in_background(update, context, user_id, lang, "add_meal", {"meal_desc": meal_desc, "lang": lang}, show_analyst_menu)
 
-async def handle_delete_choice(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int):
-    """NEW LOGIC for deletion through buttons"""
+async def handle_delete_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline delete button - callback data is del:<entry id> or del:cancel"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    lang = coordinator.user_languages.get(user_id, catalog.default)
+    await query.answer()
 
-    # Back button
-    if text in ["⬅️ Назад", "⬅️ Back"]:
+    entry_id = query.data.split(":", 1)[1]
+    if entry_id == "cancel":
         logger.info("Back button pressed during deletion")
-        coordinator.user_states[user_id] = None
-        coordinator.user_states.pop(f"{user_id}_delete_entries", None)
-        await show_analyst_menu(update, context, lang)
+        edit(query, catalog.text(lang, "delete_cancelled"))
         return
 
-    # Search dish by button text
-    entries = coordinator.user_states.get(f"{user_id}_delete_entries", [])
-
-    if entries:
-        # Search entry by button content
-        selected_entry = None
-        selected_index = None
-
-        for entry_data in entries:
-            entry = entry_data["entry"]
-            # Check if dish description is contained in button text
-            if entry['description'] in text and str(entry['calories']) in text:
-                selected_entry = entry
-                selected_index = entry_data["index"]
-                break
-
-        if selected_entry and selected_index is not None:
-            logger.info(f"Found meal to delete: {selected_entry['description']}")
-
-            # Delete dish
-            result = await coordinator.route_request(user_id, "confirm_delete", {"index": selected_index, "lang": lang})
-
-            # Clear state
-            coordinator.user_states[user_id] = None
-            coordinator.user_states.pop(f"{user_id}_delete_entries", None)
-
-            await send_result(update, result, lang)
-            await show_analyst_menu(update, context, lang)
-        else:
-            logger.warning(f"Could not find meal to delete: {text}")
-            msg = "❌ Страву не знайдено. Оберіть з списку." if lang == "uk" else "❌ Meal not found. Choose from list."
-            await update.message.reply_text(msg)
+    result = await coordinator.route_request(user_id, "confirm_delete", {"entry_id": entry_id, "lang": lang})
+    if result.get("status") == "success":
+        edit(query, f"✅ {result['message']}")
     else:
-        msg = "❌ Список порожній" if lang == "uk" else "❌ List is empty"
-        await update.message.reply_text(msg)
-
-async def handle_calorie_calculation(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, current_state: str):
-    """Handle calorie calculation"""
-
-    if current_state == "calorie_calc_age":
-        try:
-            age = int(text)
-            coordinator.user_states[f"{user_id}_age"] = age
-            coordinator.user_states[user_id] = "calorie_calc_weight"
-            msg = "⚖️ Введіть вашу вагу (кг):" if lang == "uk" else "⚖️ Enter your weight (kg):"
-            await update.message.reply_text(msg)
-        except ValueError:
-            msg = "❌ Введіть число (наприклад: 25)" if lang == "uk" else "❌ Enter a number (e.g.: 25)"
-            await update.message.reply_text(msg)
-
-    elif current_state == "calorie_calc_weight":
-        try:
-            weight = float(text)
-            coordinator.user_states[f"{user_id}_weight"] = weight
-            coordinator.user_states[user_id] = "calorie_calc_height"
-            msg = "📏 Введіть ваш зріст (см):" if lang == "uk" else "📏 Enter your height (cm):"
-            await update.message.reply_text(msg)
-        except ValueError:
-            msg = "❌ Введіть число (наприклад: 70)" if lang == "uk" else "❌ Enter a number (e.g.: 70)"
-            await update.message.reply_text(msg)
-
-    elif current_state == "calorie_calc_height":
-        try:
-            height = int(text)
-            coordinator.user_states[f"{user_id}_height"] = height
-            coordinator.user_states[user_id] = "calorie_calc_gender"
-
-            if lang == "uk":
-                keyboard = [["👨 Чоловік", "👩 Жінка"], ["⬅️ Назад"]]
-                text_msg = "👤 Оберіть стать:"
-            else:
-                keyboard = [["👨 Male", "👩 Female"], ["⬅️ Back"]]
-                text_msg = "👤 Choose gender:"
-
-            reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-            await update.message.reply_text(text_msg, reply_markup=reply_markup)
-        except ValueError:
-            msg = "❌ Введіть число (наприклад: 175)" if lang == "uk" else "❌ Enter a number (e.g.: 175)"
-            await update.message.reply_text(msg)
-
-    elif current_state == "calorie_calc_gender":
-        gender_map = {"👨 Чоловік": "male", "👩 Жінка": "female", "👨 Male": "male", "👩 Female": "female"}
-
-        if text in gender_map:
-            coordinator.user_states[f"{user_id}_gender"] = gender_map[text]
-            coordinator.user_states[user_id] = "calorie_calc_activity"
-
-            if lang == "uk":
-                keyboard = [
-                    ["🛋 Сидячий спосіб життя"],
-                    ["🚶 Легка активність"],
-                    ["🏃 Помірна активність"],
-                    ["💪 Висока активність"],
-                    ["⬅️ Назад"]
-                ]
-                text_msg = "🏃 Оберіть рівень активності:"
-            else:
-                keyboard = [
-                    ["🛋 Sedentary lifestyle"],
-                    ["🚶 Light activity"],
-                    ["🏃 Moderate activity"],
-                    ["💪 High activity"],
-                    ["⬅️ Back"]
-                ]
-                text_msg = "🏃 Choose activity level:"
-
-            reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-            await update.message.reply_text(text_msg, reply_markup=reply_markup)
-        else:
-            msg = "❌ Оберіть стать" if lang == "uk" else "❌ Choose gender"
-            await update.message.reply_text(msg)
-
-    elif current_state == "calorie_calc_activity":
-        activity_map = {
-            "🛋 Сидячий спосіб життя": 1.2, "🚶 Легка активність": 1.375,
-            "🏃 Помірна активність": 1.55, "💪 Висока активність": 1.725,
-            "🛋 Sedentary lifestyle": 1.2, "🚶 Light activity": 1.375,
-            "🏃 Moderate activity": 1.55, "💪 High activity": 1.725
-        }
+        edit(query, catalog.render(lang, "error_message", message=result.get("message", catalog.text(lang, "error"))))
 
-        if text in activity_map:
-            # Collect all data
-            age = coordinator.user_states.get(f"{user_id}_age")
-            weight = coordinator.user_states.get(f"{user_id}_weight")
-            height = coordinator.user_states.get(f"{user_id}_height")
-            gender = coordinator.user_states.get(f"{user_id}_gender")
-
-            if all([age, weight, height, gender]):
-                user_data = {
-                    "age": age,
-                    "weight": weight,
-                    "height": height,
-                    "gender": gender,
-                    "activity_coefficient": activity_map[text]
-                }
-
-                # Clear states
-                coordinator.user_states[user_id] = None
-                for key in [f"{user_id}_age", f"{user_id}_weight", f"{user_id}_height", f"{user_id}_gender"]:
-                    coordinator.user_states.pop(key, None)
-
-                # Calculate calories
-                result = await coordinator.route_request(user_id, "calculate_calories", {"user_data": user_data})
-                await send_result(update, result, lang)
-                await show_dietitian_menu(update, context, lang)
-            else:
-                msg = "❌ Помилка даних" if lang == "uk" else "❌ Data error"
-                await update.message.reply_text(msg)
-        else:
-            msg = "❌ Оберіть активність" if lang == "uk" else "❌ Choose activity"
-            await update.message.reply_text(msg)
+async def handle_favorite_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline favorite button - callback data is fav:<favorite id> or fav:cancel"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    lang = coordinator.user_languages.get(user_id, catalog.default)
+    await query.answer()
 
-async def handle_menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int):
-    """Handle menu commands"""
-    logger.info(f"Menu command: {text}")
+    favorite_id = query.data.split(":", 1)[1]
+    if favorite_id == "cancel":
+        edit(query, catalog.text(lang, "favorites_closed"))
+        return
 
-    # Clear states
-    coordinator.user_states[user_id] = None
+    result = await coordinator.route_request(user_id, "relog_favorite", {"favorite_id": favorite_id, "lang": lang})
+    message, _ = format_result(result, lang)
+    edit(query, message)
 
-    if text in ["📊 Аналітик", "📊 Analyst"]:
-        await show_analyst_menu(update, context, lang)
+async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Photo while adding food: a barcode (the caption may carry the grams) or the meal itself"""
+    user_id = update.effective_user.id
+    if not user_has_language(user_id):
+        await ask_language(update)
+        return
+    lang = coordinator.user_languages[user_id]
 
-    elif text in ["🍎 Дієтолог", "🍎 Dietitian"]:
-        await show_dietitian_menu(update, context, lang)
+    session = coordinator.sessions.get(user_id)
+    if coordinator.sessions.get_state(user_id) != "waiting_food":
+        reply(update, catalog.text(lang, "photo_needs_meal_type"))
+        return
 
-    elif text in ["➕ Додати їжу", "➕ Add food"]:
-        coordinator.user_states[user_id] = "waiting_meal_type"
+    try:
+        # Largest size Telegram has: barcodes need the detail, meal photos are downscaled later anyway
+        photo = await update.message.photo[-1].get_file()
+        image = bytes(await photo.download_as_bytearray())
+        barcode = await asyncio.to_thread(decode_barcode, image)
+    except Exception as e:
+        logger.error(f"Photo download failed: {e}")
+        await handle_error(update, context, user_id)
+        return
 
-        if lang == "uk":
-            keyboard = [["🌅 Сніданок", "🌞 Обід"], ["🌙 Вечеря", "🍪 Перекус"], ["⬅️ Назад"]]
-            msg = "🍽️ Оберіть тип прийому їжі:"
-        else:
-            keyboard = [["🌅 Breakfast", "🌞 Lunch"], ["🌙 Dinner", "🍪 Snack"], ["⬅️ Back"]]
-            msg = "🍽️ Choose meal type:"
+    caption = (update.message.caption or "").strip()
+    meal_type = session.meal_type
+    coordinator.sessions.clear(user_id)
 
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        await update.message.reply_text(msg, reply_markup=reply_markup)
+    if barcode is not None:
+        text = f"{barcode} {caption}".strip()
+        meal_desc = f"{meal_type}: {text}" if meal_type else text
+        logger.info(f"Barcode photo: {text}")
+        run_in_background(update, context, user_id, lang, "add_meal", {"meal_desc": meal_desc, "lang": lang}, show_analyst_menu)
+        return
 
-    elif text in ["📊 Підсумок дня", "📊 Daily summary"]:
-        result = await coordinator.route_request(user_id, "daily_summary", {"lang": lang})
-        await send_result(update, result, lang)
+    logger.info(f"Meal photo: {len(image)} bytes, caption '{caption}'")
+    data = {"image": image, "caption": caption, "meal_type": meal_type, "lang": lang}
+    run_in_background(update, context, user_id, lang, "add_photo", data, show_analyst_menu)
 
-    elif text in ["🗑️ Видалити їжу", "🗑️ Delete food"]:
-        result = await coordinator.route_request(user_id, "delete_meal", {"lang": lang})
-        await send_result(update, result, lang)
+async def start_calorie_calc(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, arg):
+    coordinator.sessions.set_state(user_id, "calorie_calc_age")
+    reply(update, catalog.text(lang, "enter_age"))
 
-    elif text in ["🧮 Розрахувати калораж", "🧮 Calculate calories"]:
-        coordinator.user_states[user_id] = "calorie_calc_age"
-        msg = "👤 Введіть ваш вік (число):" if lang == "uk" else "👤 Enter your age (number):"
-        await update.message.reply_text(msg)
+async def enter_age(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, arg):
+    try:
+        age = int(text)
+        session = coordinator.sessions.set_state(user_id, "calorie_calc_weight")
+        session.age = age
+        reply(update, catalog.text(lang, "enter_weight"))
+    except ValueError:
+        reply(update, catalog.text(lang, "invalid_age"))
+
+async def enter_weight(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, arg):
+    try:
+        weight = float(text)
+        session = coordinator.sessions.set_state(user_id, "calorie_calc_height")
+        session.weight = weight
+        reply(update, catalog.text(lang, "enter_height"))
+    except ValueError:
+        reply(update, catalog.text(lang, "invalid_weight"))
+
+async def enter_height(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, arg):
+    try:
+        height = int(text)
+        session = coordinator.sessions.set_state(user_id, "calorie_calc_gender")
+        session.height = height
+        reply(update, catalog.text(lang, "choose_gender"), reply_markup=keyboard(lang, "gender"))
+    except ValueError:
+        reply(update, catalog.text(lang, "invalid_height"))
+
+async def select_gender(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, gender: str):
+    session = coordinator.sessions.set_state(user_id, "calorie_calc_activity")
+    session.gender = gender
+    reply(update, catalog.text(lang, "choose_activity"), reply_markup=keyboard(lang, "activity"))
+
+async def select_activity(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, activity_key: str):
+    # Collect all data
+    session = coordinator.sessions.get(user_id)
+    age = session.age if session else None
+    weight = session.weight if session else None
+    height = session.height if session else None
+    gender = session.gender if session else None
+
+    if all([age, weight, height, gender]):
+        user_data = {
+            "age": age,
+            "weight": weight,
+            "height": height,
+            "gender": gender,
+            "activity_coefficient": ACTIVITY_COEFFICIENTS[activity_key]
+        }
 
-    elif text in ["💡 Рекомендації", "💡 Recommendations"]:
-        result = await coordinator.route_request(user_id, "get_recommendations", {"lang": lang})
-        await send_result(update, result, lang)
+        # Clear states
+        coordinator.sessions.clear(user_id)
 
-    elif text in ["📋 Мій профіль", "📋 My profile"]:
-        result = await coordinator.route_request(user_id, "show_profile", {"lang": lang})
+        # Calculate calories
+        result = await coordinator.route_request(user_id, "calculate_calories", {"user_data": user_data})
         await send_result(update, result, lang)
+        await show_dietitian_menu(update, context, lang)
+    else:
+        reply(update, catalog.text(lang, "data_error"))
 
-    elif text in ["⬅️ Назад", "⬅️ Back"]:
-        await show_main_menu(update, context)
+async def reply_hint(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, hint_key: str):
+    """Unexpected input inside a button step - repeat what is expected"""
+    reply(update, catalog.text(lang, hint_key))
 
-async def handle_unknown(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str):
+async def handle_unknown(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str, user_id: int, arg):
     """Handle unknown commands"""
     logger.info(f"Unknown: {text}")
-    msg = "❌ Невідома команда" if lang == "uk" else "❌ Unknown command"
-    await update.message.reply_text(msg)
-    await show_main_menu(update, context)
+    reply(update, catalog.text(lang, "unknown_command"))
+    await show_main_menu(update, context, lang)
 
 async def handle_error(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
     """Handle errors"""
     try:
-        lang = coordinator.user_languages.get(user_id, "uk")
-        msg = "❌ Помилка" if lang == "uk" else "❌ Error"
-        await update.message.reply_text(msg)
-        coordinator.user_states[user_id] = None
+        lang = coordinator.user_languages.get(user_id, catalog.default)
+        reply(update, catalog.text(lang, "error_generic"))
+        coordinator.sessions.clear(user_id)
         await show_main_menu(update, context)
     except:
         logger.error("Failed to handle error")
 
+# ============================================================================
+# CONVERSATION FLOWS
+# ============================================================================
+# (state, label keys - None means any text, handler, optional handler arg)
+
+FLOWS = [
+    *[(LANGUAGE_STATE, [f"lang_{lang}"], choose_language, lang) for lang in catalog.languages],
+    (LANGUAGE_STATE, None, handle_no_language),
+
+    # Main menus
+    (None, ["analyst"], open_menu, show_analyst_menu),
+    (None, ["dietitian"], open_menu, show_dietitian_menu),
+    (None, ["back"], open_menu, show_main_menu),
+    (None, ["add_food"], start_add_food),
+    (None, ["daily_summary"], run_action, "daily_summary"),
+    (None, ["favorites"], run_action, "favorites"),
+    (None, ["delete_food"], run_action, "delete_meal"),
+    (None, ["weekly_report"], run_background_action, "weekly_report"),
+    (None, ["monthly_report"], run_background_action, "monthly_report"),
+    (None, ["calculate_calories"], start_calorie_calc),
+    (None, ["recommendations"], run_background_action, "get_recommendations"),
+    (None, ["meal_plan"], start_meal_plan),
+    (None, ["my_profile"], run_action, "show_profile"),
+    (None, ["digest"], run_action, "toggle_digest"),
+    (None, None, handle_unknown),
+
+    # Add food
+    ("waiting_meal_type", ["breakfast", "lunch", "dinner", "snack"], select_meal_type),
+    ("waiting_meal_type", ["back"], open_menu, show_analyst_menu),
+    ("waiting_meal_type", None, reply_hint, "hint_meal_type"),
+    ("waiting_food", ["back"], open_menu, show_analyst_menu),
+    ("waiting_food", None, handle_food_description),
+
+    # Meal plan
+    ("waiting_plan_meal_type", ["breakfast", "lunch", "dinner", "snack"], select_plan_meal_type),
+    ("waiting_plan_meal_type", ["back"], open_menu, show_dietitian_menu),
+    ("waiting_plan_meal_type", None, reply_hint, "hint_meal_type"),
+
+    # Calorie calculation
+    ("calorie_calc_age", ["back"], open_menu, show_dietitian_menu),
+    ("calorie_calc_age", None, enter_age),
+    ("calorie_calc_weight", ["back"], open_menu, show_dietitian_menu),
+    ("calorie_calc_weight", None, enter_weight),
+    ("calorie_calc_height", ["back"], open_menu, show_dietitian_menu),
+    ("calorie_calc_height", None, enter_height),
+    ("calorie_calc_gender", ["male"], select_gender, "male"),
+    ("calorie_calc_gender", ["female"], select_gender, "female"),
+    ("calorie_calc_gender", ["back"], open_menu, show_dietitian_menu),
+    ("calorie_calc_gender", None, reply_hint, "hint_gender"),
+    ("calorie_calc_activity", ["sedentary", "light_activity", "moderate_activity", "high_activity"], select_activity),
+    ("calorie_calc_activity", ["back"], open_menu, show_dietitian_menu),
+    ("calorie_calc_activity", None, reply_hint, "hint_activity"),
+]
+
+router.compile(FLOWS)
+
 # ============================================================================
 # BOT STARTUP
 # ============================================================================
 
+async def send_daily_digests(context: ContextTypes.DEFAULT_TYPE):
+    """Scheduled: digests of users whose evening just started are built in one pass, the outbox paces delivery"""
+    digests = coordinator.due_digests(DIGEST_TIME, 2 * DIGEST_CHECK_INTERVAL)
+    for user_id, text in digests.items():
+        # Private chat ID is the user ID
+        outbox.send(user_id, text)
+    if digests:
+        logger.info(f"Queued {len(digests)} daily digests")
+
+async def post_init(application):
+    """Restore agent state from the latest snapshot + event log tail"""
+    outbox.bind(application.bot)
+    await jobs.start()
+    await coordinator.restore_state()
+    logger.info("Agent state restored")
+    if "analyst" in coordinator.agents:
+        coordinator.agents["analyst"].vision = create_vision_estimator(VISION_ESTIMATOR)
+        logger.info(f"Photo estimator: {VISION_ESTIMATOR}")
+
+    global reestimate_job
+    reestimate_job = coordinator.create_reestimate_job(
+        concurrency=REESTIMATE_CONCURRENCY,
+        rate=REESTIMATE_RATE,
+        batch_size=REESTIMATE_BATCH,
+        is_busy=lambda: jobs.queue.qsize() > 0
+    )
+    # An unfinished range carries on after a restart
+    if reestimate_job is not None and reestimate_job.start():
+        logger.info("Resumed re-estimation from its checkpoint")
+
+    if application.job_queue is not None:
+        # Checks fall on whole quarter hours, so DIGEST_TIME in any offset (+05:30 too) is hit on time
+        interval = DIGEST_CHECK_INTERVAL.total_seconds()
+        application.job_queue.run_repeating(
+            send_daily_digests, interval=interval, first=interval - datetime.now().timestamp() % interval,
+            name="daily_digest"
+        )
+    else:
+        logger.warning("Job queue unavailable (install python-telegram-bot[job-queue]), daily digests disabled")
+
+async def post_stop(application):
+    """Finish running jobs and flush queued messages while the bot can still send them"""
+    if reestimate_job is not None:
+        await reestimate_job.stop()
+    await jobs.stop()
+    await outbox.close()
+
+async def post_shutdown(application):
+    """Snapshot agent state so the next start replays nothing"""
+    coordinator.snapshot()
+    logger.info("Agent state snapshot saved")
+
+async def run_webhook(app):
+    """Serve updates through the built-in webhook endpoint until interrupted"""
+    global webhook_server
+    webhook_server = WebhookServer(app, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET)
+
+    # run_polling calls these hooks itself, here the lifecycle is ours
+    await app.initialize()
+    await post_init(app)
+    try:
+        if WEBHOOK_URL:
+            await app.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                drop_pending_updates=True
+            )
+        await app.start()
+        await webhook_server.start()
+        await asyncio.Event().wait()
+    finally:
+        await webhook_server.stop()
+        if app.running:
+            await app.stop()
+            await post_stop(app)
+        await app.shutdown()
+        await post_shutdown(app)
+
 def main():
     """Start bot"""
     logger.info("Starting bot...")
@@ -666,11 +842,25 @@ def main():
     logger.info(f"Token: {TOKEN[:10]}...")
 
     try:
-        app = ApplicationBuilder().token(TOKEN).build()
+        app = (
+            ApplicationBuilder()
+            .token(TOKEN)
+            .post_init(post_init)
+            .post_stop(post_stop)
+            .post_shutdown(post_shutdown)
+            .concurrent_updates(update_processor)
+            .build()
+        )
 
         # Handlers
         app.add_handler(CommandHandler("start", start))
+        app.add_handler(CommandHandler("stats", stats))
+        app.add_handler(CommandHandler("reestimate", reestimate))
+        app.add_handler(CommandHandler("timezone", timezone))
+        app.add_handler(CallbackQueryHandler(handle_delete_callback, pattern=r"^del:"))
+        app.add_handler(CallbackQueryHandler(handle_favorite_callback, pattern=r"^fav:"))
         app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+        app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
 
         # Error handler
         async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -678,9 +868,15 @@ def main():
 
         app.add_error_handler(error_handler)
 
-        logger.info("Bot starting...")
+        logger.info(f"Bot starting ({BOT_MODE})...")
         print("Bot running! Press Ctrl+C to stop.")
-        app.run_polling(drop_pending_updates=True)
+        if BOT_MODE == "webhook":
+            try:
+                asyncio.run(run_webhook(app))
+            except KeyboardInterrupt:
+                pass
+        else:
+            app.run_polling(drop_pending_updates=True)
 
     except Exception as e:
         logger.error(f"Startup error: {e}")
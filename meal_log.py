@@ -0,0 +1,55 @@
+import json
+from pathlib import Path
+from typing import Dict, Iterator
+
+CHUNK_SIZE = 1024 * 1024
+
+
+# ============================================================================
+# Streaming access to nutrition_data.json
+# ============================================================================
+
+def iter_entries(path: Path, chunk_size: int = CHUNK_SIZE) -> Iterator[Dict]:
+    """Yield the entries of a JSON array file one by one.
+
+    Reads `chunk_size` characters at a time, so memory stays bounded by
+    the chunk and the largest entry no matter how big the file is.
+    """
+    decoder = json.JSONDecoder()
+
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(chunk_size)
+        pos = buffer.find("[")
+        if pos < 0:
+            return
+        pos += 1
+
+        while True:
+            # Skip separators between entries
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+
+            if pos >= len(buffer):
+                more = f.read(chunk_size)
+                if not more:
+                    return
+                buffer, pos = more, 0
+                continue
+
+            if buffer[pos] == "]":
+                return
+
+            try:
+                entry, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Entry cut by the chunk boundary - read on
+                more = f.read(chunk_size)
+                if not more:
+                    raise
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+
+            yield entry
+            pos = end
+            if pos > chunk_size:
+                buffer, pos = buffer[pos:], 0
@@ -0,0 +1,210 @@
+import json
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+FOODS_FILE = Path(__file__).parent / "data" / "foods.json"
+
+NUTRIENTS = ("calories", "protein", "fat", "carbs")
+
+# Share of the daily target per meal
+MEAL_SHARES = {"breakfast": 0.25, "lunch": 0.35, "dinner": 0.30, "snack": 0.10}
+
+# Dish structure per meal: (food role, optional)
+MEAL_SLOTS = {
+    "breakfast": [("grain", False), ("protein", False), ("fruit", False), ("extra", True)],
+    "lunch": [("protein", False), ("grain", False), ("vegetable", False), ("extra", True)],
+    "dinner": [("protein", False), ("vegetable", False), ("grain", True), ("extra", True)],
+    "snack": [("protein", True), ("fruit", True), ("extra", True)]
+}
+
+# Calories miss weighs more than a macro miss; misses are relative to the
+# target, floored so a near-zero macro budget doesn't dominate the score
+WEIGHTS = (4.0, 1.0, 1.0, 1.0)
+SCALE_FLOOR = (50.0, 5.0, 5.0, 5.0)
+MIN_MEAL_CALORIES = 100
+
+# Budgets are rounded to this before solving, so close budgets share a cache entry
+CALORIE_STEP = 25
+MACRO_STEP = 5
+CACHE_SIZE = 512
+# Distinct food combinations kept while searching, best `count` of them are returned
+POOL_SIZE = 12
+
+
+# ============================================================================
+# Budget
+# ============================================================================
+
+def meal_budget(targets: Dict[str, float], eaten: Optional[Dict], meal_type: str) -> Dict[str, float]:
+    """Meal's share of the daily targets, capped by what is left of the day"""
+    share = MEAL_SHARES.get(meal_type, MEAL_SHARES["breakfast"])
+    eaten = eaten or {}
+    return {
+        key: max(0.0, min(targets[key] * share, targets[key] - (eaten.get(key) or 0)))
+        for key in NUTRIENTS
+    }
+
+
+# ============================================================================
+# Food table
+# ============================================================================
+
+class Food:
+    __slots__ = ("id", "name", "aliases", "role", "meals", "per_gram", "portions", "density")
+
+    def __init__(self, data: Dict):
+        self.id = data["id"]
+        self.name = data["name"]
+        # Other names per language, used by the food search only
+        self.aliases = data.get("aliases", {})
+        self.role = data["role"]
+        self.meals = set(data["meals"])
+        self.per_gram = tuple(value / 100 for value in data["kbju"])
+        low, high, step = data["portion"]
+        self.portions = list(range(low, high + 1, step))
+        # Grams per ml for drinks, None when the food can't be measured by volume
+        self.density = data.get("density")
+
+    def amounts(self, grams: int) -> Tuple[int, ...]:
+        return tuple(round(value * grams) for value in self.per_gram)
+
+
+def load_foods(path: Path = FOODS_FILE) -> List[Food]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return [Food(item) for item in json.load(f)]
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+
+# ============================================================================
+# Planner
+# ============================================================================
+
+class MealPlanner:
+    """Picks foods and portions that hit a meal's calorie and macro budget.
+
+    Depth-first search over the meal's slots (one food and portion per
+    slot), pruned by a lower bound on the final score: nutrients only grow
+    as items are added, so an overshoot is already final, and an undershoot
+    larger than what the remaining slots can add is too. Results are cached
+    per rounded budget.
+    """
+
+    def __init__(self, foods: List[Food] = None):
+        self.foods = load_foods() if foods is None else foods
+        self.options = {meal_type: self._slot_options(meal_type) for meal_type in MEAL_SLOTS}
+        self._cache: "OrderedDict[tuple, List[Dict]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _slot_options(self, meal_type: str) -> List[List[Tuple[Optional[Food], int, Tuple[int, ...]]]]:
+        """Per slot: (food, grams, amounts) choices, lightest first; (None, 0, zeros) for optional slots"""
+        slots = []
+        for role, optional in MEAL_SLOTS[meal_type]:
+            choices = [(None, 0, (0, 0, 0, 0))] if optional else []
+            for food in self.foods:
+                if food.role == role and meal_type in food.meals:
+                    choices.extend((food, grams, food.amounts(grams)) for grams in food.portions)
+            slots.append(sorted(choices, key=lambda choice: choice[2][0]))
+        return slots
+
+    def plan(self, meal_type: str, budget: Dict[str, float], count: int = 3) -> List[Dict]:
+        if meal_type not in MEAL_SLOTS:
+            return []
+        key = (meal_type, count, round(budget["calories"] / CALORIE_STEP) * CALORIE_STEP) + tuple(
+            round(budget[macro] / MACRO_STEP) * MACRO_STEP for macro in NUTRIENTS[1:]
+        )
+        cached = self._cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return cached
+
+        self.misses += 1
+        plans = self._search(meal_type, key[2:], count)
+        self._cache[key] = plans
+        if len(self._cache) > CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return plans
+
+    def _search(self, meal_type: str, target: Tuple[float, ...], count: int) -> List[Dict]:
+        slots = self.options[meal_type]
+        scale = [max(t, floor) for t, floor in zip(target, SCALE_FLOOR)]
+        # Most each nutrient can still grow after slot i
+        max_rest = [[0] * 4 for _ in range(len(slots) + 1)]
+        for i in range(len(slots) - 1, -1, -1):
+            for n in range(4):
+                max_rest[i][n] = max_rest[i + 1][n] + max((choice[2][n] for choice in slots[i]), default=0)
+
+        # frozenset of food ids -> (score, items)
+        pool: Dict[frozenset, Tuple[float, list]] = {}
+        cutoff = [float("inf")]
+        chosen = []
+
+        def bound(totals, depth):
+            score = 0.0
+            for n in range(4):
+                miss = totals[n] - target[n]
+                if miss < 0:
+                    miss = min(0, miss + max_rest[depth][n])
+                score += WEIGHTS[n] * (miss / scale[n]) ** 2
+            return score
+
+        def visit(depth, totals):
+            if depth == len(slots):
+                if not chosen:
+                    return
+                score = bound(totals, depth)
+                foods = frozenset(food.id for food, _, _ in chosen)
+                if score < pool.get(foods, (float("inf"),))[0]:
+                    pool[foods] = (score, list(chosen))
+                    if len(pool) > POOL_SIZE:
+                        del pool[max(pool, key=lambda k: pool[k][0])]
+                    if len(pool) == POOL_SIZE:
+                        cutoff[0] = max(item[0] for item in pool.values())
+                return
+
+            for food, grams, amounts in slots[depth]:
+                new_totals = [totals[n] + amounts[n] for n in range(4)]
+                if bound(new_totals, depth + 1) >= cutoff[0]:
+                    # Only calories are monotonic across the choices, a later one may still fit
+                    continue
+                if food is not None:
+                    chosen.append((food, grams, amounts))
+                visit(depth + 1, new_totals)
+                if food is not None:
+                    chosen.pop()
+
+        visit(0, [0, 0, 0, 0])
+        ranked = sorted(pool.values(), key=lambda item: item[0])
+        return [self._describe(items) for _, items in self._diverse(ranked, count)]
+
+    @staticmethod
+    def _diverse(ranked: List[Tuple[float, list]], count: int) -> List[Tuple[float, list]]:
+        """Best plans, preferring ones whose main food hasn't been picked yet"""
+        picked, deferred, mains = [], [], set()
+        for score, items in ranked:
+            main = items[0][0].id
+            if main in mains:
+                deferred.append((score, items))
+                continue
+            mains.add(main)
+            picked.append((score, items))
+        return (picked + deferred)[:count]
+
+    @staticmethod
+    def _describe(items: list) -> Dict:
+        plan_items = []
+        totals = dict.fromkeys(NUTRIENTS, 0)
+        for food, grams, amounts in items:
+            item = {"id": food.id, "name": food.name, "grams": grams}
+            for key, value in zip(NUTRIENTS, amounts):
+                item[key] = value
+                totals[key] += value
+            plan_items.append(item)
+        return {"items": plan_items, "totals": totals}
+
+    def stats(self) -> Dict:
+        return {"foods": len(self.foods), "cached": len(self._cache), "hits": self.hits, "misses": self.misses}
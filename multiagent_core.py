@@ -1,20 +1,56 @@
+import asyncio
+import functools
 import json
-from datetime import datetime, date
+import logging
+import os
+import uuid
+from datetime import datetime, date, time, timedelta
 from dataclasses import dataclass
-from typing import Dict, List
+from typing import Dict, List, Optional
 from pathlib import Path
 
+from budget import BudgetTracker
+from event_store import EventStore
+from favorites import FavoritesStore
+from food_search import FoodSearch
+from anomaly import AnomalyDetector
+from i18n import catalog
+from meal_log import iter_entries
+from meal_planner import MIN_MEAL_CALORIES, MealPlanner, meal_budget
+from nutrition_formulas import body_mass_index, daily_calories
+from nutrition_reports import aggregate_period
+from photo_logging import PhotoCache, VisionEstimator, prepare_photo
+from portion_cache import PortionCache, strip_meal_type
+from reestimate import ReestimateJob
+from product_index import DEFAULT_GRAMS, ProductIndex, parse_scan, portion_kbju
+from rolling_stats import RollingStatsEngine
+from sessions import SessionStore
+from user_time import clock, day_number, entry_day
+
 # Data path definition
 PROJECT_ROOT = Path(__file__).parent
 DATA_DIR = PROJECT_ROOT / "data"
+STATE_DIR = DATA_DIR / "state"
+
+logger = logging.getLogger(__name__)
+
+# Bounded history kept in agent state so snapshots stay compact
+MAX_RECENT_ITEMS = 50
+
+# Days of per-user daily totals kept by the analyst
+ROLLUP_DAYS = 31
+NUTRIENTS = ("calories", "protein", "fat", "carbs")
+
+# Fixed alert cutoff, used until a user has enough history for a personal baseline
+HIGH_CALORIE_MEAL = 800
 
 # ============================================================================
 # Import original functions
 # ============================================================================
 
 try:
-    from agents.analyst_agent import estimate_kbju, analyze_daily_nutrition
-    from agents.dietitian_agent import calculate_daily_calories, get_nutrition_advice, load_user_profile
+    from agents.analyst_agent import estimate_kbju, analyze_daily_nutrition, get_weekly_nutrition_summary
+    from agents.dietitian_agent import calculate_daily_calories, get_meal_suggestions, get_nutrition_advice, load_user_profile
 
     USE_ORIGINAL_FUNCTIONS = True
 except ImportError:
@@ -27,47 +63,18 @@ except ImportError:
             "protein": 0,
             "fat": 0,
             "carbs": 0,
-            "analysis": "❌ GPT недоступний. Необхідно налаштувати OpenAI API"
-            if lang == "uk" else "❌ GPT unavailable. OpenAI API setup required"
+            "analysis": catalog.text(lang, "gpt_unavailable_setup")
         }
 
 
     def calculate_daily_calories(age: int, gender: str, weight: float, height: int,
                                  activity_coefficient: float) -> dict:
-        if gender == "male":
-            bmr = 10 * weight + 6.25 * height - 5 * age + 5
-        else:
-            bmr = 10 * weight + 6.25 * height - 5 * age - 161
-
-        total_calories = bmr * activity_coefficient
-
-        return {
-            "bmr": round(bmr),
-            "total": round(total_calories),
-            "maintain": round(total_calories),
-            "lose": round(total_calories - 300),
-            "gain": round(total_calories + 300)
-        }
+        return daily_calories(age, gender, weight, height, activity_coefficient)
 
 
     def get_nutrition_advice(profile: dict, lang: str = "uk") -> str:
         calories = profile.get('calories', {})
-        maintain_calories = calories.get('maintain', 2000)
-
-        if lang == "uk":
-            return f"""💡 Базові рекомендації (без GPT):
-
-🎯 Ваша денна норма: {maintain_calories} ккал
-
-❌ Для персональних рекомендацій потрібен OpenAI API
-💡 Налаштуйте OPENAI_API_KEY в .env файлі"""
-        else:
-            return f"""💡 Basic recommendations (without GPT):
-
-🎯 Your daily target: {maintain_calories} kcal
-
-❌ For personalized recommendations OpenAI API is required
-💡 Set OPENAI_API_KEY in .env file"""
+        return catalog.render(lang, "basic_advice", maintain=calories.get('maintain', 2000))
 
 
     def load_user_profile(user_id: int) -> dict:
@@ -93,21 +100,87 @@ class AgentMessage:
 
 
 class SimpleMessageBus:
-    def __init__(self):
+    def __init__(self, event_store: EventStore = None):
         self.messages: Dict[str, List[AgentMessage]] = {}
+        self.event_store = event_store
+        self.replaying = False
 
     async def send_message(self, sender: str, receiver: str, content: Dict):
+        # State is being rebuilt from the log - replies were already recorded
+        if self.replaying:
+            return
+
         if receiver not in self.messages:
             self.messages[receiver] = []
 
         message = AgentMessage(sender, receiver, content, datetime.now())
         self.messages[receiver].append(message)
 
+        if self.event_store is not None:
+            self.event_store.append("message", message_to_dict(message))
+
     async def get_messages(self, agent_id: str) -> List[AgentMessage]:
         messages = self.messages.get(agent_id, [])
         self.messages[agent_id] = []
         return messages
 
+    def get_state(self) -> Dict:
+        return {receiver: [message_to_dict(m) for m in queue]
+                for receiver, queue in self.messages.items() if queue}
+
+    def load_state(self, state: Dict):
+        self.messages = {receiver: [message_from_dict(m) for m in queue]
+                         for receiver, queue in state.items()}
+
+
+def message_to_dict(message: AgentMessage) -> Dict:
+    return {
+        "sender": message.sender,
+        "receiver": message.receiver,
+        "content": message.content,
+        "timestamp": message.timestamp.isoformat()
+    }
+
+
+def message_from_dict(data: Dict) -> AgentMessage:
+    return AgentMessage(data["sender"], data["receiver"], data["content"],
+                        datetime.fromisoformat(data["timestamp"]))
+
+
+async def run_blocking(func, *args):
+    """Run a blocking call (OpenAI client, sync I/O) in a thread so other users aren't stalled"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args))
+
+
+def new_entry_id() -> str:
+    """Stable meal entry ID, short enough for Telegram callback data"""
+    return uuid.uuid4().hex[:12]
+
+
+def owns_entry(entry: Dict, user_id: int) -> bool:
+    # Entries logged before user_id was stored belong to everyone
+    return entry.get("user_id") in (None, user_id)
+
+
+def int_keys(data: Dict) -> Dict:
+    """JSON turns user_id keys into strings - convert them back"""
+    return {int(key): value for key, value in data.items()}
+
+
+def short_date(iso_date: str) -> str:
+    """2024-05-31 -> 31.05"""
+    return f"{iso_date[8:10]}.{iso_date[5:7]}"
+
+
+def load_all_profiles() -> Dict:
+    """profiles.json in one read, keyed by int user_id"""
+    try:
+        with open(DATA_DIR / "profiles.json", "r", encoding="utf-8") as f:
+            return int_keys(json.load(f))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
 
 # ============================================================================
 # Base agent
@@ -135,6 +208,17 @@ class SimpleAgent:
     async def handle_message(self, message: AgentMessage):
         pass
 
+    async def replay_message(self, message: AgentMessage):
+        """Re-apply a logged message to in-memory state"""
+        if message.receiver == self.agent_id:
+            await self.handle_message(message)
+
+    def get_state(self) -> Dict:
+        return {}
+
+    def load_state(self, state: Dict):
+        pass
+
 
 # ============================================================================
 # Analyst agent
@@ -144,31 +228,160 @@ class AnalystAgent(SimpleAgent):
     def __init__(self, message_bus: SimpleMessageBus):
         super().__init__("analyst", "📊 Аналітик", message_bus)
         self.user_patterns = {}
+        # {"YYYY-MM-DD": {user_id: {"meals", "calories", ...}}}; None until built from nutrition_data.json
+        self.daily_totals = None
+        # Per-user baseline of meal calories
+        self.meal_detector = AnomalyDetector()
+        # Past meals with their KBJU for one-tap re-logging
+        self.favorites = FavoritesStore()
+        self.favorites_loaded = False
+        # Per-gram densities of single items, so quantity variants skip GPT
+        self.portions = PortionCache()
+        self.portions_loaded = False
+        # Barcode -> KBJU table, None until built with product_index.py
+        self.products = ProductIndex.open()
+        # Typo-tolerant names of foods.json, checked before GPT
+        self.food_search = FoodSearch()
+        # Meal photos: the model is set by the bot at startup, near-duplicate photos reuse earlier estimates
+        self.vision: Optional[VisionEstimator] = None
+        self.photos = PhotoCache()
+        self.photos_loaded = False
+        # False until entries logged before day numbers existed have been given one
+        self.day_numbers_added = False
 
     async def add_meal(self, user_id: int, meal_desc: str, lang: str):
+        scan = parse_scan(strip_meal_type(meal_desc))
+        if scan is not None:
+            return await self.add_product(user_id, meal_desc, *scan, lang)
+
         try:
-            if not USE_ORIGINAL_FUNCTIONS:
-                error_msg = "❌ GPT недоступний. Потрібен OpenAI API ключ" \
-                    if lang == "uk" else "❌ GPT unavailable. OpenAI API key required"
-                return {"status": "error", "message": error_msg}
+            kbju = self._local_estimate(meal_desc, lang)
+            if kbju is None:
+                if not USE_ORIGINAL_FUNCTIONS:
+                    return {"status": "error", "message": catalog.text(lang, "gpt_unavailable")}
+                kbju = await run_blocking(estimate_kbju, meal_desc, lang)
+            return await self._record_meal(user_id, meal_desc, kbju)
 
-            kbju = estimate_kbju(meal_desc, lang)
-            self._save_entry(meal_desc, kbju)
-            await self._autonomous_analysis(user_id, kbju, meal_desc)
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
 
-            await self.send_to_agent("dietitian", "meal_added", {
-                "user_id": user_id,
-                "meal": meal_desc,
-                "kbju": kbju,
-                "analysis": self._quick_meal_assessment(kbju)
-            })
+    async def add_photo(self, user_id: int, image: bytes, caption: str, meal_type: Optional[str], lang: str):
+        """Meal photo: downscaled, checked against the user's earlier photos, then sent to the vision model"""
+        try:
+            prepared, photo_hash = await run_blocking(prepare_photo, image)
+            photo_hash = f"{photo_hash:016x}"
+
+            match = self.photos.find(user_id, int(photo_hash, 16))
+            if match is not None:
+                cached_hash, estimate, distance = match
+                kbju = {key: estimate[key] for key in NUTRIENTS}
+                dish = estimate["dish"]
+                kbju["analysis"] = catalog.text(lang, "photo_cached")
+                kbju["provenance"] = {"source": "photo", "hash": photo_hash, "dish": dish,
+                                      "cached_from": f"{cached_hash:016x}", "distance": distance}
+            elif self.vision is None:
+                return {"status": "error", "message": catalog.text(lang, "photo_unavailable")}
+            else:
+                kbju = await run_blocking(self.vision.estimate, prepared, caption, lang)
+                if not kbju:
+                    return {"status": "error", "message": catalog.text(lang, "photo_failed")}
+                dish = kbju.pop("dish", "") or ""
+                kbju["provenance"] = {"source": "photo", "hash": photo_hash, "dish": dish}
 
-            return {"status": "success", "kbju": kbju}
+            text = f"📷 {caption or dish or catalog.text(lang, 'photo_meal')}"
+            meal_desc = f"{meal_type}: {text}" if meal_type else text
+            return await self._record_meal(user_id, meal_desc, kbju)
 
         except Exception as e:
             return {"status": "error", "message": str(e)}
 
-    def _save_entry(self, description: str, kbju: dict):
+    def _local_estimate(self, meal_desc: str, lang: str) -> Optional[Dict]:
+        """KBJU of a single weighed item from the food table or earlier estimates, None when GPT has to answer"""
+        # Typo-tolerant matches are bounded by name length; the reply names the food so the user can check it
+        kbju = self.food_search.estimate(meal_desc)
+        if kbju is not None:
+            food = self.food_search.by_id[kbju["provenance"]["food"]]
+            key = "food_table_match" if kbju["provenance"]["confidence"] == "high" else "food_table_guess"
+            kbju["analysis"] = catalog.render(
+                lang, key,
+                food=food.name.get(lang) or food.name[catalog.default],
+                calories=round(food.per_gram[0] * 100)
+            )
+            return kbju
+
+        kbju = self.portions.estimate(meal_desc)
+        if kbju is not None:
+            provenance = kbju["provenance"]
+            kbju["analysis"] = catalog.render(
+                lang, "portion_scaled",
+                source=provenance["from"],
+                samples=provenance["samples"],
+                confidence=catalog.text(lang, f"confidence_{provenance['confidence']}")
+            )
+        return kbju
+
+    async def add_product(self, user_id: int, meal_desc: str, barcode: int, grams: Optional[float], lang: str):
+        """Barcode looked up in the local product index - no GPT call"""
+        product = self.products.lookup(barcode) if self.products is not None else None
+        if product is None:
+            return {"status": "error", "message": catalog.render(lang, "barcode_unknown", barcode=barcode)}
+
+        try:
+            grams = grams or product["serving"] or DEFAULT_GRAMS
+            name = product["name"] or str(barcode)
+            # Keep the "🌞 Обід: " prefix, replace the digits with the product
+            meal_desc = meal_desc.strip()
+            prefix = meal_desc[:len(meal_desc) - len(strip_meal_type(meal_desc))]
+            description = prefix + catalog.render(lang, "product_portion", name=name, grams=f"{grams:g}")
+
+            kbju = portion_kbju(product, grams)
+            kbju["analysis"] = catalog.render(
+                lang, "barcode_logged",
+                barcode=barcode, name=name, grams=f"{grams:g}", calories=round(product["per_100g"]["calories"])
+            )
+            kbju["provenance"] = {"source": "barcode", "barcode": str(barcode), "grams": grams}
+            return await self._record_meal(user_id, description, kbju)
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    async def relog_favorite(self, user_id: int, favorite_id: str, lang: str):
+        """Log a past meal again with its stored KBJU - no GPT call"""
+        favorite = self.favorites.get(user_id, favorite_id)
+        if favorite is None:
+            return {"status": "error", "message": catalog.text(lang, "favorite_missing")}
+
+        try:
+            kbju = dict(favorite.kbju, analysis=catalog.text(lang, "favorite_relogged"),
+                        provenance={"source": "favorite"})
+            return await self._record_meal(user_id, favorite.description, kbju)
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    async def get_favorites(self, user_id: int, lang: str):
+        favorites = self.favorites.top(user_id)
+        if not favorites:
+            return {"status": "success", "message": catalog.text(lang, "favorites_empty")}
+        return {"status": "success", "favorites": favorites, "action": "show_favorites"}
+
+    async def _record_meal(self, user_id: int, meal_desc: str, kbju: Dict):
+        entry = self._save_entry(user_id, meal_desc, kbju)
+        self._update_rollup(user_id, entry["date"], entry)
+        self.favorites.add(user_id, meal_desc, kbju)
+        self.portions.learn(meal_desc, kbju)
+        self.photos.learn(user_id, kbju)
+        anomaly = await self._autonomous_analysis(user_id, kbju, meal_desc, entry["date"])
+
+        await self.send_to_agent("dietitian", "meal_added", {
+            "user_id": user_id,
+            "meal": meal_desc,
+            "date": entry["date"],
+            "kbju": kbju,
+            "analysis": self._quick_meal_assessment(kbju, anomaly)
+        })
+
+        return {"status": "success", "kbju": kbju}
+
+    def _save_entry(self, user_id: int, description: str, kbju: dict):
         try:
             DATA_DIR.mkdir(exist_ok=True)
             data_file = DATA_DIR / "nutrition_data.json"
@@ -181,8 +394,13 @@ class AnalystAgent(SimpleAgent):
             except json.JSONDecodeError:
                 data = []
 
+            # The user's local day; "day" is what reads filter on, "date" is kept for exports and reports
+            today = clock.today(user_id)
             entry = {
-                "date": date.today().strftime("%Y-%m-%d"),
+                "id": new_entry_id(),
+                "user_id": user_id,
+                "date": today.isoformat(),
+                "day": day_number(today),
                 "description": description,
                 "calories": kbju.get("calories", 0),
                 "protein": kbju.get("protein", 0),
@@ -190,23 +408,123 @@ class AnalystAgent(SimpleAgent):
                 "carbs": kbju.get("carbs", 0),
                 "timestamp": datetime.now().isoformat()
             }
+            if kbju.get("provenance"):
+                entry["provenance"] = kbju["provenance"]
             data.append(entry)
 
             with open(data_file, "w", encoding="utf-8") as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
 
+            return entry
+
         except Exception as e:
             raise
 
+    # ------------------------------------------------------------------------
+    # Daily rollups
+    # ------------------------------------------------------------------------
+
+    def _update_rollup(self, user_id: int, day: str, entry: Dict, sign: int = 1):
+        """Add (sign=1) or remove (sign=-1) one meal from the user's totals for `day`"""
+        if self.daily_totals is None or user_id is None or not day:
+            return
+
+        users = self.daily_totals.get(day)
+        if users is None:
+            if sign < 0:
+                return
+            users = self.daily_totals[day] = {}
+            # Users' local todays run from the server's yesterday to its tomorrow, so two extra days are kept
+            for old_day in sorted(self.daily_totals)[:-ROLLUP_DAYS - 2]:
+                del self.daily_totals[old_day]
+
+        totals = users.get(user_id)
+        if totals is None:
+            if sign < 0:
+                return
+            totals = users[user_id] = {"meals": 0, **{key: 0 for key in NUTRIENTS}}
+
+        totals["meals"] += sign
+        for key in NUTRIENTS:
+            totals[key] += sign * (entry.get(key) or 0)
+
+    def _correct_rollup(self, user_id: int, day: str, old: Dict, new: Dict):
+        """Replace one meal's KBJU in the totals for `day`, if the day is still kept"""
+        totals = (self.daily_totals or {}).get(day, {}).get(user_id)
+        if totals is None:
+            return
+        for key in NUTRIENTS:
+            totals[key] += (new.get(key) or 0) - (old.get(key) or 0)
+
+    def rebuild_daily_totals(self):
+        """One pass over nutrition_data.json - for state saved before rollups existed"""
+        self.daily_totals = {}
+        # One day of margin: users west of the server are still on its yesterday
+        cutoff = day_number(date.today()) - ROLLUP_DAYS - 1
+        try:
+            with open(DATA_DIR / "nutrition_data.json", "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+
+        for entry in data:
+            if entry_day(entry) > cutoff:
+                self._update_rollup(entry.get("user_id"), entry.get("date"), entry)
+
+    def add_day_numbers(self):
+        """One rewrite of nutrition_data.json giving entries from before day numbers their "day" """
+        data_file = DATA_DIR / "nutrition_data.json"
+        try:
+            with open(data_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+
+        missing = [entry for entry in data if "day" not in entry]
+        if not missing:
+            return
+        for entry in missing:
+            entry["day"] = entry_day(entry)
+        tmp_file = data_file.with_suffix(".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, data_file)
+
+    def rebuild_favorites(self):
+        """Streamed pass over nutrition_data.json - for state saved before favorites existed"""
+        try:
+            self.favorites.seed(iter_entries(DATA_DIR / "nutrition_data.json"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.favorites.users = {}
+
+    def rebuild_portions(self):
+        """Same, for portion densities"""
+        try:
+            self.portions.seed(iter_entries(DATA_DIR / "nutrition_data.json"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.portions.densities = {}
+
+    def rebuild_photos(self):
+        """Same, for photo hashes"""
+        try:
+            self.photos.seed(iter_entries(DATA_DIR / "nutrition_data.json"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.photos.users = {}
+
+    def get_day_totals(self, day: date) -> Dict[int, Dict]:
+        """Totals of every user for one day"""
+        return (self.daily_totals or {}).get(day.strftime("%Y-%m-%d"), {})
+
     async def get_daily_summary(self, user_id: int, lang: str):
-        today = date.today()
-        entries = self._get_entries_for_date(today)
+        today = clock.today(user_id)
+        entries = self._get_entries_for_date(today, user_id)
 
         if entries:
             total_calories = sum(entry.get('calories', 0) for entry in entries)
 
             await self.send_to_agent("dietitian", "analyze_day", {
                 "user_id": user_id,
+                "date": today.strftime("%Y-%m-%d"),
                 "entries": entries,
                 "total_calories": total_calories,
                 "lang": lang
@@ -215,8 +533,7 @@ class AnalystAgent(SimpleAgent):
             summary = self._format_summary(entries, lang)
             return {"status": "success", "entries": entries, "summary": summary}
         else:
-            no_data_msg = "Немає даних за день" if lang == "uk" else "No data for today"
-            return {"status": "no_data", "message": no_data_msg}
+            return {"status": "no_data", "message": catalog.text(lang, "no_data_today")}
 
     def _format_summary(self, entries: list, lang: str) -> str:
         total_calories = sum(entry.get('calories', 0) for entry in entries)
@@ -224,133 +541,225 @@ class AnalystAgent(SimpleAgent):
         total_fat = sum(entry.get('fat', 0) for entry in entries)
         total_carbs = sum(entry.get('carbs', 0) for entry in entries)
 
-        if lang == "uk":
-            summary = f"""📊 **Підсумок за день:**
-
-🍽 **Прийомів їжі:** {len(entries)}
-
-📈 **Загальні показники:**
-• Калорії: {total_calories} ккал
-• Білки: {total_protein} г
-• Жири: {total_fat} г
-• Вуглеводи: {total_carbs} г
-
-📋 **Список страв:**"""
-        else:
-            summary = f"""📊 **Daily Summary:**
+        parts = [catalog.render(lang, "summary", meals=len(entries), calories=total_calories,
+                                protein=total_protein, fat=total_fat, carbs=total_carbs)]
+        item = catalog.text(lang, "summary_item")
+        for entry in entries:
+            parts.append(item.format(description=entry['description'], calories=entry['calories']))
 
-🍽 **Meals:** {len(entries)}
+        return "".join(parts)
 
-📈 **Total indicators:**
-• Calories: {total_calories} kcal
-• Protein: {total_protein} g
-• Fat: {total_fat} g
-• Carbs: {total_carbs} g
+    async def get_period_report(self, user_id: int, days: int, lang: str):
+        """Report for the last `days` days including today"""
+        end = clock.today(user_id)
+        start = end - timedelta(days=days - 1)
+        entries = self._get_entries_for_range(start, end, user_id)
+        if not entries:
+            return {"status": "no_data", "message": catalog.text(lang, "no_data_period")}
 
-📋 **Meal list:**"""
+        stats = aggregate_period(entries, start, end)
+        report = self._format_period_report(stats, lang)
 
-        for entry in entries:
-            summary += f"\n• {entry['description']} ({entry['calories']} ккал)"
+        if USE_ORIGINAL_FUNCTIONS:
+            analysis = await run_blocking(get_weekly_nutrition_summary, stats, lang)
+            report = f"{report}\n\n{analysis}"
+
+        return {"status": "success", "summary": report, "stats": stats}
+
+    def _format_period_report(self, stats: Dict, lang: str) -> str:
+        daily_avg = stats["daily_avg"]
+        ratio = stats["macro_ratio"]
+        parts = [catalog.render(
+            lang, "period_report",
+            days=stats["days"],
+            start=short_date(stats["start"]),
+            end=short_date(stats["end"]),
+            days_logged=stats["days_logged"],
+            meals=stats["meals"],
+            calories=daily_avg["calories"],
+            calories_std=stats["calories_std"],
+            protein=daily_avg["protein"],
+            fat=daily_avg["fat"],
+            carbs=daily_avg["carbs"],
+            protein_pct=ratio["protein"],
+            fat_pct=ratio["fat"],
+            carbs_pct=ratio["carbs"]
+        )]
+
+        parts.append(catalog.text(lang, "period_days"))
+        item = catalog.text(lang, "period_day")
+        for day in stats["per_day"]:
+            parts.append(item.format(date=short_date(day["date"]), calories=day["calories"], meals=day["meals"]))
+
+        return "".join(parts)
+
+    def _get_entries_for_range(self, start: date, end: date, user_id: int):
+        """User's entries dated start..end, compared by day number"""
+        first, last = day_number(start), day_number(end)
+        try:
+            with open(DATA_DIR / "nutrition_data.json", "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
 
-        return summary
+        return [entry for entry in data
+                if first <= entry_day(entry) <= last and owns_entry(entry, user_id)]
 
-    def _get_entries_for_date(self, target_date):
+    def _get_entries_for_date(self, target_date: date, user_id: int = None):
+        target = day_number(target_date)
         try:
             data_file = DATA_DIR / "nutrition_data.json"
             with open(data_file, "r", encoding="utf-8") as f:
                 data = json.load(f)
-
-            result = []
-            for entry in data:
-                try:
-                    entry_date = datetime.strptime(entry["date"], "%Y-%m-%d").date()
-                    if entry_date == target_date:
-                        result.append(entry)
-                except (KeyError, ValueError):
-                    continue
-            return result
         except (FileNotFoundError, json.JSONDecodeError):
             return []
 
-    async def delete_meal(self, user_id: int, lang: str):
-        today = date.today()
-        entries = self._get_entries_for_date(today)
+        return [entry for entry in data
+                if entry_day(entry) == target and (user_id is None or owns_entry(entry, user_id))]
 
-        if not entries:
-            no_data_msg = "Немає записів для видалення" if lang == "uk" else "No entries to delete"
-            return {"status": "no_data", "message": no_data_msg}
+    async def delete_meal(self, user_id: int, lang: str):
+        today = clock.day(user_id)
 
-        entries_with_index = []
         try:
             data_file = DATA_DIR / "nutrition_data.json"
             with open(data_file, "r", encoding="utf-8") as f:
                 all_data = json.load(f)
+        except FileNotFoundError:
+            all_data = []
+        except Exception as e:
+            return {"status": "error", "message": catalog.text(lang, "delete_list_error")}
+
+        entries = []
+        missing_ids = False
+        for entry in all_data:
+            if entry_day(entry) == today and owns_entry(entry, user_id):
+                # Entries from before IDs existed get one now, so buttons can reference them
+                if "id" not in entry:
+                    entry["id"] = new_entry_id()
+                    missing_ids = True
+                entries.append(entry)
 
-            for global_index, entry in enumerate(all_data):
-                try:
-                    entry_date = datetime.strptime(entry["date"], "%Y-%m-%d").date()
-                    if entry_date == today:
-                        entries_with_index.append({"entry": entry, "index": global_index})
-                except (KeyError, ValueError):
-                    continue
+        if not entries:
+            return {"status": "no_data", "message": catalog.text(lang, "nothing_to_delete")}
 
-        except Exception as e:
-            return {"status": "error",
-                    "message": "Помилка підготовки списку" if lang == "uk" else "Error preparing list"}
+        if missing_ids:
+            with open(data_file, "w", encoding="utf-8") as f:
+                json.dump(all_data, f, ensure_ascii=False, indent=2)
 
-        return {"status": "success", "entries": entries_with_index, "action": "show_delete_list"}
+        return {"status": "success", "entries": entries, "action": "show_delete_list"}
 
-    async def confirm_delete_meal(self, user_id: int, entry_index: int, lang: str):
+    async def confirm_delete_meal(self, user_id: int, entry_id: str, lang: str):
         try:
-            deleted_entry = self._delete_entry_by_index(entry_index)
+            deleted_entry = self._delete_entry_by_id(user_id, entry_id)
             if deleted_entry:
+                self._update_rollup(deleted_entry.get("user_id"), deleted_entry.get("date"), deleted_entry, -1)
+                self.favorites.remove(user_id, deleted_entry.get("description"))
+                self.photos.forget(user_id, deleted_entry)
                 await self.send_to_agent("dietitian", "meal_deleted", {
                     "user_id": user_id,
                     "deleted_entry": deleted_entry
                 })
 
-                success_msg = f"Запис видалено: {deleted_entry['description']}" if lang == "uk" else f"Entry deleted: {deleted_entry['description']}"
+                success_msg = catalog.render(lang, "entry_deleted", description=deleted_entry['description'])
                 return {"status": "success", "message": success_msg}
             else:
-                error_msg = "Помилка при видаленні" if lang == "uk" else "Error deleting entry"
-                return {"status": "error", "message": error_msg}
+                return {"status": "error", "message": catalog.text(lang, "delete_error")}
         except Exception as e:
             return {"status": "error", "message": str(e)}
 
-    def _delete_entry_by_index(self, index):
+    def _delete_entry_by_id(self, user_id: int, entry_id: str):
         try:
             data_file = DATA_DIR / "nutrition_data.json"
             with open(data_file, "r", encoding="utf-8") as f:
                 data = json.load(f)
 
-            if 0 <= index < len(data):
-                deleted_entry = data.pop(index)
-                with open(data_file, "w", encoding="utf-8") as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-                return deleted_entry
+            for index, entry in enumerate(data):
+                if entry.get("id") == entry_id and owns_entry(entry, user_id):
+                    deleted_entry = data.pop(index)
+                    with open(data_file, "w", encoding="utf-8") as f:
+                        json.dump(data, f, ensure_ascii=False, indent=2)
+                    return deleted_entry
             return None
         except Exception:
             return None
 
-    async def _autonomous_analysis(self, user_id: int, kbju: Dict, meal_desc: str):
+    async def apply_reestimates(self, estimates: Dict[str, Dict]) -> int:
+        """Write re-estimated KBJU (by entry ID, or timestamp for old entries) back in one rewrite of the log"""
+        data_file = DATA_DIR / "nutrition_data.json"
+        with open(data_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        corrections = []
+        now = datetime.now().isoformat()
+        for entry in data:
+            new = estimates.get(entry.get("id") or entry.get("timestamp"))
+            if new is None:
+                continue
+            old = {key: entry.get(key) or 0 for key in NUTRIENTS}
+            # Only direct GPT estimates were learned by the portion cache
+            learned = "provenance" not in entry
+            entry.update(new)
+            # The values are a direct estimate now, whatever they were scaled or copied from
+            entry.pop("provenance", None)
+            entry["reestimated"] = {"at": now, "previous": old}
+            # Incremental exports pick the entry up again
+            entry["modified"] = now
+            corrections.append({"user_id": entry.get("user_id"), "date": entry.get("date"),
+                                "description": entry.get("description"), "learned": learned, "old": old, "new": new})
+
+        if not corrections:
+            return 0
+        tmp_file = data_file.with_suffix(".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, data_file)
+
+        for correction in corrections:
+            self._apply_correction(correction)
+        await self.send_to_agent("dietitian", "meals_reestimated", {"corrections": corrections})
+        return len(corrections)
+
+    def _apply_correction(self, correction: Dict):
+        """Re-estimated KBJU into the rollup, the favorite and the portion densities, so re-logs use the new values"""
+        self._correct_rollup(correction["user_id"], correction["date"], correction["old"], correction["new"])
+        description = correction.get("description")
+        if description:
+            self.favorites.correct(correction["user_id"], description, correction["old"], correction["new"])
+            self.portions.correct(description, correction["old"], correction["new"], correction.get("learned", True))
+
+    async def _autonomous_analysis(self, user_id: int, kbju: Dict, meal_desc: str, day: str):
+        """Compare the meal with the user's own baseline; alerts the dietitian about unusually big meals"""
         calories = kbju.get('calories', 0)
+        self._record_pattern(user_id, calories, datetime.now())
+        anomaly = self.meal_detector.observe(user_id, calories)
+
+        is_high = calories > HIGH_CALORIE_MEAL if anomaly is None else anomaly["level"] == "high"
+        if is_high:
+            await self.send_to_agent("dietitian", "high_calorie_alert", {
+                "user_id": user_id,
+                "calories": calories,
+                "meal": meal_desc,
+                "date": day,
+                "baseline": anomaly["baseline"] if anomaly else None
+            })
+
+        return anomaly
 
+    def _record_pattern(self, user_id: int, calories: int, timestamp: datetime):
         if user_id not in self.user_patterns:
             self.user_patterns[user_id] = {"meals": [], "avg_calories": 0}
 
-        self.user_patterns[user_id]["meals"].append({
+        meals = self.user_patterns[user_id]["meals"]
+        meals.append({
             "calories": calories,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": timestamp.isoformat()
         })
+        del meals[:-MAX_RECENT_ITEMS]
 
-        if calories > 800:
-            await self.send_to_agent("dietitian", "high_calorie_alert", {
-                "user_id": user_id,
-                "calories": calories,
-                "meal": meal_desc
-            })
+    def _quick_meal_assessment(self, kbju: Dict, anomaly: Dict = None) -> str:
+        if anomaly is not None:
+            return {"high": "high_calorie", "low": "low_calorie"}.get(anomaly["level"], "normal")
 
-    def _quick_meal_assessment(self, kbju: Dict) -> str:
         calories = kbju.get('calories', 0)
         if calories < 200:
             return "low_calorie"
@@ -372,6 +781,64 @@ class AnalystAgent(SimpleAgent):
                 "patterns": patterns
             })
 
+    async def replay_message(self, message: AgentMessage):
+        await super().replay_message(message)
+
+        if message.sender != self.agent_id:
+            return
+
+        # Patterns and rollups are updated while adding/deleting a meal, the messages carry the same data
+        msg_type = message.content.get("type")
+        data = message.content.get("data", {})
+        if msg_type == "meal_added":
+            self._record_pattern(data["user_id"], data["kbju"].get("calories", 0), message.timestamp)
+            self.meal_detector.observe(data["user_id"], data["kbju"].get("calories", 0))
+            day = data.get("date") or message.timestamp.strftime("%Y-%m-%d")
+            self._update_rollup(data["user_id"], day, data["kbju"])
+            self.favorites.add(data["user_id"], data.get("meal"), data["kbju"], message.timestamp)
+            self.portions.learn(data.get("meal") or "", data["kbju"])
+            self.photos.learn(data["user_id"], data["kbju"])
+        elif msg_type == "meal_deleted":
+            entry = data.get("deleted_entry", {})
+            self._update_rollup(entry.get("user_id"), entry.get("date"), entry, -1)
+            self.favorites.remove(data.get("user_id"), entry.get("description"))
+            self.photos.forget(data.get("user_id"), entry)
+        elif msg_type == "meals_reestimated":
+            for correction in data.get("corrections", []):
+                self._apply_correction(correction)
+
+    def get_state(self) -> Dict:
+        return {"user_patterns": self.user_patterns, "daily_totals": self.daily_totals,
+                "meal_baselines": self.meal_detector.get_state(), "favorites": self.favorites.get_state(),
+                "portion_densities": self.portions.get_state(), "photo_hashes": self.photos.get_state(),
+                "day_numbers_added": self.day_numbers_added}
+
+    def load_state(self, state: Dict):
+        self.user_patterns = int_keys(state.get("user_patterns", {}))
+        if "meal_baselines" in state:
+            self.meal_detector.load_state(state["meal_baselines"])
+        else:
+            # Older snapshot: learn baselines from the recent meals kept in patterns
+            for user_id, patterns in self.user_patterns.items():
+                for meal in patterns.get("meals", []):
+                    self.meal_detector.observe(user_id, meal.get("calories", 0))
+
+        if "favorites" in state:
+            self.favorites.load_state(state["favorites"])
+            self.favorites_loaded = True
+        if "portion_densities" in state:
+            self.portions.load_state(state["portion_densities"])
+            self.portions_loaded = True
+        if "photo_hashes" in state:
+            self.photos.load_state(state["photo_hashes"])
+            self.photos_loaded = True
+        self.day_numbers_added = state.get("day_numbers_added", False)
+
+        daily_totals = state.get("daily_totals")
+        self.daily_totals = None if daily_totals is None else {
+            day: int_keys(users) for day, users in daily_totals.items()
+        }
+
 
 # ============================================================================
 # Dietitian agent
@@ -382,6 +849,15 @@ class DietitianAgent(SimpleAgent):
         super().__init__("dietitian", "🍎 Дієтолог", message_bus)
         self.user_profiles = {}
         self.alerts = {}
+        # 7/30-day intake statistics, fed by meal_added / meal_deleted messages
+        self.rolling_stats = RollingStatsEngine()
+        self.rolling_stats_loaded = False
+        # Per-user baseline of daily calories; a day is scored when the user logs the next one
+        self.day_detector = AnomalyDetector(alpha=0.2)
+        self.current_days = {}
+        self.day_baselines_loaded = False
+        # Local optimizer for meal suggestions, GPT only phrases its result
+        self.meal_planner = MealPlanner()
 
     async def calculate_calories(self, user_id: int, user_data: Dict):
         try:
@@ -392,11 +868,12 @@ class DietitianAgent(SimpleAgent):
 
             self._save_user_profile(user_id, user_data, calories)
 
-            self.user_profiles[user_id] = {
+            # Keep the meal counters the dietitian already tracks for this user
+            self.user_profiles.setdefault(user_id, {}).update({
                 "calories": calories,
                 "data": user_data,
                 "created": datetime.now().isoformat()
-            }
+            })
 
             return {"status": "success", "calories": calories, "user_data": user_data}
 
@@ -417,6 +894,7 @@ class DietitianAgent(SimpleAgent):
         except (FileNotFoundError, json.JSONDecodeError):
             profiles = {}
 
+        previous = profiles.get(str(user_id)) or {}
         profiles[str(user_id)] = {
             "age": data["age"],
             "gender": data["gender"],
@@ -424,12 +902,39 @@ class DietitianAgent(SimpleAgent):
             "height": data["height"],
             "activity_coefficient": data["activity_coefficient"],
             "calories": calories,
+            "bmi": round(body_mass_index(data["weight"], data["height"]), 1),
             "updated_at": datetime.now().isoformat()
         }
+        # Set separately with /timezone, survives recalculation
+        if previous.get("timezone"):
+            profiles[str(user_id)]["timezone"] = previous["timezone"]
+
+        with open(profile_file, "w", encoding="utf-8") as f:
+            json.dump(profiles, f, ensure_ascii=False, indent=2)
+
+    def set_timezone(self, user_id: int, name: str, lang: str) -> Dict:
+        """Store the user's IANA timezone in their profile; days are counted in it from now on"""
+        profile_file = DATA_DIR / "profiles.json"
+        try:
+            with open(profile_file, "r", encoding="utf-8") as f:
+                profiles = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            profiles = {}
+
+        profile = profiles.get(str(user_id))
+        if not profile:
+            return {"status": "no_profile", "message": catalog.text(lang, "timezone_needs_profile")}
+        if not clock.set_timezone(user_id, name):
+            return {"status": "error", "message": catalog.render(lang, "timezone_invalid", timezone=name)}
 
+        profile["timezone"] = str(clock.zones[user_id])
         with open(profile_file, "w", encoding="utf-8") as f:
             json.dump(profiles, f, ensure_ascii=False, indent=2)
 
+        return {"status": "success", "message": catalog.render(
+            lang, "timezone_set", timezone=profile["timezone"], today=clock.today(user_id).strftime("%d.%m")
+        )}
+
     async def get_recommendations(self, user_id: int, lang: str):
         profile = load_user_profile(user_id)
         if not profile:
@@ -444,9 +949,11 @@ class DietitianAgent(SimpleAgent):
         enhanced_profile = profile.copy()
         if nutrition_data:
             enhanced_profile['recent_nutrition'] = nutrition_data
+        enhanced_profile['trend'] = self.format_trend(user_id, lang)
+        enhanced_profile['alerts'] = self.format_alerts(user_id, lang)
 
         if USE_ORIGINAL_FUNCTIONS:
-            recommendations = self._get_enhanced_nutrition_advice(enhanced_profile, lang)
+            recommendations = await run_blocking(self._get_enhanced_nutrition_advice, enhanced_profile, lang)
         else:
             recommendations = get_nutrition_advice(profile, lang)
 
@@ -458,8 +965,9 @@ class DietitianAgent(SimpleAgent):
             with open(data_file, "r", encoding="utf-8") as f:
                 all_data = json.load(f)
 
-            today = date.today()
+            today = clock.today(user_id)
             today_str = today.strftime("%Y-%m-%d")
+            today_number = day_number(today)
 
             today_entries = []
             total_calories = 0
@@ -468,16 +976,12 @@ class DietitianAgent(SimpleAgent):
             total_carbs = 0
 
             for entry in all_data:
-                try:
-                    entry_date = datetime.strptime(entry["date"], "%Y-%m-%d").date()
-                    if entry_date == today:
-                        today_entries.append(entry)
-                        total_calories += entry.get("calories", 0)
-                        total_protein += entry.get("protein", 0)
-                        total_fat += entry.get("fat", 0)
-                        total_carbs += entry.get("carbs", 0)
-                except (KeyError, ValueError):
-                    continue
+                if entry_day(entry) == today_number and owns_entry(entry, user_id):
+                    today_entries.append(entry)
+                    total_calories += entry.get("calories", 0)
+                    total_protein += entry.get("protein", 0)
+                    total_fat += entry.get("fat", 0)
+                    total_carbs += entry.get("carbs", 0)
 
             if not today_entries:
                 return "User hasn't eaten anything today yet."
@@ -512,6 +1016,8 @@ DETAILED ALL DISHES TODAY:"""
                 calories = enhanced_profile.get('calories', {})
                 target_calories = calories.get('maintain', 2000)
                 today_nutrition = enhanced_profile['recent_nutrition']
+                trend = enhanced_profile.get('trend', '')
+                alerts = enhanced_profile.get('alerts', '')
 
                 if lang == "uk":
                     prompt = f"""Ти - професійний дієтолог. Проаналізуй що користувач з'їв СЬОГОДНІ і дай персональні рекомендації.
@@ -519,6 +1025,8 @@ DETAILED ALL DISHES TODAY:"""
 ЦІЛЬОВИЙ КАЛОРАЖ: {target_calories} ккал/день
 
 {today_nutrition}
+{trend}
+{alerts}
 
 На основі того, що користувач з'їв СЬОГОДНІ, дай конкретні рекомендації:
 
@@ -543,6 +1051,8 @@ DETAILED ALL DISHES TODAY:"""
 TARGET CALORIES: {target_calories} kcal/day
 
 {today_nutrition}
+{trend}
+{alerts}
 
 Based on what the user ate TODAY, provide specific recommendations:
 
@@ -571,35 +1081,43 @@ Be specific and practical. Respond in English."""
 
                 return response.choices[0].message.content.strip()
             else:
-                if lang == "uk":
-                    return f"""💡 **Базові рекомендації:**
+                maintain = enhanced_profile.get('calories', {}).get('maintain', 2000)
+                return catalog.render(lang, "no_meals_advice", maintain=maintain)
 
-🎯 **Ваша денна норма:** {enhanced_profile.get('calories', {}).get('maintain', 2000)} ккал
-
-📝 **Сьогодні ви ще нічого не їли.**
-
-Рекомендую почати день з:
-• Збалансованого сніданку (300-400 ккал)
-• Додайте білки та складні вуглеводи
-• Не забувайте про воду
+        except Exception as e:
+            return get_nutrition_advice(enhanced_profile, lang)
 
-Додайте перші страви через Аналітика, і я дам персональні рекомендації на основі вашого фактичного харчування!"""
-                else:
-                    return f"""💡 **Basic recommendations:**
+    async def plan_meal(self, user_id: int, meal_type: str, day_budget: Optional[Dict], lang: str,
+                        phrase: bool = False):
+        """Meal options that fit what is left of today's budget"""
+        if day_budget is None:
+            return {"status": "no_profile"}
 
-🎯 **Your daily target:** {enhanced_profile.get('calories', {}).get('maintain', 2000)} kcal
+        budget = meal_budget(day_budget["targets"], day_budget["eaten"], meal_type)
+        meal = catalog.labels[meal_type][lang]
+        if budget["calories"] < MIN_MEAL_CALORIES:
+            return {"status": "success", "message": catalog.render(lang, "meal_plan_no_budget", meal=meal)}
 
-📝 **You haven't eaten anything today yet.**
+        plans = self.meal_planner.plan(meal_type, budget)
+        if not plans:
+            return {"status": "success", "message": catalog.text(lang, "meal_plan_empty")}
 
-I recommend starting the day with:
-• Balanced breakfast (300-400 kcal)
-• Add proteins and complex carbs
-• Don't forget about water
+        summary = catalog.render(lang, "meal_plan", meal=meal, **{key: round(value) for key, value in budget.items()})
+        for n, plan in enumerate(plans, 1):
+            summary += catalog.render(lang, "meal_plan_option", n=n, **plan["totals"])
+            for item in plan["items"]:
+                summary += catalog.render(lang, "meal_plan_item", name=item["name"][lang],
+                                          grams=item["grams"], calories=item["calories"])
 
-Add your first meals through Analyst, and I'll give personalized recommendations based on your actual nutrition!"""
+        profile = load_user_profile(user_id) if phrase and USE_ORIGINAL_FUNCTIONS else None
+        if profile:
+            try:
+                summary += "\n\n💬 " + await run_blocking(get_meal_suggestions, profile, meal_type, plans, lang)
+            except Exception:
+                # Phrasing is optional, the plan already has everything
+                pass
 
-        except Exception as e:
-            return get_nutrition_advice(enhanced_profile, lang)
+        return {"status": "success", "summary": summary, "plans": plans}
 
     async def show_profile(self, user_id: int, lang: str):
         profile = load_user_profile(user_id)
@@ -614,51 +1132,117 @@ Add your first meals through Analyst, and I'll give personalized recommendations
 
         if msg_type == "meal_added":
             await self._process_new_meal(data)
+            day = data.get("date") or message.timestamp.strftime("%Y-%m-%d")
+            self.rolling_stats.add_meal(data["user_id"], day, data["kbju"])
+            self._track_day(data["user_id"], day, data["kbju"].get("calories") or 0)
         elif msg_type == "high_calorie_alert":
             await self._handle_high_calorie_alert(data)
         elif msg_type == "analyze_day":
             await self._analyze_daily_intake(data)
         elif msg_type == "meal_deleted":
             await self._process_meal_deletion(data)
+            entry = data.get("deleted_entry", {})
+            self.rolling_stats.add_meal(entry.get("user_id"), entry.get("date"), entry, -1)
+            current = self.current_days.get(entry.get("user_id"))
+            if current and current[0] == entry.get("date"):
+                current[1] -= entry.get("calories") or 0
+        elif msg_type == "meals_reestimated":
+            for correction in data.get("corrections", []):
+                user_id, day = correction["user_id"], correction["date"]
+                self.rolling_stats.add_meal(user_id, day, correction["old"], -1, meals=0)
+                self.rolling_stats.add_meal(user_id, day, correction["new"], meals=0)
+                current = self.current_days.get(user_id)
+                if current and current[0] == day:
+                    current[1] += (correction["new"].get("calories") or 0) - (correction["old"].get("calories") or 0)
 
     async def _process_new_meal(self, data: Dict):
         user_id = data["user_id"]
         analysis = data["analysis"]
 
-        if user_id not in self.user_profiles:
-            self.user_profiles[user_id] = {"meal_count": 0, "last_meals": []}
-
-        self.user_profiles[user_id]["meal_count"] += 1
-        self.user_profiles[user_id]["last_meals"].append({
+        # Profiles from calculate_calories (or older snapshots) may lack the counters
+        profile = self.user_profiles.setdefault(user_id, {})
+        profile["meal_count"] = profile.get("meal_count", 0) + 1
+        last_meals = profile.setdefault("last_meals", [])
+        last_meals.append({
             "kbju": data["kbju"],
             "analysis": analysis,
             "timestamp": datetime.now().isoformat()
         })
+        del last_meals[:-MAX_RECENT_ITEMS]
 
     async def _handle_high_calorie_alert(self, data: Dict):
-        user_id = data["user_id"]
-        calories = data["calories"]
-
-        if user_id not in self.alerts:
-            self.alerts[user_id] = []
-
-        self.alerts[user_id].append({
-            "type": "high_calorie",
-            "calories": calories,
+        # Without a baseline the analyst used the fixed cutoff
+        self._add_alert(data["user_id"], {
+            "type": "meal_high" if data.get("baseline") else "high_calorie",
+            "calories": data["calories"],
             "meal": data["meal"],
-            "timestamp": datetime.now().isoformat()
+            "baseline": data.get("baseline"),
+            "date": data.get("date") or clock.today(data["user_id"]).isoformat()
         })
 
     async def _analyze_daily_intake(self, data: Dict):
+        """Today isn't over, so only an already unusually high total is flagged"""
         user_id = data["user_id"]
-        total_calories = data["total_calories"]
+        day = data.get("date") or clock.today(user_id).isoformat()
+        anomaly = self.day_detector.check(user_id, data["total_calories"])
+
+        if anomaly and anomaly["level"] == "high":
+            self._add_alert(user_id, {
+                "type": "day_high",
+                "calories": round(data["total_calories"]),
+                "baseline": anomaly["baseline"],
+                "date": day
+            })
 
-        if total_calories > 2500:
-            recommendation = "Recommend reducing portions tomorrow"
-        elif total_calories < 1200:
-            recommendation = "Too few calories, add a snack"
-        else:
-            recommendation = "Good calorie balance"
+    def _track_day(self, user_id: int, day: str, calories: float):
+        """Running total of the user's latest day; the previous day is scored once a later one starts"""
+        current = self.current_days.get(user_id)
+        if current is None or day > current[0]:
+            if current is not None:
+                self._close_day(user_id, current[0], current[1])
+            self.current_days[user_id] = [day, calories]
+        elif day == current[0]:
+            current[1] += calories
+
+    def _close_day(self, user_id: int, day: str, calories: float):
+        anomaly = self.day_detector.observe(user_id, calories)
+        if anomaly and anomaly["level"] != "normal":
+            self._add_alert(user_id, {
+                "type": f"day_{anomaly['level']}",
+                "calories": round(calories),
+                "baseline": anomaly["baseline"],
+                "date": day
+            })
+
+    def _add_alert(self, user_id: int, alert: Dict):
+        alerts = self.alerts.setdefault(user_id, [])
+        # A day is flagged once per kind
+        if alert["type"].startswith("day_") and any(
+                a.get("type") == alert["type"] and a.get("date") == alert["date"] for a in alerts):
+            return
+
+        alert["timestamp"] = datetime.now().isoformat()
+        alerts.append(alert)
+        del alerts[:-MAX_RECENT_ITEMS]
+
+    def format_alerts(self, user_id: int, lang: str) -> str:
+        """Alerts for today and yesterday, empty if there are none"""
+        since = (clock.today(user_id) - timedelta(days=1)).strftime("%Y-%m-%d")
+        recent = [alert for alert in self.alerts.get(user_id, [])
+                  if (alert.get("date") or alert.get("timestamp", "")[:10]) >= since]
+        if not recent:
+            return ""
+
+        parts = [catalog.text(lang, "alerts")]
+        for alert in recent[-5:]:
+            parts.append(catalog.render(
+                lang, f"alert_{alert['type']}",
+                meal=alert.get("meal", ""),
+                calories=round(alert.get("calories", 0)),
+                baseline=alert.get("baseline"),
+                date=short_date(alert.get("date") or alert.get("timestamp", "")[:10])
+            ))
+        return "".join(parts)
 
     async def _process_meal_deletion(self, data: Dict):
         user_id = data["user_id"]
@@ -667,42 +1251,315 @@ Add your first meals through Analyst, and I'll give personalized recommendations
             if "meal_count" in self.user_profiles[user_id]:
                 self.user_profiles[user_id]["meal_count"] -= 1
 
+    def format_trend(self, user_id: int, lang: str) -> str:
+        """7 vs 30-day average intake, empty without data"""
+        stats = self.rolling_stats.get(user_id, clock.today(user_id))
+        if not stats:
+            return ""
+
+        week, month = stats[7], stats[30]
+        week_avg, month_avg = week["mean"]["calories"], month["mean"]["calories"]
+        if month_avg and abs(week_avg - month_avg) > month_avg * 0.05:
+            direction = "↗️" if week_avg > month_avg else "↘️"
+        else:
+            direction = "➡️"
+
+        return catalog.render(
+            lang, "trend",
+            direction=direction,
+            week_avg=week_avg,
+            week_std=week["std"]["calories"],
+            week_days=week["days_logged"],
+            month_avg=month_avg,
+            month_std=month["std"]["calories"],
+            month_days=month["days_logged"],
+            protein=week["mean"]["protein"],
+            fat=week["mean"]["fat"],
+            carbs=week["mean"]["carbs"]
+        )
+
+    def get_state(self) -> Dict:
+        return {"user_profiles": self.user_profiles, "alerts": self.alerts,
+                "rolling_stats": self.rolling_stats.get_state(),
+                "day_baselines": self.day_detector.get_state(),
+                "current_days": self.current_days}
+
+    def load_state(self, state: Dict):
+        self.user_profiles = int_keys(state.get("user_profiles", {}))
+        self.alerts = int_keys(state.get("alerts", {}))
+        if "rolling_stats" in state:
+            self.rolling_stats.load_state(state["rolling_stats"])
+            self.rolling_stats_loaded = True
+        if "day_baselines" in state:
+            self.day_detector.load_state(state["day_baselines"])
+            self.current_days = int_keys(state.get("current_days", {}))
+            self.day_baselines_loaded = True
+
+    def seed_day_baselines(self, daily_totals: Dict[str, Dict[int, Dict]]):
+        """Learn daily baselines from the analyst's rollups (state saved before detectors existed)"""
+        self.day_detector.baselines = {}
+        self.current_days = {}
+        for day, users in sorted(daily_totals.items()):
+            for user_id, totals in users.items():
+                if totals["meals"] > 0:
+                    current = self.current_days.get(user_id)
+                    if current is not None:
+                        self.day_detector.observe(user_id, current[1])
+                    self.current_days[user_id] = [day, totals["calories"]]
+
 
 # ============================================================================
 # Coordinator
 # ============================================================================
 
 class SimpleCoordinator:
-    def __init__(self):
-        self.message_bus = SimpleMessageBus()
+    def __init__(self, event_store: EventStore = None):
+        self.event_store = event_store or EventStore(STATE_DIR)
+        self.message_bus = SimpleMessageBus(self.event_store)
         self.agents = {
             "analyst": AnalystAgent(self.message_bus),
             "dietitian": DietitianAgent(self.message_bus)
         }
         self.user_languages = {}
-        self.user_states = {}
+        self.digest_subscribers = set()
+        # user_id -> day number of the last digest sent, so each local evening gets one
+        self.digests_sent = {}
+        # Remaining calories / macros for today, from the analyst's rollups and profile targets
+        self.budgets = BudgetTracker(self.agents["analyst"].get_day_totals)
+        self.sessions = SessionStore(STATE_DIR / "sessions.json")
+
+    def set_user_language(self, user_id: int, lang: str):
+        self.user_languages[user_id] = lang
+        self.event_store.append("language_set", {"user_id": user_id, "lang": lang})
+
+    def toggle_digest(self, user_id: int, lang: str) -> Dict:
+        enabled = user_id not in self.digest_subscribers
+        if enabled:
+            self.digest_subscribers.add(user_id)
+        else:
+            self.digest_subscribers.discard(user_id)
+        self.event_store.append("digest_set", {"user_id": user_id, "enabled": enabled})
+
+        return {"status": "success", "message": catalog.text(lang, "digest_on" if enabled else "digest_off")}
+
+    def due_digests(self, digest_time: time, window: timedelta) -> Dict[int, str]:
+        """Digests of subscribers whose local clock passed `digest_time` less than `window` ago.
+
+        Checked every few minutes, so each timezone gets its digest in its
+        own evening; a user is sent one digest per local day.
+        """
+        due = []
+        for user_id in self.digest_subscribers:
+            now = clock.now(user_id)
+            start = datetime.combine(now.date(), digest_time, now.tzinfo)
+            if start <= now < start + window and self.digests_sent.get(user_id) != day_number(now.date()):
+                due.append(user_id)
+
+        digests = self.build_daily_digests(users=due)
+        for user_id in digests:
+            self.digests_sent[user_id] = clock.day(user_id)
+        return digests
+
+    def build_daily_digests(self, day: date = None, users: List[int] = None) -> Dict[int, str]:
+        """Digest text for every subscriber (or `users`) from one pass over the day's rollup.
+
+        Cost depends on the day's totals and the subscriber count, not on
+        meal history; targets come from a single read of profiles.json.
+        Without `day` each user gets their own local today.
+        """
+        users = self.digest_subscribers if users is None else users
+        if not users:
+            return {}
+
+        # Subscribers share a handful of distinct days, each rollup is looked up once
+        day_totals = {}
+        profiles = load_all_profiles()
+        digests = {}
+
+        for user_id in users:
+            lang = self.user_languages.get(user_id, catalog.default)
+            user_day = day or clock.today(user_id)
+            if user_day not in day_totals:
+                day_totals[user_day] = self.agents["analyst"].get_day_totals(user_day)
+            totals = day_totals[user_day].get(user_id)
+            if not totals or totals["meals"] <= 0:
+                digests[user_id] = catalog.render(lang, "digest_empty", date=user_day.strftime("%d.%m"))
+                continue
+
+            text = catalog.render(
+                lang, "digest",
+                date=user_day.strftime("%d.%m"),
+                meals=totals["meals"],
+                calories=round(totals["calories"]),
+                protein=round(totals["protein"]),
+                fat=round(totals["fat"]),
+                carbs=round(totals["carbs"])
+            )
+
+            target = (profiles.get(user_id) or {}).get("calories", {}).get("maintain")
+            if target:
+                text += catalog.render(
+                    lang, "digest_target",
+                    target=target,
+                    percent=round(totals["calories"] / target * 100),
+                    difference=f"{round(totals['calories'] - target):+d}"
+                )
+            digests[user_id] = text
+
+        return digests
+
+    async def restore_state(self):
+        """Load the latest snapshot and replay the events written after it"""
+        self.sessions.load()
+
+        state = self.event_store.load_snapshot()
+        if state:
+            self._load_state(state)
+
+        self.message_bus.replaying = True
+        try:
+            for record in self.event_store.replay():
+                # One bad event must not keep the bot from starting
+                try:
+                    await self._apply_event(record)
+                except Exception:
+                    logger.exception("Skipping event %s that failed to replay", record.get("kind"))
+        finally:
+            self.message_bus.replaying = False
+
+        profiles = load_all_profiles()
+        clock.load(profiles)
+
+        analyst = self.agents["analyst"]
+        if not analyst.day_numbers_added:
+            analyst.add_day_numbers()
+            analyst.day_numbers_added = True
+        if analyst.daily_totals is None:
+            analyst.rebuild_daily_totals()
+        if not analyst.favorites_loaded:
+            analyst.rebuild_favorites()
+            analyst.favorites_loaded = True
+        if not analyst.portions_loaded:
+            analyst.rebuild_portions()
+            analyst.portions_loaded = True
+        if not analyst.photos_loaded:
+            analyst.rebuild_photos()
+            analyst.photos_loaded = True
+
+        # State saved before rolling stats existed: seed them from the analyst's rollups
+        dietitian = self.agents["dietitian"]
+        if not dietitian.rolling_stats_loaded:
+            dietitian.rolling_stats.seed(analyst.daily_totals)
+            dietitian.rolling_stats_loaded = True
+        if not dietitian.day_baselines_loaded:
+            dietitian.seed_day_baselines(analyst.daily_totals)
+            dietitian.day_baselines_loaded = True
+
+        self.budgets.load_targets(profiles)
+
+    def create_reestimate_job(self, **options) -> Optional[ReestimateJob]:
+        """Background re-estimation of the meal log; None without GPT"""
+        if not USE_ORIGINAL_FUNCTIONS:
+            return None
+        return ReestimateJob(self.agents["analyst"], estimate_kbju, DATA_DIR / "nutrition_data.json",
+                             STATE_DIR / "reestimate.json", **options)
+
+    def snapshot(self):
+        self.event_store.save_snapshot({
+            "agents": {agent_id: agent.get_state() for agent_id, agent in self.agents.items()},
+            "bus": self.message_bus.get_state(),
+            "user_languages": self.user_languages,
+            "digest_subscribers": sorted(self.digest_subscribers),
+            "digests_sent": self.digests_sent
+        })
+        self.sessions.save()
+
+    def _load_state(self, state: Dict):
+        for agent_id, agent_state in state.get("agents", {}).items():
+            if agent_id in self.agents:
+                self.agents[agent_id].load_state(agent_state)
+        self.message_bus.load_state(state.get("bus", {}))
+        self.user_languages = int_keys(state.get("user_languages", {}))
+        self.digest_subscribers = set(state.get("digest_subscribers", []))
+        self.digests_sent = int_keys(state.get("digests_sent", {}))
+
+    async def _apply_event(self, record: Dict):
+        kind = record.get("kind")
+        data = record.get("data", {})
+
+        if kind == "message":
+            message = message_from_dict(data)
+            for agent in self.agents.values():
+                await agent.replay_message(message)
+        elif kind == "language_set":
+            self.user_languages[data["user_id"]] = data["lang"]
+        elif kind == "digest_set":
+            if data["enabled"]:
+                self.digest_subscribers.add(data["user_id"])
+            else:
+                self.digest_subscribers.discard(data["user_id"])
 
     async def route_request(self, user_id: int, action: str, data: Dict):
         await self._process_agent_messages()
 
-        if action in ["add_meal", "daily_summary", "delete_meal", "confirm_delete"]:
-            if action == "add_meal":
-                return await self.agents["analyst"].add_meal(user_id, data["meal_desc"], data["lang"])
+        if self.event_store.needs_snapshot():
+            self.snapshot()
+
+        if action in ["add_meal", "add_photo", "relog_favorite", "favorites", "daily_summary", "weekly_report", "monthly_report",
+                      "delete_meal", "confirm_delete"]:
+            if action in ("add_meal", "add_photo", "relog_favorite"):
+                if action == "add_meal":
+                    result = await self.agents["analyst"].add_meal(user_id, data["meal_desc"], data["lang"])
+                elif action == "add_photo":
+                    result = await self.agents["analyst"].add_photo(
+                        user_id, data["image"], data.get("caption", ""), data.get("meal_type"), data["lang"]
+                    )
+                else:
+                    result = await self.agents["analyst"].relog_favorite(user_id, data["favorite_id"], data["lang"])
+                if result.get("status") == "success":
+                    result["budget"] = self.budgets.format(user_id, data["lang"])
+                return result
+            elif action == "favorites":
+                return await self.agents["analyst"].get_favorites(user_id, data["lang"])
             elif action == "daily_summary":
-                return await self.agents["analyst"].get_daily_summary(user_id, data["lang"])
+                result = await self.agents["analyst"].get_daily_summary(user_id, data["lang"])
+                if result.get("status") == "success":
+                    dietitian = self.agents["dietitian"]
+                    result["summary"] += self.budgets.format(user_id, data["lang"])
+                    result["summary"] += dietitian.format_trend(user_id, data["lang"])
+                    result["summary"] += dietitian.format_alerts(user_id, data["lang"])
+                return result
+            elif action == "weekly_report":
+                return await self.agents["analyst"].get_period_report(user_id, 7, data["lang"])
+            elif action == "monthly_report":
+                return await self.agents["analyst"].get_period_report(user_id, 30, data["lang"])
             elif action == "delete_meal":
                 return await self.agents["analyst"].delete_meal(user_id, data["lang"])
             elif action == "confirm_delete":
-                return await self.agents["analyst"].confirm_delete_meal(user_id, data["index"], data["lang"])
+                return await self.agents["analyst"].confirm_delete_meal(user_id, data["entry_id"], data["lang"])
 
         elif action in ["calculate_calories", "get_recommendations", "show_profile"]:
             if action == "calculate_calories":
-                return await self.agents["dietitian"].calculate_calories(user_id, data["user_data"])
+                result = await self.agents["dietitian"].calculate_calories(user_id, data["user_data"])
+                if result.get("status") == "success":
+                    self.budgets.set_targets(user_id, result["calories"])
+                return result
             elif action == "get_recommendations":
                 return await self.agents["dietitian"].get_recommendations(user_id, data["lang"])
             elif action == "show_profile":
                 return await self.agents["dietitian"].show_profile(user_id, data["lang"])
 
+        elif action == "meal_plan":
+            return await self.agents["dietitian"].plan_meal(
+                user_id, data["meal_type"], self.budgets.get(user_id), data["lang"], data.get("phrase", False)
+            )
+
+        elif action == "toggle_digest":
+            return self.toggle_digest(user_id, data["lang"])
+
+        elif action == "set_timezone":
+            return self.agents["dietitian"].set_timezone(user_id, data["timezone"], data["lang"])
+
         return {"status": "unknown_action"}
 
     async def _process_agent_messages(self):
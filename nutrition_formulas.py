@@ -0,0 +1,83 @@
+from typing import Dict
+
+import numpy as np
+
+# ============================================================================
+# Constants shared by the bot and the batch recompute
+# ============================================================================
+
+ACTIVITY_COEFFICIENTS = {
+    "sedentary": 1.2,
+    "light_activity": 1.375,
+    "moderate_activity": 1.55,
+    "high_activity": 1.725
+}
+
+# Mifflin-St Jeor: 10 * weight + 6.25 * height - 5 * age + gender offset
+BMR_WEIGHT = 10
+BMR_HEIGHT = 6.25
+BMR_AGE = 5
+GENDER_OFFSET = {"male": 5, "female": -161}
+
+CALORIE_DEFICIT = 300       # kcal below maintenance to lose weight
+CALORIE_SURPLUS = 300       # kcal above maintenance to gain weight
+
+# Share of calories from protein / fat / carbs, and kcal per gram
+MACRO_SPLIT = {"protein": 0.25, "fat": 0.30, "carbs": 0.45}
+KCAL_PER_GRAM = {"protein": 4, "fat": 9, "carbs": 4}
+
+# Upper bounds of underweight / normal / overweight, everything above is obesity
+BMI_THRESHOLDS = (18.5, 25, 30)
+BMI_CATEGORIES = ("underweight", "normal", "overweight", "obesity")
+
+
+# ============================================================================
+# Formulas - work on scalars and numpy arrays alike
+# ============================================================================
+
+def gender_offset(gender):
+    """Offset for one gender string or an array of them; anything but "male" counts as female"""
+    if isinstance(gender, str):
+        return GENDER_OFFSET.get(gender, GENDER_OFFSET["female"])
+    return np.where(np.asarray(gender) == "male", GENDER_OFFSET["male"], GENDER_OFFSET["female"])
+
+
+def basal_metabolic_rate(age, gender, weight, height):
+    return BMR_WEIGHT * weight + BMR_HEIGHT * height - BMR_AGE * age + gender_offset(gender)
+
+
+def calorie_targets(age, gender, weight, height, activity_coefficient) -> Dict:
+    """Unrounded bmr / total / maintain / lose / gain"""
+    bmr = basal_metabolic_rate(age, gender, weight, height)
+    total = bmr * activity_coefficient
+    return {
+        "bmr": bmr,
+        "total": total,
+        "maintain": total,
+        "lose": total - CALORIE_DEFICIT,
+        "gain": total + CALORIE_SURPLUS
+    }
+
+
+def daily_targets(calories) -> Dict:
+    """Calories and macro grams for a daily calorie target"""
+    targets = {"calories": calories}
+    for macro, share in MACRO_SPLIT.items():
+        targets[macro] = calories * share / KCAL_PER_GRAM[macro]
+    return targets
+
+
+def body_mass_index(weight, height):
+    return weight / (height / 100) ** 2
+
+
+def bmi_category(bmi):
+    """Index into BMI_CATEGORIES"""
+    index = np.searchsorted(BMI_THRESHOLDS, bmi, side="right")
+    return int(index) if np.ndim(index) == 0 else index
+
+
+def daily_calories(age: int, gender: str, weight: float, height: int, activity_coefficient: float) -> dict:
+    """calories block stored in a profile"""
+    return {key: round(value) for key, value in
+            calorie_targets(age, gender, weight, height, activity_coefficient).items()}
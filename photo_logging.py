@@ -0,0 +1,177 @@
+import io
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+NUTRIENTS = ("calories", "protein", "fat", "carbs")
+
+# What the vision model gets: longest side and JPEG quality. The model's
+# low-detail mode looks at 512 px anyway, so larger uploads only cost time
+MAX_SIDE = 512
+JPEG_QUALITY = 80
+
+# dHash of a 9x8 grayscale thumbnail - 64 bits
+HASH_WIDTH = 8
+# Photos at most this many bits apart are the same meal
+MAX_DISTANCE = 4
+# Hashes remembered per user, least recently used are forgotten first
+MAX_PHOTOS = 200
+
+
+def dhash(picture: Image.Image) -> int:
+    """Difference hash: one bit per horizontally adjacent pixel pair, robust to re-encoding and resizing"""
+    gray = picture.convert("L").resize((HASH_WIDTH + 1, HASH_WIDTH), Image.LANCZOS)
+    pixels = gray.tobytes()
+    value = 0
+    for row in range(HASH_WIDTH):
+        start = row * (HASH_WIDTH + 1)
+        for col in range(HASH_WIDTH):
+            value = (value << 1) | (pixels[start + col] < pixels[start + col + 1])
+    return value
+
+
+def prepare_photo(image: bytes) -> Tuple[bytes, int]:
+    """(downscaled JPEG for the model, perceptual hash)"""
+    with Image.open(io.BytesIO(image)) as picture:
+        # JPEGs are decoded straight at a reduced scale when possible
+        picture.draft("RGB", (MAX_SIDE, MAX_SIDE))
+        picture = ImageOps.exif_transpose(picture).convert("RGB")
+        picture.thumbnail((MAX_SIDE, MAX_SIDE))
+
+        output = io.BytesIO()
+        picture.save(output, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        return output.getvalue(), dhash(picture)
+
+
+# ============================================================================
+# Vision estimators
+# ============================================================================
+
+class VisionEstimator(ABC):
+    """KBJU of the meal in a prepared JPEG. Blocking - called on a worker thread.
+
+    Returns {"dish", "calories", "protein", "fat", "carbs", "analysis"}, or
+    None when the photo couldn't be estimated.
+    """
+
+    @abstractmethod
+    def estimate(self, image: bytes, caption: str, lang: str) -> Optional[Dict]:
+        ...
+
+
+class GPTVisionEstimator(VisionEstimator):
+    def __init__(self):
+        from agents.analyst_agent import estimate_kbju_from_photo
+        self._estimate = estimate_kbju_from_photo
+
+    def estimate(self, image: bytes, caption: str, lang: str) -> Optional[Dict]:
+        return self._estimate(image, caption, lang)
+
+
+class StubVisionEstimator(VisionEstimator):
+    """Fixed answer after a fixed delay - stands in for the model in tests and benchmarks"""
+
+    def __init__(self, kbju: Dict = None, delay: float = 0.0):
+        self.kbju = kbju or {"dish": "stub", "calories": 500, "protein": 25, "fat": 20, "carbs": 55,
+                             "analysis": "stub estimate"}
+        self.delay = delay
+        self.calls = 0
+
+    def estimate(self, image: bytes, caption: str, lang: str) -> Optional[Dict]:
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return dict(self.kbju)
+
+
+def create_vision_estimator(name: str) -> Optional[VisionEstimator]:
+    """Estimator by name - "gpt", "stub" or "off"; None when photos can't be estimated"""
+    if name == "stub":
+        return StubVisionEstimator()
+    if name == "gpt":
+        try:
+            return GPTVisionEstimator()
+        except ImportError:
+            return None
+    return None
+
+
+# ============================================================================
+# Near-duplicate cache
+# ============================================================================
+
+class PhotoCache:
+    """KBJU of each user's recent meal photos by perceptual hash.
+
+    A re-sent or re-shot photo of the same plate lands within a few bits
+    of the original, so it reuses that estimate instead of another vision
+    call. Only model estimates are remembered, never answers that were
+    themselves reused.
+    """
+
+    def __init__(self):
+        # user_id -> hash -> {"dish", "calories", ...}
+        self.users: Dict[int, "OrderedDict[int, Dict]"] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def find(self, user_id: int, photo_hash: int) -> Optional[Tuple[int, Dict, int]]:
+        """(stored hash, stored estimate, distance) of the closest photo within MAX_DISTANCE"""
+        photos = self.users.get(user_id)
+        best = None
+        for stored_hash, estimate in (photos or {}).items():
+            distance = bin(stored_hash ^ photo_hash).count("1")
+            if distance <= MAX_DISTANCE and (best is None or distance < best[2]):
+                best = (stored_hash, estimate, distance)
+
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        photos.move_to_end(best[0])
+        return best
+
+    def learn(self, user_id: int, kbju: Dict):
+        provenance = kbju.get("provenance") or {}
+        if user_id is None or provenance.get("source") != "photo" or "cached_from" in provenance:
+            return
+        photos = self.users.setdefault(user_id, OrderedDict())
+        photo_hash = int(provenance["hash"], 16)
+        photos[photo_hash] = {"dish": provenance.get("dish", ""), **{key: kbju.get(key) or 0 for key in NUTRIENTS}}
+        photos.move_to_end(photo_hash)
+        if len(photos) > MAX_PHOTOS:
+            photos.popitem(last=False)
+
+    def forget(self, user_id: int, entry: Dict):
+        """A deleted photo entry drops its estimate (and the one it was reused from), so a re-send asks the model again"""
+        provenance = entry.get("provenance") or {}
+        photos = self.users.get(user_id)
+        if not photos or provenance.get("source") != "photo":
+            return
+        for key in ("hash", "cached_from"):
+            if provenance.get(key):
+                photos.pop(int(provenance[key], 16), None)
+
+    def seed(self, entries: Iterable[Dict]):
+        """Rebuild from stored entries, oldest first"""
+        self.users = {}
+        for entry in entries:
+            self.learn(entry.get("user_id"), entry)
+
+    def stats(self) -> Dict:
+        return {"photos": sum(len(photos) for photos in self.users.values()), "hits": self.hits, "misses": self.misses}
+
+    def get_state(self) -> Dict:
+        return {
+            str(user_id): [[f"{photo_hash:016x}", estimate] for photo_hash, estimate in photos.items()]
+            for user_id, photos in self.users.items()
+        }
+
+    def load_state(self, state: Dict):
+        self.users = {
+            int(user_id): OrderedDict((int(photo_hash, 16), estimate) for photo_hash, estimate in photos)
+            for user_id, photos in state.items()
+        }
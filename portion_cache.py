@@ -0,0 +1,180 @@
+import math
+import re
+from typing import Dict, Iterable, Optional, Tuple
+
+NUTRIENTS = ("calories", "protein", "fat", "carbs")
+
+# Unit -> (base unit, factor)
+UNITS = {
+    "г": ("g", 1), "гр": ("g", 1), "грам": ("g", 1), "грамів": ("g", 1), "g": ("g", 1), "gr": ("g", 1),
+    "gram": ("g", 1), "grams": ("g", 1), "кг": ("g", 1000), "kg": ("g", 1000),
+    "мл": ("ml", 1), "ml": ("ml", 1), "л": ("ml", 1000), "l": ("ml", 1000)
+}
+
+_QUANTITY = r"(?P<qty>\d+(?:[.,]\d+)?)\s*(?P<unit>[a-zа-яіїєґ]+)\.?"
+_NAME = r"(?P<name>[^\d]+?)"
+PATTERNS = [re.compile(rf"^{_NAME}\s*{_QUANTITY}$"), re.compile(rf"^{_QUANTITY}\s+{_NAME}$")]
+# Descriptions with several items are estimated as a whole, never scaled
+SEPARATORS = re.compile(r"[,;+&]|\s(?:і|й|та|з|із|and|with)\s")
+
+# Scale only within this factor of the smallest / largest portion seen
+MAX_RATIO = 4
+# Calorie density spread (std / mean) up to which an answer is trusted
+HIGH_CV = 0.15
+MEDIUM_CV = 0.30
+HIGH_SAMPLES = 3
+
+
+def strip_meal_type(description: str) -> str:
+    """Drop the "🌅 Сніданок: " prefix the bot adds"""
+    prefix, sep, rest = description.strip().partition(": ")
+    return rest.strip() if sep and len(prefix) < 25 else description.strip()
+
+
+def parse_portion(description: str) -> Optional[Tuple[str, str, float]]:
+    """(item name, base unit, quantity in base units) for a single item with a weight or volume"""
+    text = strip_meal_type(description).lower()
+
+    for pattern in PATTERNS:
+        match = pattern.match(text)
+        if match:
+            break
+    else:
+        return None
+
+    unit = UNITS.get(match.group("unit"))
+    if unit is None or SEPARATORS.search(f" {match.group('name')} "):
+        return None
+    name = " ".join(re.sub(r"[^\w\s%-]", " ", match.group("name")).split())
+    if not name:
+        return None
+
+    base_unit, factor = unit
+    quantity = float(match.group("qty").replace(",", ".")) * factor
+    if quantity <= 0:
+        return None
+    return name, base_unit, quantity
+
+
+# ============================================================================
+# Nutrient densities
+# ============================================================================
+
+class Density:
+    """Per-gram (or per-ml) nutrients of one item, averaged over GPT estimates"""
+
+    __slots__ = ("per_unit", "samples", "m2", "min_qty", "max_qty", "source")
+
+    def __init__(self, per_unit=None, samples: int = 0, m2: float = 0.0, min_qty: float = 0.0,
+                 max_qty: float = 0.0, source: str = ""):
+        self.per_unit = per_unit or [0.0] * len(NUTRIENTS)
+        self.samples = samples
+        # Running sum of squared deviations of calorie density (Welford)
+        self.m2 = m2
+        self.min_qty = min_qty
+        self.max_qty = max_qty
+        self.source = source
+
+    def add(self, quantity: float, kbju: Dict, source: str):
+        self.samples += 1
+        old_mean = self.per_unit[0]
+        for i, key in enumerate(NUTRIENTS):
+            self.per_unit[i] += ((kbju.get(key) or 0) / quantity - self.per_unit[i]) / self.samples
+        self.m2 += ((kbju.get("calories") or 0) / quantity - old_mean) * (
+            (kbju.get("calories") or 0) / quantity - self.per_unit[0])
+        self.min_qty = quantity if self.samples == 1 else min(self.min_qty, quantity)
+        self.max_qty = quantity if self.samples == 1 else max(self.max_qty, quantity)
+        self.source = source
+
+    def replace(self, quantity: float, old: Dict, new: Dict):
+        """Swap one learned sample for its re-estimate; the quantity range doesn't change"""
+        old_mean = self.per_unit[0]
+        for i, key in enumerate(NUTRIENTS):
+            self.per_unit[i] += ((new.get(key) or 0) - (old.get(key) or 0)) / quantity / self.samples
+        old_value = (old.get("calories") or 0) / quantity
+        new_value = (new.get("calories") or 0) / quantity
+        self.m2 = max(self.m2 + (new_value - old_value) * (new_value + old_value - self.per_unit[0] - old_mean), 0.0)
+
+    def confidence(self, quantity: float) -> Optional[str]:
+        """Confidence level, "high" or "medium"; None when scaling isn't trustworthy"""
+        if not self.per_unit[0] or not self.min_qty / MAX_RATIO <= quantity <= self.max_qty * MAX_RATIO:
+            return None
+        cv = math.sqrt(self.m2 / self.samples) / self.per_unit[0] if self.samples > 1 else 0.0
+        if self.samples >= HIGH_SAMPLES and cv <= HIGH_CV:
+            return "high"
+        if cv <= MEDIUM_CV:
+            return "medium"
+        return None
+
+    def to_list(self):
+        return [self.per_unit, self.samples, self.m2, self.min_qty, self.max_qty, self.source]
+
+
+class PortionCache:
+    """Answers "гречка 200г" from earlier estimates of "гречка 300г" by linear scaling.
+
+    Densities are keyed by item name and base unit (g or ml) and learned
+    only from single-item GPT estimates, so scaled answers never feed back
+    into the table.
+    """
+
+    def __init__(self):
+        # "name|unit" -> Density
+        self.densities: Dict[str, Density] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def estimate(self, description: str) -> Optional[Dict]:
+        """Scaled KBJU with provenance, None when GPT has to answer"""
+        portion = parse_portion(description)
+        density = self.densities.get(f"{portion[0]}|{portion[1]}") if portion else None
+        confidence = density.confidence(portion[2]) if density else None
+        if confidence is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        quantity = portion[2]
+        kbju = {key: round(value * quantity) for key, value in zip(NUTRIENTS, density.per_unit)}
+        kbju["provenance"] = {
+            "source": "scaled",
+            "from": density.source,
+            "samples": density.samples,
+            "confidence": confidence
+        }
+        return kbju
+
+    def learn(self, description: str, kbju: Optional[Dict]):
+        if not kbju or "provenance" in kbju or not kbju.get("calories"):
+            return
+        portion = parse_portion(description)
+        if portion is None:
+            return
+        name, unit, quantity = portion
+        density = self.densities.setdefault(f"{name}|{unit}", Density())
+        density.add(quantity, kbju, strip_meal_type(description))
+
+    def correct(self, description: str, old: Dict, new: Dict, learned: bool):
+        """Apply a re-estimate: replace the sample `old` was learned as, or learn `new` if `old` never was"""
+        if not learned or not old.get("calories"):
+            self.learn(description, new)
+            return
+        portion = parse_portion(description)
+        density = self.densities.get(f"{portion[0]}|{portion[1]}") if portion else None
+        if density is not None:
+            density.replace(portion[2], old, new)
+
+    def seed(self, entries: Iterable[Dict]):
+        """Rebuild from stored entries"""
+        self.densities = {}
+        for entry in entries:
+            self.learn(entry.get("description") or "", entry)
+
+    def stats(self) -> Dict:
+        return {"items": len(self.densities), "hits": self.hits, "misses": self.misses}
+
+    def get_state(self) -> Dict:
+        return {key: density.to_list() for key, density in self.densities.items()}
+
+    def load_state(self, state: Dict):
+        self.densities = {key: Density(*values) for key, values in state.items()}
@@ -0,0 +1,291 @@
+"""Local barcode -> nutrition lookup.
+
+    python product_index.py --source products.csv.gz --output data/products.idx
+
+The index is a sorted file of fixed-width records (barcode, KBJU per 100 g,
+serving size, short name). The bot memory-maps it and binary-searches the
+barcode, so a table of millions of products is opened instantly and only
+the ~23 pages touched by a lookup are read from disk.
+
+The source is a CSV / TSV (optionally gzipped) with the columns
+barcode,name,calories,protein,fat,carbs[,serving] - an Open Food Facts
+export works as is.
+"""
+import argparse
+import csv
+import gzip
+import io
+import logging
+import mmap
+import os
+import re
+import struct
+import time
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).parent / "data"
+PRODUCT_INDEX_FILE = DATA_DIR / "products.idx"
+
+MAGIC = b"KBJUIDX1"
+HEADER = struct.Struct("<8sQ")                  # magic, record count
+NAME_BYTES = 54
+RECORD = struct.Struct(f"<Q4fH{NAME_BYTES}s")   # barcode, kcal/protein/fat/carbs per 100 g, serving g, name
+RECORD_DTYPE = np.dtype([
+    ("barcode", "<u8"), ("kbju", "<f4", (4,)), ("serving", "<u2"), ("name", f"S{NAME_BYTES}")
+])
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+NUTRIENTS = ("calories", "protein", "fat", "carbs")
+
+# Source column -> accepted header names (ours first, then Open Food Facts)
+COLUMNS = {
+    "barcode": ("barcode", "code"),
+    "name": ("name", "product_name"),
+    "calories": ("calories", "energy-kcal_100g"),
+    "protein": ("protein", "proteins_100g"),
+    "fat": ("fat", "fat_100g"),
+    "carbs": ("carbs", "carbohydrates_100g"),
+    "serving": ("serving", "serving_quantity")
+}
+
+# EAN-8 / UPC-A / EAN-13 / GTIN-14, optionally followed by the grams eaten
+SCAN_PATTERN = re.compile(r"^(?P<barcode>\d{8,14})(?:\s+(?P<grams>\d+(?:[.,]\d+)?)\s*(?:г|гр|g)?\.?)?$")
+DEFAULT_GRAMS = 100
+MAX_GRAMS = 5000
+
+# Records copied per write when the sorted index is written
+WRITE_CHUNK = 1 << 16
+
+
+def parse_scan(text: str) -> Optional[Tuple[int, Optional[float]]]:
+    """(barcode, grams or None) for "4820000000000" / "4820000000000 150г", None for anything else"""
+    match = SCAN_PATTERN.match(text.strip().lower())
+    if not match:
+        return None
+    grams = match.group("grams")
+    grams = float(grams.replace(",", ".")) if grams else None
+    if grams is not None and not 0 < grams <= MAX_GRAMS:
+        return None
+    # GTINs are compared as numbers, so UPC-A and its zero-padded EAN-13 are the same product
+    return int(match.group("barcode")), grams
+
+
+def upc_e_to_a(code: str) -> str:
+    """12-digit UPC-A of an 8-digit zero-suppressed UPC-E code; the index keys products by the full GTIN"""
+    if len(code) != 8 or code[0] not in "01":
+        return code
+    system, digits, check = code[0], code[1:7], code[7]
+    last = digits[5]
+    if last in "012":
+        body = digits[:2] + last + "0000" + digits[2:5]
+    elif last == "3":
+        body = digits[:3] + "00000" + digits[3:5]
+    elif last == "4":
+        body = digits[:4] + "00000" + digits[4]
+    else:
+        body = digits[:5] + "0000" + last
+    return system + body + check
+
+
+_pyzbar_warned = False
+
+
+def decode_barcode(image: bytes) -> Optional[str]:
+    """Digits of the first EAN/UPC code in a photo; None when there is none or pyzbar isn't installed.
+
+    UPC-E codes come back expanded to UPC-A. A typed 8-digit code is taken
+    as EAN-8 - only the photo tells the two apart.
+    """
+    global _pyzbar_warned
+    try:
+        from PIL import Image
+        from pyzbar.pyzbar import ZBarSymbol, decode
+    except ImportError:
+        if not _pyzbar_warned:
+            logger.warning("pyzbar (and the system zbar library) not installed, barcodes in photos aren't read")
+            _pyzbar_warned = True
+        return None
+
+    with Image.open(io.BytesIO(image)) as picture:
+        picture = picture.convert("L")
+        symbols = [ZBarSymbol.EAN13, ZBarSymbol.EAN8, ZBarSymbol.UPCA, ZBarSymbol.UPCE]
+        for result in decode(picture, symbols=symbols):
+            digits = result.data.decode("ascii", "ignore")
+            if digits.isdigit():
+                return upc_e_to_a(digits) if result.type == "UPCE" else digits
+    return None
+
+
+# ============================================================================
+# Lookup
+# ============================================================================
+
+class ProductIndex:
+    """Read-only view of products.idx"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or HEADER.size + self.count * RECORD.size != len(self._map):
+            self._map.close()
+            raise ValueError(f"{path} is not a product index")
+        if hasattr(self._map, "madvise"):
+            # Lookups jump around the file - don't read ahead
+            self._map.madvise(mmap.MADV_RANDOM)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def open(cls, path: Path = PRODUCT_INDEX_FILE) -> Optional["ProductIndex"]:
+        """None when no index has been built"""
+        try:
+            return cls(path)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.error(e)
+            return None
+
+    def __len__(self):
+        return self.count
+
+    def _barcode_at(self, i: int) -> int:
+        return struct.unpack_from("<Q", self._map, HEADER.size + i * RECORD.size)[0]
+
+    def lookup(self, barcode: int) -> Optional[Dict]:
+        """Product with KBJU per 100 g, None when the barcode is unknown"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._barcode_at(middle) < barcode:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == self.count or self._barcode_at(low) != barcode:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        _, *kbju, serving, name = RECORD.unpack_from(self._map, HEADER.size + low * RECORD.size)
+        return {
+            "barcode": barcode,
+            "name": name.rstrip(b"\0").decode("utf-8", "ignore"),
+            "serving": serving or None,
+            "per_100g": {key: round(value, 1) for key, value in zip(NUTRIENTS, kbju)}
+        }
+
+    def stats(self) -> Dict:
+        return {"products": self.count, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self._map.close()
+
+
+def portion_kbju(product: Dict, grams: float) -> Dict:
+    return {key: round(value * grams / 100) for key, value in product["per_100g"].items()}
+
+
+# ============================================================================
+# Building
+# ============================================================================
+
+def open_source(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def read_products(path: Path) -> Iterator[bytes]:
+    """Packed records from the source file, in file order; rows without a numeric barcode or calories are skipped"""
+    csv.field_size_limit(1 << 24)
+    with open_source(path) as f:
+        header = f.readline()
+        delimiter = "\t" if "\t" in header else ","
+        names = next(csv.reader([header], delimiter=delimiter))
+        positions = {}
+        for column, aliases in COLUMNS.items():
+            found = [names.index(alias) for alias in aliases if alias in names]
+            if found:
+                positions[column] = found[0]
+        missing = {"barcode", "calories"} - positions.keys()
+        if missing:
+            raise ValueError(f"{path}: missing columns {', '.join(sorted(missing))}")
+
+        for row in csv.reader(f, delimiter=delimiter):
+            values = {column: row[i].strip() if i < len(row) else "" for column, i in positions.items()}
+            if not values["barcode"].isdigit() or len(values["barcode"]) > 14:
+                continue
+            try:
+                kbju = [float(values.get(key) or 0) for key in NUTRIENTS]
+            except ValueError:
+                continue
+            try:
+                serving = float(values.get("serving") or 0)
+            except ValueError:
+                serving = 0
+            if not 0 < kbju[0] < 1000 or any(not 0 <= value <= 100 for value in kbju[1:]):
+                continue
+            name = (values.get("name") or "").encode("utf-8")[:NAME_BYTES].decode("utf-8", "ignore")
+            yield RECORD.pack(int(values["barcode"]), *kbju,
+                              int(serving) if 0 < serving < 65536 else 0, name.encode("utf-8"))
+
+
+def build_index(source: Path, output: Path) -> Dict:
+    """Sort by barcode (the last row wins for duplicates) and write atomically"""
+    output.parent.mkdir(parents=True, exist_ok=True)
+    unsorted_file = output.with_name(output.name + ".unsorted")
+    tmp_output = output.with_name(output.name + ".part")
+
+    # Records go to disk first so the sort only holds the barcode column in memory
+    rows = 0
+    with open(unsorted_file, "wb") as f:
+        for record in read_products(source):
+            f.write(record)
+            rows += 1
+
+    try:
+        records = np.memmap(unsorted_file, dtype=RECORD_DTYPE, mode="r") if rows else np.empty(0, RECORD_DTYPE)
+        order = np.argsort(records["barcode"], kind="stable")
+        barcodes = records["barcode"][order]
+        keep = np.append(barcodes[1:] != barcodes[:-1], True) if rows else np.empty(0, bool)
+        order = order[keep]
+
+        with open(tmp_output, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(order)))
+            for start in range(0, len(order), WRITE_CHUNK):
+                f.write(records[order[start:start + WRITE_CHUNK]].tobytes())
+        del records
+        os.replace(tmp_output, output)
+    finally:
+        unsorted_file.unlink(missing_ok=True)
+
+    return {"rows": rows, "products": int(len(order))}
+
+
+# ============================================================================
+# Entry point
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the barcode index from a product nutrition table")
+    parser.add_argument("--source", type=Path, required=True, help="CSV / TSV, optionally .gz")
+    parser.add_argument("--output", type=Path, default=PRODUCT_INDEX_FILE)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    started = time.monotonic()
+    result = build_index(args.source, args.output)
+    logger.info(f"{result['products']} products from {result['rows']} rows written to {args.output} "
+                f"in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import time
+
+
+# ============================================================================
+# Rate limiting
+# ============================================================================
+
+class TokenBucket:
+    """`rate` tokens per second, bursts up to `capacity`"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Take a token; returns how many seconds to wait before using it"""
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
@@ -0,0 +1,124 @@
+"""Recompute calorie targets and BMI of every stored profile.
+
+    python recompute_profiles.py [--dry-run]
+
+Run after changing the constants in nutrition_formulas.py. All profiles are
+loaded into arrays, the formulas are evaluated once over the arrays, and
+profiles.json is rewritten in a single atomic replace. Profiles with
+missing or invalid fields are left as they are.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+
+from nutrition_formulas import body_mass_index, calorie_targets
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).parent / "data"
+PROFILES_FILE = DATA_DIR / "profiles.json"
+
+FIELDS = ("age", "weight", "height", "activity_coefficient")
+TARGETS = ("bmr", "total", "maintain", "lose", "gain")
+
+
+# ============================================================================
+# Loading
+# ============================================================================
+
+def load_profiles(path: Path) -> Dict[str, Dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read().strip()
+        return json.loads(content) if content else {}
+    except FileNotFoundError:
+        return {}
+
+
+# ============================================================================
+# Recompute
+# ============================================================================
+
+def recompute(profiles: Dict[str, Dict]) -> Dict:
+    """Update profiles in place, return counts"""
+    keys, rows, genders = [], [], []
+    for key, profile in profiles.items():
+        try:
+            rows.append([float(profile[field]) for field in FIELDS])
+        except (KeyError, TypeError, ValueError):
+            continue
+        keys.append(key)
+        genders.append(profile.get("gender"))
+
+    columns = np.array(rows, dtype=np.float64).reshape(-1, len(FIELDS))
+    valid = (columns > 0).all(axis=1) & np.isfinite(columns).all(axis=1)
+    keys = [key for key, ok in zip(keys, valid) if ok]
+    if not keys:
+        return {"profiles": len(profiles), "recomputed": 0, "changed": 0}
+
+    columns = dict(zip(FIELDS, columns[valid].T))
+    genders = np.array(genders, dtype=object)[valid]
+
+    targets = calorie_targets(
+        columns["age"], genders, columns["weight"], columns["height"], columns["activity_coefficient"]
+    )
+    rounded = np.rint(np.column_stack([targets[name] for name in TARGETS])).astype(np.int64).tolist()
+    bmi = body_mass_index(columns["weight"], columns["height"]).tolist()
+
+    changed = 0
+    for key, values, profile_bmi in zip(keys, rounded, bmi):
+        profile = profiles[key]
+        calories = dict(zip(TARGETS, values))
+        # round() rather than np.round so halves match what the bot stores
+        profile_bmi = round(profile_bmi, 1)
+        if profile.get("calories") != calories or profile.get("bmi") != profile_bmi:
+            changed += 1
+        profile["calories"] = calories
+        profile["bmi"] = profile_bmi
+
+    return {"profiles": len(profiles), "recomputed": len(keys), "changed": changed}
+
+
+def write_profiles(profiles: Dict[str, Dict], path: Path):
+    """One profile per line: indent=2 falls back to the pure-Python encoder and is several times slower"""
+    tmp_file = path.with_suffix(".tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        f.write("{\n")
+        f.write(",\n".join(
+            f"  {json.dumps(key)}: {json.dumps(profile, ensure_ascii=False)}" for key, profile in profiles.items()
+        ))
+        f.write("\n}\n")
+    os.replace(tmp_file, path)
+
+
+# ============================================================================
+# Entry point
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute calorie targets and BMI for all profiles")
+    parser.add_argument("--profiles", type=Path, default=PROFILES_FILE)
+    parser.add_argument("--dry-run", action="store_true", help="count changes without writing")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    started = time.monotonic()
+    profiles = load_profiles(args.profiles)
+    # Millions of loaded dicts never become garbage - keep the collector from rescanning them
+    gc.freeze()
+    result = recompute(profiles)
+    if result["changed"] and not args.dry_run:
+        write_profiles(profiles, args.profiles)
+    logger.info(f"{result['recomputed']}/{result['profiles']} profiles recomputed, {result['changed']} changed"
+                f"{' (dry run)' if args.dry_run else ''} in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
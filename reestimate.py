@@ -0,0 +1,211 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import date, datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+from meal_log import iter_entries
+from rate_limit import TokenBucket
+from user_time import day_number, entry_day
+
+logger = logging.getLogger(__name__)
+
+NUTRIENTS = ("calories", "protein", "fat", "carbs")
+
+# Exact values that a new prompt or model can't improve; photos aren't kept.
+# Low-confidence (typo-tolerant) food table matches are re-estimated
+SKIP_SOURCES = {"barcode", "food_table", "photo"}
+
+# Seconds between checks while live requests are waiting
+BUSY_WAIT = 1.0
+
+
+def entry_key(entry: Dict) -> Optional[str]:
+    """Entries from before IDs existed are matched by their timestamp"""
+    return entry.get("id") or entry.get("timestamp")
+
+
+def needs_estimate(entry: Dict, first_day: int, last_day: int) -> bool:
+    provenance = entry.get("provenance") or {}
+    return (first_day <= entry_day(entry) <= last_day and bool(entry.get("description"))
+            and entry_key(entry) is not None
+            and (provenance.get("source") not in SKIP_SOURCES or provenance.get("confidence") == "low"))
+
+
+# ============================================================================
+# Bulk re-estimation
+# ============================================================================
+
+class ReestimateJob:
+    """Re-runs KBJU estimation over the meal log for a date range, in the background of the bot.
+
+    Entries are read from a copy of the log taken at start (the bot rewrites
+    the log in place on every save) and estimated `concurrency` at a time,
+    paced by their own rate budget and paused while live requests are
+    queued. Each batch is written back with one rewrite of the log - the
+    same cost as saving one meal - and then checkpointed, so a restart
+    resumes after the last written batch.
+    """
+
+    def __init__(self, analyst, estimate: Callable[[str, str], Optional[Dict]], data_file: Path, checkpoint_file: Path,
+                 concurrency: int = 2, rate: float = 1.0, batch_size: int = 200,
+                 is_busy: Callable[[], bool] = None, lang: str = "uk"):
+        self.analyst = analyst
+        self.estimate = estimate
+        self.data_file = data_file
+        self.source_file = checkpoint_file.with_name(checkpoint_file.stem + "_source.json")
+        self.checkpoint_file = checkpoint_file
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, max(1.0, rate))
+        self.batch_size = batch_size
+        self.is_busy = is_busy or (lambda: False)
+        self.lang = lang
+        self.state: Optional[Dict] = self.load_checkpoint()
+        self._task: Optional[asyncio.Task] = None
+
+    # ------------------------------------------------------------------------
+    # Checkpoint
+    # ------------------------------------------------------------------------
+
+    def load_checkpoint(self) -> Optional[Dict]:
+        try:
+            with open(self.checkpoint_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save_checkpoint(self):
+        self.checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.checkpoint_file.with_suffix(".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    # ------------------------------------------------------------------------
+    # Control
+    # ------------------------------------------------------------------------
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, date_from: str = None, date_to: str = None) -> bool:
+        """Start a new range, or resume the checkpointed one when no range is given; False if nothing to do"""
+        if self.running:
+            return False
+        if date_from is not None:
+            if not (self.state and self.state["from"] == date_from and self.state["to"] == date_to
+                    and not self.state["finished"]):
+                self.state = {"from": date_from, "to": date_to, "watermark": "", "finished": False,
+                              "processed": 0, "changed": 0, "failed": 0, "started_at": datetime.now().isoformat()}
+                self.save_checkpoint()
+        elif not self.state or self.state["finished"]:
+            return False
+        self.state.pop("error", None)
+
+        self._task = asyncio.create_task(self._run())
+        return True
+
+    async def stop(self):
+        """Cancel; the batch in progress is estimated again on resume"""
+        if self.running:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        if not self.state:
+            return {"status": "idle"}
+        if self.running:
+            status = "running"
+        elif self.state["finished"]:
+            status = "finished"
+        else:
+            status = "failed" if self.state.get("error") else "paused"
+        stats = {"status": status, **{key: self.state[key] for key in
+                                      ("from", "to", "processed", "changed", "failed", "watermark")}}
+        if self.state.get("error"):
+            stats["error"] = self.state["error"]
+        return stats
+
+    # ------------------------------------------------------------------------
+    # Work
+    # ------------------------------------------------------------------------
+
+    def _pending(self) -> Iterator[Dict]:
+        """Entries of the range after the checkpoint, in log order (= timestamp order)"""
+        watermark = self.state["watermark"]
+        first_day = day_number(date.fromisoformat(self.state["from"]))
+        last_day = day_number(date.fromisoformat(self.state["to"]))
+        for entry in iter_entries(self.source_file):
+            if needs_estimate(entry, first_day, last_day) and (entry.get("timestamp") or "") > watermark:
+                yield entry
+
+    async def _estimate_one(self, entry: Dict, semaphore: asyncio.Semaphore) -> Optional[Dict]:
+        async with semaphore:
+            while self.is_busy():
+                await asyncio.sleep(BUSY_WAIT)
+            delay = self.bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                kbju = await asyncio.to_thread(self.estimate, entry["description"], self.lang)
+            except Exception as e:
+                logger.warning(f"Re-estimate of {entry_key(entry)} failed: {e}")
+                return None
+            if not kbju or any(key not in kbju for key in NUTRIENTS):
+                return None
+            return {key: kbju[key] for key in NUTRIENTS}
+
+    async def _run(self):
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        logger.info(f"Re-estimating {self.state['from']}..{self.state['to']} after '{self.state['watermark']}'")
+
+        try:
+            # Copied in the event loop, so no save can happen halfway through
+            shutil.copyfile(self.data_file, self.source_file)
+            batch: List[Dict] = []
+            for entry in self._pending():
+                batch.append(entry)
+                if len(batch) >= self.batch_size:
+                    await self._process_batch(batch, semaphore)
+                    batch = []
+            if batch:
+                await self._process_batch(batch, semaphore)
+        except Exception as e:
+            # Kept in the checkpoint so /reestimate and /stats show why it stopped; start() again retries
+            logger.exception("Re-estimate stopped")
+            self.state["error"] = f"{type(e).__name__}: {e}"
+            try:
+                self.save_checkpoint()
+            except OSError:
+                pass
+            return
+        finally:
+            self.source_file.unlink(missing_ok=True)
+
+        self.state["finished"] = True
+        self.save_checkpoint()
+        logger.info(f"Re-estimate finished: {self.state['processed']} entries, {self.state['changed']} changed, "
+                    f"{self.state['failed']} failed in {time.monotonic() - started:.0f}s")
+
+    async def _process_batch(self, batch: List[Dict], semaphore: asyncio.Semaphore):
+        results = await asyncio.gather(*(self._estimate_one(entry, semaphore) for entry in batch))
+
+        estimates = {}
+        for entry, kbju in zip(batch, results):
+            if kbju is None:
+                self.state["failed"] += 1
+            elif any(kbju[key] != entry.get(key) for key in NUTRIENTS):
+                estimates[entry_key(entry)] = kbju
+
+        changed = await self.analyst.apply_reestimates(estimates) if estimates else 0
+
+        self.state["processed"] += len(batch)
+        self.state["changed"] += changed
+        self.state["watermark"] = max(self.state["watermark"], *(entry.get("timestamp") or "" for entry in batch))
+        self.save_checkpoint()
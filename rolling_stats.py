@@ -0,0 +1,147 @@
+import math
+from datetime import date
+from typing import Dict, List, Optional
+
+NUTRIENTS = ("calories", "protein", "fat", "carbs")
+WINDOWS = (7, 30)
+MAX_WINDOW = max(WINDOWS)
+
+
+# ============================================================================
+# Rolling per-user statistics
+# ============================================================================
+
+class UserRollingStats:
+    """Daily totals of one user over the last 30 days with running sums.
+
+    Statistics are over days with at least one meal. Adding or removing a
+    meal is O(1); moving to a new day subtracts the days that left each
+    window, and each day leaves a window once.
+    """
+
+    __slots__ = ("days", "today", "sums", "squares", "logged")
+
+    def __init__(self):
+        # day ordinal -> [meals, calories, protein, fat, carbs]
+        self.days: Dict[int, List[float]] = {}
+        self.today = 0
+        self.sums = {window: [0.0] * len(NUTRIENTS) for window in WINDOWS}
+        self.squares = {window: [0.0] * len(NUTRIENTS) for window in WINDOWS}
+        self.logged = {window: 0 for window in WINDOWS}
+
+    def _in_window(self, day: int, window: int, today: int = None) -> bool:
+        today = self.today if today is None else today
+        return today - window < day <= today
+
+    def advance(self, today: int):
+        if today <= self.today:
+            return
+
+        for day, values in list(self.days.items()):
+            for window in WINDOWS:
+                if self._in_window(day, window) and not self._in_window(day, window, today):
+                    self._apply_window(window, values, -1)
+            if day <= today - MAX_WINDOW:
+                del self.days[day]
+        self.today = today
+
+    def _apply_window(self, window: int, values: List[float], sign: int):
+        sums = self.sums[window]
+        squares = self.squares[window]
+        for i in range(len(NUTRIENTS)):
+            sums[i] += sign * values[i + 1]
+            squares[i] += sign * values[i + 1] ** 2
+        self.logged[window] += sign
+
+    def add(self, day: int, meal: Dict, sign: int = 1, meals: int = 1):
+        """Add (sign=1) or remove (sign=-1) `meals` meals with these totals eaten on `day`"""
+        self.advance(day)
+        if day <= self.today - MAX_WINDOW or day > self.today:
+            return
+
+        old = self.days.get(day)
+        if old is None:
+            if sign < 0:
+                return
+            old = [0] + [0.0] * len(NUTRIENTS)
+        new = [old[0] + sign * meals] + [old[i + 1] + sign * (meal.get(key) or 0) for i, key in enumerate(NUTRIENTS)]
+
+        for window in WINDOWS:
+            if not self._in_window(day, window):
+                continue
+            # Replace the day's contribution: sums/squares/logged stay exact
+            if old[0] > 0:
+                self._apply_window(window, old, -1)
+            if new[0] > 0:
+                self._apply_window(window, new, 1)
+
+        if new[0] > 0:
+            self.days[day] = new
+        else:
+            self.days.pop(day, None)
+
+    def window_stats(self, window: int) -> Dict:
+        n = self.logged[window]
+        stats = {"days_logged": n, "mean": {}, "std": {}}
+        for i, key in enumerate(NUTRIENTS):
+            mean = self.sums[window][i] / n if n else 0.0
+            variance = self.squares[window][i] / n - mean ** 2 if n else 0.0
+            stats["mean"][key] = round(mean)
+            stats["std"][key] = round(math.sqrt(max(variance, 0.0)))
+        return stats
+
+    def to_dict(self) -> Dict:
+        return {"today": self.today, "days": {str(day): values for day, values in self.days.items()}}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "UserRollingStats":
+        """Running sums are recomputed from the stored days"""
+        stats = cls()
+        stats.today = data.get("today", 0)
+        stats.days = {int(day): values for day, values in data.get("days", {}).items()}
+        for day, values in stats.days.items():
+            for window in WINDOWS:
+                if stats._in_window(day, window):
+                    stats._apply_window(window, values, 1)
+        return stats
+
+
+class RollingStatsEngine:
+    """7/30-day sums, means and variances of daily intake for every user"""
+
+    def __init__(self):
+        self.users: Dict[int, UserRollingStats] = {}
+
+    def add_meal(self, user_id: int, day: str, meal: Dict, sign: int = 1, meals: int = 1):
+        if user_id is None or not day:
+            return
+        stats = self.users.get(user_id)
+        if stats is None:
+            if sign < 0:
+                return
+            stats = self.users[user_id] = UserRollingStats()
+        stats.add(date.fromisoformat(day).toordinal(), meal, sign, meals)
+
+    def seed(self, daily_totals: Dict[str, Dict[int, Dict]]):
+        """Rebuild from the analyst's daily rollups"""
+        self.users = {}
+        for day, users in sorted(daily_totals.items()):
+            for user_id, totals in users.items():
+                if totals["meals"] > 0:
+                    self.add_meal(user_id, day, totals, meals=totals["meals"])
+
+    def get(self, user_id: int, today: date = None) -> Optional[Dict]:
+        """{7: window stats, 30: window stats} as of today, None without data"""
+        stats = self.users.get(user_id)
+        if stats is None:
+            return None
+        stats.advance((today or date.today()).toordinal())
+        if not stats.logged[MAX_WINDOW]:
+            return None
+        return {window: stats.window_stats(window) for window in WINDOWS}
+
+    def get_state(self) -> Dict:
+        return {str(user_id): stats.to_dict() for user_id, stats in self.users.items()}
+
+    def load_state(self, state: Dict):
+        self.users = {int(user_id): UserRollingStats.from_dict(data) for user_id, data in state.items()}
@@ -0,0 +1,116 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+
+# ============================================================================
+# Per-user conversation state
+# ============================================================================
+
+class UserSession:
+    """State of one multi-step flow (add meal, calorie calculation)"""
+
+    __slots__ = ("state", "meal_type", "age", "weight", "height", "gender", "touched")
+
+    def __init__(self, state: str = None):
+        self.state = state
+        self.meal_type = None
+        self.age = None
+        self.weight = None
+        self.height = None
+        self.gender = None
+        self.touched = time.time()
+
+    def to_dict(self) -> Dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__ if getattr(self, slot) is not None}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "UserSession":
+        session = cls()
+        for slot, value in data.items():
+            if slot in cls.__slots__:
+                setattr(session, slot, value)
+        return session
+
+
+class SessionStore:
+    """Sessions exist only while a flow is in progress - idle users cost nothing.
+
+    Abandoned flows expire after `ttl` seconds; lookups sweep them out at
+    most every `sweep_interval` seconds, so users who never come back don't
+    pile up. With a `path`, sessions are saved on shutdown and reloaded on
+    start so a deploy doesn't break a flow.
+    """
+
+    def __init__(self, path: Path = None, ttl: float = 30 * 60, sweep_interval: float = 60):
+        self.path = Path(path) if path else None
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.sessions: Dict[int, UserSession] = {}
+        self.swept = time.time()
+
+    def get(self, user_id: int) -> Optional[UserSession]:
+        if time.time() - self.swept > self.sweep_interval:
+            self.expire()
+
+        session = self.sessions.get(user_id)
+        if session is None:
+            return None
+
+        if time.time() - session.touched > self.ttl:
+            del self.sessions[user_id]
+            return None
+
+        return session
+
+    def get_state(self, user_id: int) -> Optional[str]:
+        session = self.get(user_id)
+        return session.state if session else None
+
+    def set_state(self, user_id: int, state: str) -> UserSession:
+        session = self.get(user_id)
+        if session is None:
+            session = UserSession()
+            self.sessions[user_id] = session
+
+        session.state = state
+        session.touched = time.time()
+        return session
+
+    def clear(self, user_id: int):
+        self.sessions.pop(user_id, None)
+
+    def expire(self):
+        self.swept = time.time()
+        deadline = self.swept - self.ttl
+        expired = [user_id for user_id, session in self.sessions.items() if session.touched < deadline]
+        for user_id in expired:
+            del self.sessions[user_id]
+
+    def load(self):
+        if not self.path:
+            return
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+
+        self.sessions = {int(user_id): UserSession.from_dict(session) for user_id, session in data.items()}
+        self.expire()
+
+    def save(self):
+        if not self.path:
+            return
+
+        self.expire()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.path.with_suffix(".tmp")
+
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({str(user_id): session.to_dict() for user_id, session in self.sessions.items()},
+                      f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_file, self.path)
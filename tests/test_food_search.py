@@ -0,0 +1,50 @@
+import pytest
+
+from food_search import FoodSearch
+
+
+@pytest.fixture(scope="module")
+def search():
+    return FoodSearch()
+
+
+@pytest.mark.parametrize("description", ["beer 500ml", "beet 100g", "cake 100g", "paste 20g", "ріс 100г"])
+def test_short_near_misses_are_not_matched(search, description):
+    assert search.estimate(description) is None
+
+
+@pytest.mark.parametrize("description, food", [
+    ("beef 100g", "beef"),
+    ("hake 150g", "hake"),
+    ("pasta 200g", "pasta"),
+])
+def test_exact_names_are_high_confidence(search, description, food):
+    provenance = search.estimate(description)["provenance"]
+    assert provenance["food"] == food
+    assert provenance["confidence"] == "high"
+
+
+@pytest.mark.parametrize("description, food", [
+    ("молко нежирне 200 мл", "skim_milk"),
+    ("chiken breast 150 g", "chicken"),
+])
+def test_typos_are_low_confidence(search, description, food):
+    provenance = search.estimate(description)["provenance"]
+    assert provenance["food"] == food
+    assert provenance["distance"] > 0
+    assert provenance["confidence"] == "low"
+
+
+def test_volume_needs_a_density(search):
+    assert search.estimate("гречка 200 мл") is None
+    kefir = search.estimate("кефір 1л")
+    assert kefir["calories"] == round(40 * 1000 * 1.03 / 100)
+
+
+def test_stats_count_only_matches():
+    search = FoodSearch()
+    search.estimate("beer 500ml")
+    search.estimate("гречка 200 мл")
+    search.estimate("chiken breast 150 g")
+    assert search.stats()["hits"] == 1
+    assert search.stats()["misses"] == 2
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+import multiagent_core
+from event_store import EventStore
+from multiagent_core import SimpleCoordinator
+
+USER_ID = 42
+USER_DATA = {"age": 30, "gender": "male", "weight": 80, "height": 180, "activity_coefficient": 1.55}
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(multiagent_core, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(multiagent_core, "STATE_DIR", tmp_path / "state")
+    return tmp_path
+
+
+def start(data_dir) -> SimpleCoordinator:
+    coordinator = SimpleCoordinator(EventStore(data_dir / "state"))
+    asyncio.run(coordinator.restore_state())
+    return coordinator
+
+
+def test_meal_after_profile_survives_restart(data_dir):
+    coordinator = start(data_dir)
+    result = asyncio.run(coordinator.route_request(USER_ID, "calculate_calories", {"user_data": USER_DATA}))
+    assert result["status"] == "success"
+    coordinator.snapshot()
+
+    result = asyncio.run(coordinator.route_request(USER_ID, "add_meal", {"meal_desc": "beef 100g", "lang": "en"}))
+    assert result["status"] == "success"
+    coordinator.event_store.close()
+
+    restarted = start(data_dir)
+    profile = restarted.agents["dietitian"].user_profiles[USER_ID]
+    assert profile["calories"] == multiagent_core.load_all_profiles()[USER_ID]["calories"]
+    assert profile["meal_count"] == 1
+    assert len(profile["last_meals"]) == 1
+
@@ -0,0 +1,77 @@
+import asyncio
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+# ============================================================================
+# Concurrent update processing
+# ============================================================================
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Run updates of different users in parallel, updates of one user in order.
+
+    Each user has a FIFO lock that is taken before a concurrency slot, so a
+    user waiting on their own previous update doesn't hold a slot that
+    another user could use.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._user_locks: Dict[int, asyncio.Lock] = {}
+        self._user_pending: Dict[int, int] = {}
+        self.in_flight = 0
+        self.processed = 0
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        user_id = self._user_id(update)
+        if user_id is None:
+            await super().process_update(update, coroutine)
+            return
+
+        lock = self._user_locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._user_locks[user_id] = lock
+        self._user_pending[user_id] = self._user_pending.get(user_id, 0) + 1
+
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            self._user_pending[user_id] -= 1
+            if not self._user_pending[user_id]:
+                # Nobody queued behind us - drop the lock so idle users cost nothing
+                del self._user_pending[user_id]
+                del self._user_locks[user_id]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        self.in_flight += 1
+        try:
+            await coroutine
+        finally:
+            self.in_flight -= 1
+            self.processed += 1
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> Dict:
+        pending = sum(self._user_pending.values())
+        return {
+            "max_concurrent_updates": self.max_concurrent_updates,
+            "in_flight": self.in_flight,
+            "waiting": max(pending - self.in_flight, 0),
+            "active_users": len(self._user_locks),
+            "processed": self.processed
+        }
+
+    @staticmethod
+    def _user_id(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_user:
+            return update.effective_user.id
+        return None
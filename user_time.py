@@ -0,0 +1,78 @@
+import os
+from datetime import date, datetime, tzinfo
+from typing import Dict, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Zone of users who haven't set one, e.g. "Europe/Kyiv"; empty = the server's local time
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "")
+
+
+def get_timezone(name: str) -> Optional[tzinfo]:
+    """IANA zone by name ("Europe/Kyiv"), None when unknown"""
+    try:
+        return ZoneInfo(name.strip())
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def day_number(day: date) -> int:
+    """Days since 0001-01-01 - the integer day key stored in entries, same as rolling stats use"""
+    return day.toordinal()
+
+
+def entry_day(entry: Dict) -> int:
+    """Day number of a meal entry; entries logged before day numbers existed parse their date, 0 if it has none"""
+    day = entry.get("day")
+    if day is not None:
+        return day
+    try:
+        return date.fromisoformat(entry["date"]).toordinal()
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
+# ============================================================================
+# Per-user day boundaries
+# ============================================================================
+
+class UserClock:
+    """Each user's local date, from the timezone kept in their profile.
+
+    A meal belongs to the day it was eaten on where the user is, so a late
+    dinner in New York doesn't land on tomorrow in Kyiv. Zones are cached
+    per user and replaced when the profile changes.
+    """
+
+    def __init__(self, default: str = DEFAULT_TIMEZONE):
+        self.default: Optional[tzinfo] = get_timezone(default) if default else None
+        self.zones: Dict[int, tzinfo] = {}
+
+    def load(self, profiles: Dict[int, Dict]):
+        self.zones = {}
+        for user_id, profile in profiles.items():
+            if profile.get("timezone"):
+                self.set_timezone(user_id, profile["timezone"])
+
+    def set_timezone(self, user_id: int, name: str) -> bool:
+        zone = get_timezone(name)
+        if zone is None:
+            return False
+        self.zones[user_id] = zone
+        return True
+
+    def timezone_name(self, user_id: int) -> str:
+        zone = self.zones.get(user_id, self.default)
+        return str(zone) if zone is not None else datetime.now().astimezone().tzname()
+
+    def now(self, user_id: int) -> datetime:
+        # Without a zone: naive server-local time
+        return datetime.now(self.zones.get(user_id, self.default))
+
+    def today(self, user_id: int) -> date:
+        return self.now(user_id).date()
+
+    def day(self, user_id: int) -> int:
+        return day_number(self.today(user_id))
+
+
+clock = UserClock()
@@ -0,0 +1,143 @@
+import asyncio
+import hmac
+import json
+import logging
+from typing import Dict, Optional
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+MAX_BODY_SIZE = 1024 * 1024
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large"
+}
+
+
+# ============================================================================
+# Minimal HTTP endpoint for Telegram webhooks
+# ============================================================================
+
+class WebhookServer:
+    """Accepts Telegram update POSTs and puts them on the application's update queue.
+
+    Any client can POST a recorded update payload, which makes it easy to
+    benchmark per-message latency locally without Telegram in the loop.
+    """
+
+    def __init__(self, application, listen: str = "0.0.0.0", port: int = 8443,
+                 path: str = "/telegram", secret_token: Optional[str] = None):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.received = 0
+        self.rejected = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        logger.info(f"Webhook listening on {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def stats(self) -> Dict:
+        return {"received": self.received, "rejected": self.rejected}
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            keep_alive = True
+            while keep_alive:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+
+                try:
+                    length = int(headers.get("content-length", "0") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    self.rejected += 1
+                    await self._respond(writer, 400, keep_alive=False)
+                    break
+                if length > MAX_BODY_SIZE:
+                    self.rejected += 1
+                    await self._respond(writer, 413, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status = await self._handle_request(method, target, headers, body)
+                await self._respond(writer, status, keep_alive)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Webhook connection error: {e}")
+        finally:
+            writer.close()
+
+    async def _handle_request(self, method: str, target: str, headers: Dict, body: bytes) -> int:
+        if target.split("?", 1)[0] != self.path:
+            self.rejected += 1
+            return 404
+
+        if method != "POST":
+            self.rejected += 1
+            return 405
+
+        if self.secret_token and not hmac.compare_digest(headers.get(SECRET_HEADER, ""), self.secret_token):
+            self.rejected += 1
+            return 403
+
+        try:
+            payload = json.loads(body)
+            if not isinstance(payload, dict):
+                raise ValueError("payload is not a JSON object")
+            update = Update.de_json(payload, self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Invalid webhook payload: {e}")
+            self.rejected += 1
+            return 400
+
+        # Same path as polling: update processor keeps per-user ordering
+        await self.application.update_queue.put(update)
+        self.received += 1
+        return 200
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, keep_alive: bool):
+        head = (
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+            f"Content-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1"))
+        await writer.drain()